@@ -20,6 +20,8 @@ sudo apt-get install -y python3-serial
 sudo apt-get install -y python3-flask
 sudo apt-get install -y python3-picamera2
 sudo apt-get install -y python3-waitress
+sudo apt-get install -y python3-brotli
+sudo apt-get install -y python3-alsaaudio
 
 # Modify the service file directory path
 echo " "
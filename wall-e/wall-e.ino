@@ -86,6 +86,13 @@
 #define CONTROLLER_THRESHOLD 1    // The minimum error which the dynamics controller tries to achieve
 #define MAX_SERIAL_LENGTH 5       // Maximum number of characters that can be received
 
+// Binary framing (see web_interface/binary_protocol.py)
+#define BINARY_PROTOCOL_VERSION 1 // Reported in reply to the "P" command
+#define FRAME_START 0xA5          // First byte of a binary frame; never part of a text command
+#define OP_POSE 0x01              // Pose frame: 7 servos + 2 motors
+#define POSE_FRAME_LENGTH 11      // Opcode + 9 values + checksum
+#define MOTOR_UNCHANGED -128      // Pose value which leaves a motor input unchanged
+
 
 
 /// Instantiate Objects
@@ -134,6 +141,9 @@ bool autoMode = false;
 char firstChar;
 char serialBuffer[MAX_SERIAL_LENGTH];
 uint8_t serialLength = 0;
+uint8_t frameBuffer[POSE_FRAME_LENGTH];
+uint8_t frameLength = 0;
+bool frameActive = false;
 
 
 // ****** SERVO MOTOR CALIBRATION *********************
@@ -224,8 +234,25 @@ void readSerial() {
 	// Read incoming byte
 	char inchar = Serial.read();
 
+	// If a binary frame is being received, add the byte to the frame buffer
+	if (frameActive) {
+		frameBuffer[frameLength++] = inchar;
+
+		if (frameBuffer[0] != OP_POSE) {
+			Serial.println(F("Error: Unknown binary frame"));
+			frameActive = false;
+		} else if (frameLength == POSE_FRAME_LENGTH) {
+			evaluateFrame();
+			frameActive = false;
+		}
+
+	// The start byte of a binary frame can only appear between text commands
+	} else if (uint8_t(inchar) == FRAME_START && serialLength == 0) {
+		frameActive = true;
+		frameLength = 0;
+
 	// If the string has ended, evaluate the serial buffer
-	if (inchar == '\n' || inchar == '\r') {
+	} else if (inchar == '\n' || inchar == '\r') {
 
 		if (serialLength > 0) evaluateSerial();
 		serialBuffer[0] = 0;
@@ -285,6 +312,13 @@ void evaluateSerial() {
 	else if (firstChar == 'M' && number == 1) autoMode = true;
 
 
+	// Protocol query - report that binary frames are supported
+	// -- -- -- -- -- -- -- -- -- -- -- -- -- --
+	else if (firstChar == 'P') {
+		Serial.print(F("Protocol_")); Serial.println(BINARY_PROTOCOL_VERSION);
+	}
+
+
 	// Manual servo control
 	// -- -- -- -- -- -- -- -- -- -- -- -- -- --
 	else if (firstChar == 'L' && number >= 0 && number <= 100) {   // Move left arm
@@ -401,6 +435,48 @@ void evaluateSerial() {
 
 
 
+// -------------------------------------------------------------------
+/// Evaluate a binary frame from serial port
+///
+/// Parse the pose frame stored in "frameBuffer" by the "readSerial()"
+/// function. Layout: opcode, 7 servo values (0-100, or -1 to leave
+/// unchanged), turn and move values (-100 to 100, or -128 to leave
+/// unchanged), checksum (XOR of all previous bytes).
+// -------------------------------------------------------------------
+
+void evaluateFrame() {
+
+	// Verify the checksum
+	uint8_t checksum = 0;
+	for (int i = 0; i < POSE_FRAME_LENGTH - 1; i++) checksum ^= frameBuffer[i];
+
+	if (checksum != frameBuffer[POSE_FRAME_LENGTH - 1]) {
+		Serial.println(F("Error: Binary frame checksum"));
+		return;
+	}
+
+	// Servo positions, in the same order as the servo indices
+	for (int i = 0; i < NUMBER_OF_SERVOS; i++) {
+		int8_t number = int8_t(frameBuffer[i + 1]);
+		if (number >= 0 && number <= 100) {
+			autoMode = false;
+			queue.clear();
+			setpos[i] = int(number * 0.01 * (preset[i][1] - preset[i][0]) + preset[i][0]);
+		}
+	}
+
+	// Motor inputs
+	int8_t turn = int8_t(frameBuffer[NUMBER_OF_SERVOS + 1]);
+	int8_t move = int8_t(frameBuffer[NUMBER_OF_SERVOS + 2]);
+	if (turn != MOTOR_UNCHANGED && turn >= -100 && turn <= 100) turnValue = int(turn * 2.55);
+	if (move != MOTOR_UNCHANGED && move >= -100 && move <= 100) moveValue = int(move * 2.55);
+
+	// Acknowledge the frame
+	Serial.print('Q'); Serial.println(checksum);
+}
+
+
+
 // -------------------------------------------------------------------
 /// Sequence and generate animations
 // -------------------------------------------------------------------
@@ -10,18 +10,45 @@
 # @date       9th June 2024
 #############################################
 
-from flask import Flask, request, session, redirect, url_for, jsonify, render_template
+from flask import Flask, Response, request, session, redirect, url_for, jsonify, render_template, send_file, abort, g
 
 import os
+import stat
 import sys
-from queue import Queue
+import json
+import asyncio
 from threading import Event, Thread
 from serial import Serial
-import serial.tools.list_ports
 import subprocess
 import time
+import math
+import secrets
 import tempfile
+import mimetypes
+from itertools import count
+from typing import Callable
+from http.cookies import SimpleCookie
 from picamera2_stream import PiCameraStreamer
+from port_registry import PortRegistry
+from sound_catalog import SoundCatalog
+from audio_engine import AudioEngine
+from static_assets import StaticAssets
+from telemetry import TelemetryParser
+from serial_supervisor import SerialSupervisor
+from control_socket import ControlSocketServer
+from control_lease import ControlLease
+from command_buffer import CommandBuffer
+from command_tracker import CommandTracker
+from serial_budget import TokenBucket
+from batch_runner import BatchRunner
+from program_runner import ProgramRunner, ProgramStep, program_duration
+from keyframes import AnimationEngine
+from session_log import AUDIO, COMMANDS, SPEECH, URGENT_COMMANDS, SessionPlayer, SessionRecorder, read_log
+from event_hub import EventHub
+from metrics import Metric, MetricsRegistry, RateMeter
+from command_trace import CommandTracer, TraceContext
+from asgi_server import AsgiApp, AsgiRequest, AsgiResponse, AsyncArduinoDevice, json_response, run_command, serve_asgi
+import binary_protocol
 import logging
 from waitress import serve
 
@@ -37,7 +64,20 @@ else:
 # Set up global variables
 volume: int = 8
 startup: bool = False
-camera: PiCameraStreamer = PiCameraStreamer()
+events: EventHub = EventHub(app.config.get('EVENTS_MAX_CLIENTS', 4))
+camera: PiCameraStreamer = PiCameraStreamer(events)
+port_registry: PortRegistry = PortRegistry()
+sound_catalog: SoundCatalog = SoundCatalog(app.config['SOUND_FOLDER'], app.config['SOUND_FORMAT'])
+audio_engine: AudioEngine = AudioEngine(app.config.get('AUDIO_DEVICE', "default"),
+                                        period=app.config.get('AUDIO_PERIOD_FRAMES', 256),
+                                        policy=app.config.get('AUDIO_POLICY', "mix"),
+                                        max_voices=app.config.get('AUDIO_MAX_VOICES', 4),
+                                        mixer=app.config.get('AUDIO_MIXER', "Master"))
+metrics: MetricsRegistry = MetricsRegistry()
+tracer: CommandTracer = CommandTracer(app.config.get('TRACE_SAMPLE_RATE', 0.1), app.config.get('TRACE_BUFFER', 200))
+control_lease: ControlLease = ControlLease(app.config.get('CONTROL_LEASE_TIMEOUT', 2.0), events.publish)
+batch_runner: BatchRunner = BatchRunner(lease=control_lease)
+recorder: SessionRecorder = SessionRecorder(app.config.get('RECORDING_FOLDER', os.path.join(app.root_path, "recordings/")))
 
 # Set up logging
 logger = logging.getLogger()
@@ -60,23 +100,84 @@ logger.addHandler(stream_handler)
 #
 ###############################################################
 
+def is_serial_device(path: str) -> bool:
+    """
+    Check whether a path is a character device, e.g. a USB serial port or a pseudo-terminal
+    :param path: Path of the device
+    :return: True if it can be opened as a serial port
+    """
+    try:
+        return stat.S_ISCHR(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
 class ArduinoDevice:
     """Class used for managing communication with the Arduino"""
 
+    READ_TIMEOUT: float = 0.1   # Seconds the reader blocks before re-checking the exit flag
+
     # ---------------------------------------------------------
-    def __init__(self):
+    def __init__(self, port_registry: PortRegistry, baud_rate: int = 115200, flush_bytes: int = 64,
+                 budget_burst: int = 256, budget_policy: str = "merge", binary_frames: bool = True,
+                 events: EventHub | None = None, tracer: CommandTracer | None = None,
+                 recorder: SessionRecorder | None = None):
         """
         Constructor for Arduino serial communication thread class
-        :param port:     The serial port where the Arduino is connected
+        :param port_registry: Cached list of the available serial ports
+        :param baud_rate:     Baud rate of the serial link
+        :param flush_bytes:   Maximum number of bytes written to the port in one go
+        :param budget_burst:  Bytes of commands which can be queued in a burst above the link rate
+        :param budget_policy: "merge" to accept value commands over budget, since they replace
+                              pending values; "reject" to refuse all commands over budget
+        :param binary_frames: Pack motor/servo values into binary pose frames if the Arduino supports it
+        :param events:        Hub which connection changes, battery levels and command acks are published to
+        :param tracer:        Records the time taken by a sample of commands, from request to echo
+        :param recorder:      Records the commands sent while a session recording is running
         """
-        self.queue: Queue = Queue()
+        self.port_registry: PortRegistry = port_registry
+        self.events: EventHub | None = events
+        self.tracer: CommandTracer | None = tracer
+        self.recorder: SessionRecorder | None = recorder
+        self.published_connected: bool = False
+        self.baud_rate: int = baud_rate
+        self.flush_bytes: int = flush_bytes
+        self.budget: TokenBucket = TokenBucket(baud_rate / 10, budget_burst)
+        self.budget_policy: str = budget_policy
+        self.binary_frames: bool = binary_frames
+        self.binary_mode: bool = False
+        self.queue: CommandBuffer = CommandBuffer(tracer.superseded if tracer is not None else None)
+        self.tracker: CommandTracker = CommandTracker()
+        self.tickets = count()
+        self.stop_requests: dict = {}
+        self.stop_latency: dict = {'count': 0, 'last_ms': None, 'max_ms': None}
+        self.bytes_written: int = 0
+        self.bytes_read: int = 0
+        self.commands_sent: int = 0
+        self.command_rate: RateMeter = RateMeter()
+
+        # Dispatch table for messages received from the Arduino
+        self.telemetry: TelemetryParser = TelemetryParser()
+        self.telemetry.register("Battery_", "battery", self.__on_battery)
+        self.telemetry.register("Protocol_", "protocol", self.__on_protocol)
+        self.telemetry.register("Startup complete", "startup", self.__on_startup)
+        self.telemetry.register("Starting", "startup")
+        self.telemetry.register("---", "startup")
+        self.telemetry.register("Error", "error")
+
         self.exit_flag: Event = Event()
         self.port_name: str = ""
         self.serial_port: Serial | None = None
         self.serial_thread: Thread | None = None
+        self.write_thread: Thread | None = None
         self.battery_level: str | None = None
         self.exit_flag.clear()
 
+        # Link supervision - see SerialSupervisor
+        self.on_link_lost = None
+        self.outage: bool = False
+        self.buffer_in_outage: bool = False
+
     # ---------------------------------------------------------
     def __del__(self):
         """Destructor - ensures serial port is closed correctly"""
@@ -86,12 +187,12 @@ class ArduinoDevice:
     def connect(self, port: str | int = "") -> bool:
         """
         Connect to the serial port
-        :param port: The port to connect to (leave blank to use previous port)
+        :param port: The port to connect to, as an index or a path (leave blank to use previous port)
         :return: True if connected successfully, False otherwise
         """
         try:
             usb_ports = [
-                p.device for p in serial.tools.list_ports.comports()
+                p.device for p in self.port_registry.get_ports()
             ]
 
             if type(port) is str and port == "":
@@ -101,20 +202,28 @@ class ArduinoDevice:
                 port = usb_ports[port]
 
             # Check port exists and we are not already connected
-            if ((not self.is_connected() or port != self.port_name) and port in usb_ports):
+            # (ports which are not USB devices, e.g. the simulator's pseudo-terminal, can be given by path)
+            if ((not self.is_connected() or port != self.port_name)
+                    and (port in usb_ports or (type(port) is str and port != "" and is_serial_device(port)))):
                 
                # Ensure old port is properly disconnected first
                 self.disconnect() 
 
                 # Connect to the new port
-                self.serial_port = Serial(port, 115200)
+                self.serial_port = Serial(port, self.baud_rate, timeout=self.READ_TIMEOUT)
                 self.serial_port.flushInput()
                 self.port_name = port
 
-                # Start the command handler in a background thread
+                # Start the reader and writer in background threads
                 self.exit_flag.clear()
-                self.serial_thread = Thread(target = self.__communication_thread)
+                self.serial_thread = Thread(target = self.__read_thread)
+                self.write_thread = Thread(target = self.__write_thread)
                 self.serial_thread.start()
+                self.write_thread.start()
+
+                # Ask whether the Arduino understands binary frames
+                self.__negotiate_protocol()
+                self.__publish_connection(True)
 
         except Exception as ex:
             logger.error(f'Serial connect error: {repr(ex)}')
@@ -129,9 +238,17 @@ class ArduinoDevice:
         """
         try:
             self.battery_level = None
+            self.binary_mode = False
+
+            self.exit_flag.set()
+
+            if self.write_thread is not None:
+                # Wake the writer up if it is blocked waiting for a command
+                self.queue.wake()
+                self.write_thread.join()
+                self.write_thread = None
 
             if self.serial_thread is not None:
-                self.exit_flag.set()
                 self.serial_thread.join()
                 self.serial_thread = None
 
@@ -139,6 +256,10 @@ class ArduinoDevice:
                 self.serial_port.close()
                 self.serial_port = None
 
+            self.tracker.clear()
+            self.stop_requests.clear()
+            self.__publish_connection(False)
+
         except Exception as ex:
             logger.error(f'Serial disconnect error: {repr(ex)}')
 
@@ -151,30 +272,159 @@ class ArduinoDevice:
         :return: True if connected, False otherwise
         """
         return (self.serial_thread is not None and self.serial_thread.is_alive()
+             and self.write_thread is not None and self.write_thread.is_alive()
              and self.serial_port is not None and self.serial_port.is_open)
 
     # ---------------------------------------------------------
-    def send_command(self, command: str) -> bool:
+    def accepts_commands(self) -> bool:
+        """
+        Check if commands can be sent
+        :return: True if connected, or if commands are being buffered while the link is down
+        """
+        return self.is_connected() or (self.outage and self.buffer_in_outage)
+
+    # ---------------------------------------------------------
+    def in_outage(self) -> bool:
+        """
+        Check if the serial link has been lost and is waiting to be reconnected
+        :return: True if in an outage, False otherwise
+        """
+        return self.outage
+
+    # ---------------------------------------------------------
+    def set_outage(self, outage: bool, buffer: bool = False):
+        """
+        Mark the serial link as lost or restored
+        :param outage: True while the link is down
+        :param buffer: Keep accepting commands during the outage, to be sent after reconnecting
+        """
+        self.outage = outage
+        self.buffer_in_outage = outage and buffer
+
+        if outage and not buffer:
+            self.queue.clear()
+
+    # ---------------------------------------------------------
+    def send_command(self, command: str, wait_ack: bool = False, timeout: float = 1.0,
+                     trace: TraceContext | None = None) -> bool:
         """
         Send a serial command
-        :param command: The command to be sent
-        :return: True if port is open and message has been added to queue
+        Value commands (motors, trims, servos) replace any older value for the same channel
+        which has not been sent yet; all other commands are sent in order
+        :param command:  The command to be sent
+        :param wait_ack: Block until the Arduino has echoed the command back
+        :param timeout:  Maximum time in seconds to wait for the echo
+        :param trace:    Request the command came from, for tracing
+        :return: True if port is open and message has been added to queue (and acknowledged, if wait_ack)
+        """
+        return self.send_commands([command], wait_ack, timeout, trace=trace)
+
+    # ---------------------------------------------------------
+    def send_commands(self, commands: list[str], wait_ack: bool = False, timeout: float = 1.0,
+                      urgent: bool = False, trace: TraceContext | None = None) -> bool:
+        """
+        Send a group of serial commands, see send_command()
+        :param commands: The commands to be sent, in order
+        :param wait_ack: Block until the Arduino has echoed all of the commands back
+        :param timeout:  Maximum time in seconds to wait for the echoes
+        :param urgent:   Send ahead of everything else in the queue, dropping pending commands on the same channels
+        :param trace:    Request the commands came from, for tracing
+        :return: True if port is open and messages have been added to queue (and acknowledged, if wait_ack)
+        """
+        tracked = self.track_commands(commands, wait_ack, urgent, trace)
+        if tracked is None:
+            return False
+
+        if not wait_ack:
+            return True
+
+        deadline = time.monotonic() + timeout
+        acked = all(event.wait(max(0.0, deadline - time.monotonic())) for _, event in tracked)
+        self.forget_commands([ticket for ticket, _ in tracked])
+        return acked
+
+    # ---------------------------------------------------------
+    def track_commands(self, commands: list[str], watch: bool = True, urgent: bool = False,
+                       trace: TraceContext | None = None,
+                       notify: Callable[[], None] | None = None) -> list[tuple[int, Event | None]] | None:
+        """
+        Send a group of serial commands without blocking, see send_commands()
+        :param commands: The commands to be sent, in order
+        :param watch:    Create an event for each command, which is set once the Arduino has echoed it;
+                         the caller must release the tickets with forget_commands() afterwards
+        :param urgent:   Send ahead of everything else in the queue, dropping pending commands on the same channels
+        :param trace:    Request the commands came from, for tracing
+        :param notify:   With watch, also called for each command once it has been echoed, by the reader thread
+        :return: List of (ticket, event) for each command, or None if the port is not open
+        """
+        if not self.accepts_commands():
+            return None
+
+        tickets = [next(self.tickets) for _ in commands]
+        tracked = []
+
+        # Traces are started before queueing, so that the writer cannot get to the commands first
+        if self.tracer is not None:
+            self.tracer.begin(tickets, commands, trace)
+
+        for ticket, command in zip(tickets, commands):
+            event = self.tracker.watch(ticket, command, notify) if watch else None
+
+            if urgent:
+                self.stop_requests[ticket] = time.monotonic()
+                self.queue.put_urgent(command, ticket)
+
+            tracked.append((ticket, event))
+
+        if not urgent:
+            self.queue.put_many([(command, ticket) for command, (ticket, _) in zip(commands, tracked)])
+
+        if self.recorder is not None:
+            self.recorder.record_commands(commands, urgent)
+
+        return tracked
+
+    # ---------------------------------------------------------
+    def forget_commands(self, tickets: list[int]):
+        """
+        Stop tracking commands sent with track_commands()
+        :param tickets: Tickets of the commands
+        """
+        for ticket in tickets:
+            self.tracker.forget(ticket)
+
+    # ---------------------------------------------------------
+    def admit(self, commands: list[str]) -> float:
         """
-        success = False
+        Check commands against the serial bandwidth budget before sending them
+        :param commands: The commands which are about to be sent
+        :return: 0 if the commands can be sent, otherwise the seconds until the budget allows them
+        """
+        retry_after = self.budget.consume(sum(len(command) + 1 for command in commands))
+
+        # Value commands only replace pending values, so they do not grow the queue
+        if (retry_after > 0 and self.budget_policy == "merge"
+                and all(command[:1] in CommandBuffer.COALESCED_CHANNELS for command in commands)):
+            return 0.0
 
-        if self.is_connected():
-            self.queue.put(command)
-            success = True
+        return retry_after
 
-        return success
+    # ---------------------------------------------------------
+    def stop(self, wait_ack: bool = False, timeout: float = 1.0) -> bool:
+        """
+        Stop the main motors, pre-empting any movement commands which are still queued
+        :param wait_ack: Block until the Arduino has echoed the stop commands back
+        :param timeout:  Maximum time in seconds to wait for the echoes
+        :return: True if port is open and the stop has been queued (and acknowledged, if wait_ack)
+        """
+        return self.send_commands(["X0", "Y0"], wait_ack, timeout, urgent=True)
 
     # ---------------------------------------------------------
     def clear_queue(self):
         """
         Clear the serial send queue
         """
-        while not queue.empty():
-            self.queue.get()
+        self.queue.clear()
 
     # ---------------------------------------------------------
     def get_battery_level(self) -> str | None:
@@ -185,38 +435,221 @@ class ArduinoDevice:
         return self.battery_level
 
     # ---------------------------------------------------------
-    def __communication_thread(self):
+    def get_ack_stats(self) -> dict:
+        """
+        Get the command acknowledgement statistics
+        :return: Dictionary with acknowledged/lost counts and round-trip times
+        """
+        return self.tracker.get_stats()
+
+    # ---------------------------------------------------------
+    def get_queue_depth(self) -> int:
+        """
+        Get the number of commands waiting to be sent
+        :return: Current depth of the send queue
+        """
+        return len(self.queue)
+
+    # ---------------------------------------------------------
+    def get_budget_stats(self) -> dict:
+        """
+        Get the state of the serial bandwidth budget
+        :return: Dictionary with the budget rate, capacity and usage
+        """
+        return dict(self.budget.get_stats(), policy=self.budget_policy)
+
+    # ---------------------------------------------------------
+    def get_protocol(self) -> str:
+        """
+        Get the framing currently used on the serial link
+        :return: "binary" if pose frames are being used, otherwise "text"
+        """
+        return "binary" if self.binary_mode else "text"
+
+    # ---------------------------------------------------------
+    def get_telemetry(self, event_type: str | None = None, limit: int | None = None) -> list[dict]:
+        """
+        Get the most recent messages received from the Arduino
+        :param event_type: Only return messages of this type, e.g. "battery" (None for all types)
+        :param limit:      Maximum number of messages to return
+        :return: List of events as dictionaries, oldest first
+        """
+        return [event._asdict() for event in self.telemetry.get_events(event_type, limit)]
+
+    # ---------------------------------------------------------
+    def get_telemetry_stats(self) -> dict:
+        """
+        Get the number of messages received from the Arduino
+        :return: Dictionary with the count per message type, unknown lines and parse errors
+        """
+        return self.telemetry.get_stats()
+
+    # ---------------------------------------------------------
+    def get_stop_latency(self) -> dict:
+        """
+        Get the time taken from a stop request until the Arduino echoed it
+        :return: Dictionary with the number of stops, and the last and worst-case latency in milliseconds
+        """
+        return dict(self.stop_latency)
+
+    # ---------------------------------------------------------
+    def get_serial_stats(self) -> dict:
+        """
+        Get the amount of data sent and received over the serial link
+        :return: Dictionary with bytes written and read, commands sent and commands per second
+        """
+        return {
+            'bytes_written': self.bytes_written,
+            'bytes_read': self.bytes_read,
+            'commands_sent': self.commands_sent,
+            'commands_per_second': self.command_rate.rate(),
+        }
+
+    # ---------------------------------------------------------
+    def __write_thread(self):
         """
-        Handle sending and receiving data with the serial device
+        Send queued commands to the serial device
+        Blocks on the command queue, so the thread only wakes up when there is work to do.
+        Everything pending is written as one buffer, up to flush_bytes at a time.
         """
-        dataString: str = ""
-        logger.info(f'Starting Arduino Thread ({self.port_name})')
+        logger.info(f'Starting Arduino Writer ({self.port_name})')
 
         # Keep this thread running until the exit_flag changes
         while not self.exit_flag.is_set():
+            batch = self.queue.get_batch(self.flush_bytes)
+
+            # An empty batch is returned when the thread is woken up to disconnect
+            if not batch:
+                continue
+
             try:
-                # If there are any messages in the queue, send them
-                if not self.queue.empty():
-                    data = self.queue.get() + '\n'
-                    self.serial_port.write(data.encode())
-
-                # Read any incomming messages
-                while (self.serial_port.in_waiting > 0):
-                    data = self.serial_port.read()
-                    if (data.decode() == '\n' or data.decode() == '\r'):
-                        self.__parse_message(dataString)
-                        dataString = ""
-                    else:
-                        dataString += data.decode()
+                data, frames = binary_protocol.encode_batch(batch, self.binary_mode)
+
+                for echo, commands in frames:
+                    self.tracker.sent(echo, commands)
+
+                # Noted before writing, as the echo can be read before write() returns
+                if self.tracer is not None:
+                    self.tracer.written([ticket for _, ticket in batch])
+
+                self.serial_port.write(data)
+                self.bytes_written += len(data)
+                self.commands_sent += len(batch)
+                self.command_rate.mark(len(batch))
+
+                # Let the data drain at the line rate before the next flush, so that
+                # the Arduino's receive buffer is not overrun (10 bits per byte)
+                self.exit_flag.wait(len(data) * 10 / self.baud_rate)
 
             # If an error occured in the serial communication
             except Exception as ex:
-                logger.error(f'Serial handler error: {repr(ex)}')
-                #exit_flag.set()
+                self.__link_lost(ex)
+                break
 
-            time.sleep(0.01)
-        
-        logger.info(f'Stopping Arduino Thread ({self.port_name})')
+        logger.info(f'Stopping Arduino Writer ({self.port_name})')
+
+    # ---------------------------------------------------------
+    def __read_thread(self):
+        """
+        Receive and parse messages from the serial device
+        Blocks on the serial port until data arrives or the read timeout expires
+        """
+        buffer: bytearray = bytearray()
+        logger.info(f'Starting Arduino Reader ({self.port_name})')
+
+        # Keep this thread running until the exit_flag changes
+        while not self.exit_flag.is_set():
+            try:
+                # Wait for at least one byte, then take everything else that is waiting
+                data = self.serial_port.read(max(1, self.serial_port.in_waiting))
+                if not data:
+                    continue
+                self.bytes_read += len(data)
+
+                # Split complete lines off the front of the buffer
+                buffer += data.replace(b'\r', b'\n')
+                *lines, remainder = buffer.split(b'\n')
+                buffer = bytearray(remainder)
+
+                for line in lines:
+                    if line:
+                        self.__parse_message(line.decode(errors='replace'))
+
+            # If an error occured in the serial communication
+            except Exception as ex:
+                self.__link_lost(ex)
+                break
+
+        logger.info(f'Stopping Arduino Reader ({self.port_name})')
+
+    # ---------------------------------------------------------
+    def __link_lost(self, ex: Exception):
+        """
+        Stop both serial threads after the port has stopped working
+        :param ex: The error raised by the port
+        """
+        if not self.exit_flag.is_set():
+            logger.error(f'Serial link lost ({self.port_name}): {repr(ex)}')
+            self.exit_flag.set()
+            self.queue.wake()
+            self.__publish_connection(False, lost=True)
+
+            if self.on_link_lost is not None:
+                self.on_link_lost()
+
+    # ---------------------------------------------------------
+    def __publish_connection(self, connected: bool, lost: bool = False):
+        """
+        Publish a change of the connection state to the event hub
+        :param connected: True if the port has been opened, False if it has been closed
+        :param lost:      True if the port stopped working, rather than being closed
+        """
+        if self.events is not None and connected != self.published_connected:
+            self.published_connected = connected
+            self.events.publish("arduino", {'connected': connected, 'port': self.port_name, 'lost': lost})
+
+    # ---------------------------------------------------------
+    def __negotiate_protocol(self):
+        """
+        Query whether the Arduino accepts binary frames; the text protocol is used until it replies
+        """
+        if self.binary_frames:
+            self.queue.put(f"P{binary_protocol.PROTOCOL_VERSION}", next(self.tickets))
+
+    # ---------------------------------------------------------
+    def __on_battery(self, message: str) -> int:
+        """
+        Battery level message, e.g. "Battery_85"
+        :param message: The received message
+        :return: Battery level in percent
+        """
+        level = int(message.split('_')[1])
+        self.battery_level = str(level)
+
+        if self.events is not None:
+            self.events.publish("battery", {'level': level})
+        return level
+
+    # ---------------------------------------------------------
+    def __on_protocol(self, message: str) -> int:
+        """
+        Reply to the protocol query, e.g. "Protocol_1"
+        :param message: The received message
+        :return: Protocol version supported by the Arduino
+        """
+        version = int(message.split('_')[1])
+        self.binary_mode = self.binary_frames and version >= binary_protocol.PROTOCOL_VERSION
+        logger.info(f'Arduino serial protocol: {self.get_protocol()}')
+        return version
+
+    # ---------------------------------------------------------
+    def __on_startup(self, message: str):
+        """
+        The Arduino has (re)started, so it will have missed the protocol query
+        :param message: The received message
+        """
+        self.binary_mode = False
+        self.__negotiate_protocol()
 
     # ---------------------------------------------------------
     def __parse_message(self, dataString: str):
@@ -225,11 +658,25 @@ class ArduinoDevice:
         :param dataString: String containing the serial message to be parsed
         """
         try:
-            # Battery level message
-            if "Battery" in dataString:
-                dataList = dataString.split('_')
-                if len(dataList) > 1 and dataList[1].isdigit():
-                    self.battery_level = dataList[1]
+            # Echo of a command which has been consumed
+            acked = self.tracker.received(dataString)
+            if acked is not None:
+                self.telemetry.record("echo", dataString, [command for command, _ in acked])
+                if self.events is not None:
+                    self.events.publish("ack", {'echo': dataString, 'commands': [command for command, _ in acked]})
+                if self.tracer is not None:
+                    self.tracer.echoed([ticket for _, ticket in acked])
+
+                for _, ticket in acked:
+                    requested = self.stop_requests.pop(ticket, None)
+                    if requested is not None:
+                        latency = round((time.monotonic() - requested) * 1000, 2)
+                        self.stop_latency['count'] += 1
+                        self.stop_latency['last_ms'] = latency
+                        self.stop_latency['max_ms'] = max(latency, self.stop_latency['max_ms'] or 0)
+                return
+
+            self.telemetry.parse(dataString)
 
         except Exception as ex:
             logger.error(f'Error parsing message [{dataString}]: {repr(ex)}')
@@ -238,7 +685,282 @@ class ArduinoDevice:
 
 
 
-arduino: ArduinoDevice = ArduinoDevice()
+port_registry.start()
+sound_catalog.start()
+
+# Keep the sound card open and the clips in memory, if pyalsaaudio is installed
+if app.config.get('AUDIO_ENGINE', True) and audio_engine.start():
+    audio_engine.set_volume(volume * 10)
+    Thread(target=audio_engine.preload, args=([sound.path for sound in sound_catalog.get_sounds()],),
+           daemon=True).start()
+
+
+# =============================================================
+def build_static_assets():
+    """
+    Build the hashed and compressed copies of the static files
+    Until this has finished, pages link to the files in the static folder.
+    """
+    try:
+        static_assets.build()
+    except Exception as ex:
+        logging.error(f'Failed to build static assets: {repr(ex)}')
+
+
+static_assets: StaticAssets | None = None
+if app.config.get('STATIC_BUILD_FOLDER'):
+    static_assets = StaticAssets(app.static_folder, app.config['STATIC_BUILD_FOLDER'],
+                                 (os.path.relpath(app.config['SOUND_FOLDER'], app.static_folder),))
+    static_assets.load()
+    Thread(target=build_static_assets, daemon=True).start()
+
+
+@app.template_global()
+def asset_url(filename: str) -> str:
+    """
+    Get the URL of a static file, for use in templates
+    :param filename: Name of the file in the static folder, e.g. "js/main.js"
+    :return: URL of the hashed copy if it has been built, otherwise of the file itself
+    """
+    hashed_name = static_assets.url_name(filename) if static_assets is not None else None
+    if hashed_name is None:
+        return url_for('static', filename=filename)
+    return url_for('static_asset', filename=hashed_name)
+
+
+# =============================================================
+arduino: ArduinoDevice = ArduinoDevice(port_registry,
+                                       app.config.get('SERIAL_BAUD_RATE', 115200),
+                                       app.config.get('SERIAL_FLUSH_BYTES', 64),
+                                       app.config.get('SERIAL_BUDGET_BURST', 256),
+                                       app.config.get('SERIAL_BUDGET_POLICY', "merge"),
+                                       app.config.get('SERIAL_BINARY_FRAMES', True),
+                                       events,
+                                       tracer,
+                                       recorder)
+supervisor: SerialSupervisor = SerialSupervisor(arduino, port_registry,
+                                                app.config.get('SERIAL_OUTAGE_POLICY', "reject"))
+if app.config.get('SERIAL_RECONNECT', True):
+    supervisor.start()
+program_runner: ProgramRunner = ProgramRunner(
+    lambda commands: arduino.send_commands(commands, trace=TraceContext('/api/program')),
+    arduino.stop, events.publish, control_lease)
+session_player: SessionPlayer = SessionPlayer({
+    COMMANDS: lambda commands: arduino.send_commands(commands.split("\n"), trace=TraceContext('/api/replay')),
+    URGENT_COMMANDS: lambda commands: arduino.send_commands(commands.split("\n"), urgent=True,
+                                                            trace=TraceContext('/api/replay')),
+    AUDIO: lambda clip: play_audio(clip),
+    SPEECH: lambda text: Thread(target=speak, args=(text,), daemon=True).start(),
+}, events.publish, control_lease)
+
+
+# =============================================================
+def cookie_session(headers: dict) -> dict:
+    """
+    Decode the login session cookie sent with a request which is not handled by Flask
+    :param headers: HTTP headers, with lower-case names
+    :return: The session data, or an empty dictionary if there is no valid session
+    """
+    cookie = SimpleCookie(headers.get('cookie', ''))
+    name = app.config.get('SESSION_COOKIE_NAME', 'session')
+    if name not in cookie:
+        return {}
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    try:
+        data = serializer.loads(cookie[name].value,
+                                max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except Exception:
+        return {}
+
+    return data if isinstance(data, dict) else {}
+
+
+def control_socket_authorized(headers: dict) -> bool:
+    """
+    Check the login session cookie sent with a control socket handshake
+    :param headers: HTTP headers of the handshake, with lower-case names
+    :return: True if the client is logged in to the web-interface
+    """
+    return bool(cookie_session(headers).get('active'))
+
+
+def lease_client(headers: dict, address: str, session_data: dict) -> tuple[str, str]:
+    """
+    Identify a client for the motion lease
+    API callers (e.g. the Flutter app or scripts) can name themselves with an X-Client-Id header,
+    browsers are told apart by their login session, anything else by its address.
+    :param headers:      HTTP headers, with lower-case names
+    :param address:      IP address of the client
+    :param session_data: Login session of the client
+    :return: (id of the client, description shown to other clients)
+    """
+    client_id = headers.get('x-client-id', '').strip()[:64]
+    if client_id:
+        return "id:" + client_id, f"{client_id} ({address})"
+    if session_data.get('client'):
+        return "session:" + session_data['client'], f"browser ({address})"
+    return "address:" + address, address
+
+
+control_socket: ControlSocketServer = ControlSocketServer(arduino, control_socket_authorized,
+                                                          port=app.config.get('CONTROL_SOCKET_PORT', 5001),
+                                                          ack_timeout=app.config.get('SERIAL_ACK_TIMEOUT', 1.0),
+                                                          lease=control_lease,
+                                                          identify=lambda headers, address: lease_client(
+                                                              headers, address, cookie_session(headers)))
+
+
+# =============================================================
+@app.before_request
+def start_request_timer():
+    """
+    Note when a request was received, for the latency histograms and command traces
+    """
+    g.request_start = time.perf_counter()
+    g.request_received = time.monotonic()
+
+
+@app.after_request
+def record_request_time(response):
+    """
+    Add the time taken by a request to the latency histogram of its route
+    For streamed responses, this is the time until the response started.
+    :param response: The response
+    :return: The unchanged response
+    """
+    start = g.get('request_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.observe_request(route, request.method, response.status_code, time.perf_counter() - start)
+
+    trace = g.get('trace')
+    if trace is not None and trace.trace_id is not None:
+        response.headers['X-Trace-Id'] = str(trace.trace_id)
+    return response
+
+
+def request_trace() -> TraceContext:
+    """
+    Get the tracing context of the current request, for commands sent to the Arduino
+    A request is always traced if it has an X-Trace header or a ?trace=1 parameter.
+    If a front proxy sets X-Request-Start (t=<seconds since the epoch>), the time before
+    the request reached Flask is traced too.
+    :return: The context
+    """
+    trace = g.get('trace')
+    if trace is None:
+        server_delay = None
+        request_start = request.headers.get('X-Request-Start', '').removeprefix('t=')
+        try:
+            server_delay = max(0.0, time.time() - (time.monotonic() - g.request_received) - float(request_start))
+        except ValueError:
+            pass
+
+        trace = g.trace = TraceContext(request.url_rule.rule if request.url_rule is not None else request.path,
+                                       g.get('request_received'), server_delay,
+                                       'X-Trace' in request.headers or request.args.get('trace') == '1')
+    return trace
+
+
+def request_client() -> tuple[str, str]:
+    """
+    Identify the client of the current request for the motion lease, see lease_client()
+    :return: (id of the client, description shown to other clients)
+    """
+    if session.get('active') and 'client' not in session:
+        session['client'] = secrets.token_hex(8)
+    return lease_client({'x-client-id': request.headers.get('X-Client-Id', '')}, request.remote_addr or "", session)
+
+
+def drives(commands: list[str]) -> bool:
+    """
+    Check whether commands drive the main motors, and so need the motion lease
+    :param commands: The commands
+    :return: True if any of the commands is a motor command or a keyboard drive command
+    """
+    channels = CommandBuffer.MOTOR_CHANNELS + CommandBuffer.DRIVE_COMMANDS
+    return any(command[:1] and command[:1] in channels for command in commands)
+
+
+def lease_refused(retry_after: float) -> tuple[dict, str]:
+    """
+    Describe why a drive command was refused
+    :param retry_after: Seconds until the current lease runs out
+    :return: (JSON data of the error response, value of the Retry-After header)
+    """
+    holder = control_lease.get_status()['holder'] or "Another client"
+    return ({'status': 'Error', 'msg': f'{holder} is driving the robot', 'holder': holder,
+             'retry_after': round(retry_after, 3)}, str(max(1, math.ceil(retry_after))))
+
+
+def api_lease(force: bool = False):
+    """
+    Check the motion lease for the drive commands of an API request, taking or renewing it
+    :param force: Take the lease over from the client holding it
+    :return: 409 response with a Retry-After header if another client holds the lease, otherwise None
+    """
+    client, name = request_client()
+    retry_after = control_lease.acquire(client, name, force)
+    if retry_after > 0:
+        data, retry_header = lease_refused(retry_after)
+        response = jsonify(data)
+        response.headers['Retry-After'] = retry_header
+        return response, 409
+
+    return None
+
+
+def collect_metrics() -> list[Metric]:
+    """
+    Read the state of the serial link, camera and other services for /metrics
+    :return: List of metrics
+    """
+    serial = arduino.get_serial_stats()
+    acks = arduino.get_ack_stats()
+    budget = arduino.get_budget_stats()
+    stream = camera.get_stats()
+    hub = events.get_stats()
+
+    return [
+        Metric('arduino_connected', 'gauge', 'Whether the serial link to the Arduino is open',
+               [({}, arduino.is_connected())]),
+        Metric('serial_queue_depth', 'gauge', 'Commands waiting to be written to the serial port',
+               [({}, arduino.get_queue_depth())]),
+        Metric('serial_bytes_written_total', 'counter', 'Bytes written to the serial port',
+               [({}, serial['bytes_written'])]),
+        Metric('serial_bytes_read_total', 'counter', 'Bytes read from the serial port',
+               [({}, serial['bytes_read'])]),
+        Metric('serial_commands_sent_total', 'counter', 'Commands written to the serial port',
+               [({}, serial['commands_sent'])]),
+        Metric('serial_commands_per_second', 'gauge', 'Commands written per second, averaged over 10 seconds',
+               [({}, serial['commands_per_second'])]),
+        Metric('serial_commands_acked_total', 'counter', 'Commands echoed back by the Arduino',
+               [({}, acks['acked'])]),
+        Metric('serial_commands_lost_total', 'counter', 'Commands which were never echoed back',
+               [({}, acks['lost'])]),
+        Metric('serial_budget_throttled_total', 'counter', 'Commands refused by the serial bandwidth budget',
+               [({}, budget['throttled'])]),
+        Metric('camera_active', 'gauge', 'Whether the camera stream is running',
+               [({}, camera.is_stream_active())]),
+        Metric('camera_frames_captured_total', 'counter', 'Frames captured by the camera',
+               [({}, stream['frames_captured'])]),
+        Metric('camera_frames_sent_total', 'counter', 'Frames sent to stream clients',
+               [({}, stream['frames_sent'])]),
+        Metric('camera_clients', 'gauge', 'Clients watching the camera stream',
+               [({}, stream['clients'])]),
+        Metric('control_socket_clients', 'gauge', 'Clients connected to the control WebSocket',
+               [({}, control_socket.clients)]),
+        Metric('control_lease_rejected_total', 'counter', 'Drive commands refused because another client held the lease',
+               [({}, control_lease.get_status()['rejected'])]),
+        Metric('event_stream_clients', 'gauge', 'Clients connected to /api/events',
+               [({}, hub['subscribers'])]),
+        Metric('batches_pending', 'gauge', 'Batches with steps waiting to run',
+               [({}, batch_runner.get_stats()['pending'])]),
+    ]
+
+
+metrics.add_collector(collect_metrics)
 
 
 ###############################################################
@@ -256,45 +978,15 @@ def index():
     if not session.get('active'):
         return redirect(url_for('login'))
 
-    files = []
     errors = []
 
     # Get list of audio files
-    try:
-        for item in sorted(os.listdir(app.config['SOUND_FOLDER'])):
-            if item.endswith(f".{app.config['SOUND_FORMAT']}"):
-                audiofiles = os.path.splitext(os.path.basename(item))[0]
-
-                # Set up default details
-                audiogroup = "Other"
-                audionames = audiofiles
-                audiotimes = 0
-
-                audio_details = audiofiles.split('_')
-
-                # Get item details from name, and make sure they are valid
-                if len(audio_details) == 2:
-                    if audio_details[1].isdigit():
-                        audionames = audio_details[0]
-                        audiotimes = float(audio_details[1]) / 1000.0
-                    else:
-                        audiogroup = audio_details[0]
-                        audionames = audio_details[1]
-                elif len(audio_details) == 3:
-                    audiogroup = audio_details[0]
-                    audionames = audio_details[1]
-                    if audio_details[2].isdigit():
-                        audiotimes = float(audio_details[2]) / 1000.0
-
-                # Add the details to the list
-                files.append((audiogroup, audiofiles, audionames, audiotimes))
-
-    except Exception as ex:
-        errors.append(repr(ex))
-        logging.error(f'Failed to initialise audio files: {repr(ex)}')
+    files = sound_catalog.get_sounds()
+    if sound_catalog.error is not None:
+        errors.append(sound_catalog.error)
 
     # Get list of connected USB devices
-    ports = serial.tools.list_ports.comports()
+    ports = port_registry.get_ports()
     usb_ports = [
         p.description
         for p in ports
@@ -319,7 +1011,7 @@ def index():
         try:
             # If user has selected for the Arduino to connect by default, do so now
             if app.config['AUTOSTART_ARDUINO'] and selectedPort < len(usb_ports):
-                if arduino.connect(selectedPort):
+                if supervisor.connect(selectedPort):
                     logging.info("Auto-start Complete: Arduino communication")
                 else:
                     logging.warning("Auto-start Failed: Arduino communication")
@@ -344,6 +1036,36 @@ def index():
                            errorMessages=errors)
 
 
+# =============================================================
+@app.route('/assets/<path:filename>')
+def static_asset(filename):
+    """
+    Serve a hashed copy of a static file, compressed if the browser supports it
+    The contents of a hashed file never change, so it can be cached forever.
+    :param filename: Hashed name of the file
+    :return: The file, or 304 if the browser already has it
+    """
+    found = static_assets.find(filename, request.headers.get('Accept-Encoding', '')) if static_assets is not None else None
+    if found is None:
+        abort(404)
+
+    path, encoding = found
+    response = send_file(path,
+                         mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                         etag=f"{filename}-{encoding or 'identity'}",
+                         max_age=31536000,
+                         conditional=True)
+
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.vary.add('Accept-Encoding')
+    response.headers.pop('Content-Disposition', None)
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+
+    return response
+
+
 # =============================================================
 @app.route('/login')
 def login():
@@ -367,6 +1089,7 @@ def login_request():
     password = request.form.get('password')
     if password == app.config['LOGIN_PASSWORD']:
         session['active'] = True
+        session['client'] = secrets.token_hex(8)
         return redirect(url_for('index'))
     return render_template('login.html', incorrectPassword=True)
 
@@ -389,9 +1112,13 @@ def motor():
         xVal = int(float(stickX) * 100)
         yVal = int(float(stickY) * 100)
 
-        if arduino.is_connected():
-            arduino.send_command("X" + str(xVal))
-            arduino.send_command("Y" + str(yVal))
+        client, name = request_client()
+        retry_after = control_lease.admit(client, name)
+        if retry_after > 0:
+            return jsonify(lease_refused(retry_after)[0])
+
+        if arduino.accepts_commands():
+            arduino.send_commands(["X" + str(xVal), "Y" + str(yVal)], trace=request_trace())
             return jsonify({'status': 'OK'})
         else:
             return jsonify({'status': 'Error', 'msg': 'Arduino not connected'})
@@ -417,24 +1144,24 @@ def settings():
         # Motor deadzone threshold
         if thing == "motorOff":
             logging.info(f'Motor Offset: {value}')
-            if arduino.is_connected():
-                arduino.send_command("O" + value)
+            if arduino.accepts_commands():
+                arduino.send_command("O" + value, trace=request_trace())
             else:
                 return jsonify({'status': 'Error', 'msg': 'Arduino not connected'})
 
         # Motor steering offset/trim
         elif thing == "steerOff":
             logging.info(f'Steering Offset: {value}')
-            if arduino.is_connected():
-                arduino.send_command("S" + value)
+            if arduino.accepts_commands():
+                arduino.send_command("S" + value, trace=request_trace())
             else:
                 return jsonify({'status': 'Error', 'msg': 'Arduino not connected'})
 
         # Automatic/manual animation mode
         elif thing == "animeMode":
             logging.info(f'Animation Mode: {value}')
-            if arduino.is_connected():
-                arduino.send_command("M" + value)
+            if arduino.accepts_commands():
+                arduino.send_command("M" + value, trace=request_trace())
             else:
                 return jsonify({'status': 'Error', 'msg': 'Arduino not connected'})
 
@@ -446,6 +1173,7 @@ def settings():
         elif thing == "volume":
             global volume
             volume = int(value)
+            audio_engine.set_volume(volume * 10)
 
         # Turn on/off the webcam
         elif thing == "streamer":
@@ -488,6 +1216,46 @@ def settings():
         return jsonify({'status': 'Error', 'msg': 'Unable to read POST data'})
 
 
+# =============================================================
+def mixer_command() -> list | None:
+    """
+    Command which sets the audio output to the current volume
+    :return: The command, or None if volume control is not supported (only on linux via amixer)
+    """
+    if sys.platform == "linux":
+        return ["amixer", "sset", "Master", "{}%".format(volume * 10)]
+    return None
+
+
+def play_audio(clip: str):
+    """
+    Play a sound file on the Raspberry Pi, at the current volume
+    The audio engine plays it from memory if it is running, otherwise AUDIOPLAYER_CMD is started.
+    :param clip: Path of the sound file
+    """
+    recorder.record(AUDIO, clip)
+
+    if audio_engine.play(clip):
+        return
+
+    audiomixer_cmd = mixer_command()
+    if audiomixer_cmd is not None:
+        subprocess.run(audiomixer_cmd,
+                       stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+
+    p = subprocess.Popen(app.config['AUDIOPLAYER_CMD'] + [clip],
+                     stdout=subprocess.PIPE,
+                     stderr=subprocess.PIPE)
+
+    if app.config['APP_DEBUG']:
+        p.wait()
+        if p.stderr is not None:
+            logger.error(p.stderr.readlines())
+        if p.stdout is not None:
+            logger.info(p.stdout.readlines())
+
+
 # =============================================================
 @app.route('/audio', methods=['POST'])
 def audio():
@@ -500,88 +1268,73 @@ def audio():
 
     clip = request.form.get('clip')
     if clip is not None:
-        clip = f"{app.config['SOUND_FOLDER']}{clip}.{app.config['SOUND_FORMAT']}"
-
-        # Volume control only on linux via amixer
-        if sys.platform == "linux":
-            audiomixer_cmd = ["amixer", "sset", "Master", "{}%".format(volume * 10)]
-            subprocess.run(audiomixer_cmd,
-                           stdout=subprocess.DEVNULL,
-                           stderr=subprocess.DEVNULL)
-
-        p = subprocess.Popen(app.config['AUDIOPLAYER_CMD'] + [clip],
-                         stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE)
-
-        if app.config['APP_DEBUG']:
-            p.wait()
-            if p.stderr is not None:
-                logger.error(p.stderr.readlines())
-            if p.stdout is not None:
-                logger.info(p.stdout.readlines())
+        path = sound_catalog.lookup(clip)
+        if path is None:
+            return jsonify({'status': 'Error', 'msg': f'Unknown audio clip "{clip}"'})
 
+        play_audio(path)
         return jsonify({'status': 'OK'})
     else:
         return jsonify({'status': 'Error', 'msg': 'Unable to read POST data'})
 
 
 # =============================================================
-@app.route('/tts', methods=['POST'])
-def tts():
+def tts_commands(text: str, infile: str, outfile: str) -> list[list]:
     """
-    Text to Speech on the Raspberry Pi
-    Requires Espeak-NG and optionally Rubberband
-    :return: JSON response with success or error status
+    Commands which speak a text, to be run one after the other
+    :param text:    The text
+    :param infile:  Temporary file for the generated speech
+    :param outfile: Temporary file for the pitch shifted speech
+    :return: List of commands (program and arguments)
     """
-    if not session.get('active'):
-        return redirect(url_for('login'))
+    # Generate Speech
+    commands = [app.config['ESPEAK_CMD'] + ['-w', infile, text.encode('utf8')]]
 
-    text = request.form.get('text')
+    # Shift pitch
+    if app.config['RB_CMD']:
+        commands.append(app.config['RB_CMD'] + [infile, outfile])
+    else:
+        outfile = infile
 
-    # Shell commands
-    espeak_cmd = app.config['ESPEAK_CMD']
-    rb_cmd = app.config['RB_CMD']
+    # Volume control
+    audiomixer_cmd = mixer_command()
+    if audiomixer_cmd is not None:
+        commands.append(audiomixer_cmd)
 
-    # Don't react to empty strings
-    if text is not None and text != "":
+    # Play it
+    commands.append(app.config['AUDIOPLAYER_CMD'] + [outfile])
+    return commands
 
-        infile = tempfile.NamedTemporaryFile()
-        outfile = tempfile.NamedTemporaryFile()
 
-        text_e = text.encode('utf8')
-        espeak_args = ['-w', infile.name, text_e]
+def speak(text: str):
+    """
+    Speak a text on the Raspberry Pi; only returns once it has been spoken
+    :param text: The text
+    """
+    recorder.record(SPEECH, text)
 
-        try:
-            # Generate Speech
-            subprocess.run(espeak_cmd + espeak_args,
+    with tempfile.NamedTemporaryFile() as infile, tempfile.NamedTemporaryFile() as outfile:
+        for command in tts_commands(text, infile.name, outfile.name):
+            subprocess.run(command,
                            stdout=subprocess.DEVNULL,
                            stderr=subprocess.DEVNULL)
 
-            if not rb_cmd:
-                outfile = infile
 
-            else:
-                # Shift pitch
-                subprocess.run(rb_cmd + [infile.name, outfile.name],
-                               stdout=subprocess.DEVNULL,
-                               stderr=subprocess.DEVNULL)
-
-            # Volume control only on linux via amixer
-            if sys.platform == "linux":
-                audiomixer_cmd = ["amixer", "sset", "Master", "{}%".format(volume * 10)]
-                subprocess.run(audiomixer_cmd,
-                               stdout=subprocess.DEVNULL,
-                               stderr=subprocess.DEVNULL)
-
-            # Play it
-            subprocess.run(app.config['AUDIOPLAYER_CMD'] + [outfile.name],
-                           stdout=subprocess.DEVNULL,
-                           stderr=subprocess.DEVNULL)
+@app.route('/tts', methods=['POST'])
+def tts():
+    """
+    Text to Speech on the Raspberry Pi
+    Requires Espeak-NG and optionally Rubberband
+    :return: JSON response with success or error status
+    """
+    if not session.get('active'):
+        return redirect(url_for('login'))
 
-        finally:
-            infile.close()
-            outfile.close()
+    text = request.form.get('text')
 
+    # Don't react to empty strings
+    if text is not None and text != "":
+        speak(text)
         return jsonify({'status': 'OK'})
     else:
         return jsonify({'status': 'Error', 'msg': 'Unable to read POST data'})
@@ -603,8 +1356,8 @@ def animate():
     if clip is not None:
         logger.debug(f"Animate: {clip}")
 
-        if arduino.is_connected():
-            arduino.send_command("A" + clip)
+        if arduino.accepts_commands():
+            arduino.send_command("A" + clip, trace=request_trace())
             return jsonify({'status': 'OK'})
         else:
             return jsonify({'status': 'Error', 'msg': 'Arduino not connected'})
@@ -630,8 +1383,15 @@ def servoControl():
         logger.debug(f"servo: {servo}")
         logger.debug(f"value: {value}")
 
-        if arduino.is_connected():
-            arduino.send_command(servo + value)
+        # The keyboard drive commands (w, s, a, d, q) are sent as "servos" too
+        if drives([servo]):
+            client, name = request_client()
+            retry_after = control_lease.admit(client, name)
+            if retry_after > 0:
+                return jsonify(lease_refused(retry_after)[0])
+
+        if arduino.accepts_commands():
+            arduino.send_command(servo + value, trace=request_trace())
             return jsonify({'status': 'OK'})
         else:
             return jsonify({'status': 'Error', 'msg': 'Arduino not connected'})
@@ -658,7 +1418,7 @@ def arduinoConnect():
             logger.debug("Reload list of connected USB ports")
 
             # Get list of connected USB devices
-            ports = serial.tools.list_ports.comports()
+            ports = port_registry.get_ports()
             usb_ports = [p.description for p in ports]
 
             # Ensure that the preferred Arduino port is selected by default
@@ -676,7 +1436,7 @@ def arduinoConnect():
             logger.debug("Reconnect to Arduino")
 
             if arduino.is_connected():
-                arduino.disconnect()
+                supervisor.disconnect()
                 return jsonify({'status': 'OK', 'arduino': 'Disconnected'})
 
             else:
@@ -685,20 +1445,12 @@ def arduinoConnect():
                 if port is not None and port.isdigit():
                     portNum = int(port)
 
-                    # Test whether connection to the selected port is possible
-                    ports = serial.tools.list_ports.comports()
-                    usb_ports = [p.device for p in ports]
+                    usb_ports = [p.device for p in port_registry.get_ports()]
 
                     if portNum >= 0 and portNum < len(usb_ports):
-                        # Try opening and closing port to see if connection is possible
-                        try:
-                            ser = serial.Serial(usb_ports[portNum], 115200)
-                            if (ser.inWaiting() > 0):
-                                ser.flushInput()
-                            ser.close()
-                            arduino.connect(usb_ports[portNum])
+                        if supervisor.connect(usb_ports[portNum]):
                             return jsonify({'status': 'OK', 'arduino': 'Connected'})
-                        except:
+                        else:
                             return jsonify({'status': 'Error', 'msg': 'Unable to connect to selected serial port'})
                     else:
                         return jsonify({'status': 'Error', 'msg': 'Invalid serial port selected'})
@@ -744,6 +1496,164 @@ def arduinoStatus():
 # NEW API ENDPOINTS FOR EXTERNAL CONTROL
 # =============================================================
 
+def api_send(commands: list[str], urgent: bool = False):
+    """
+    Send commands for an API request
+    Requests over the serial bandwidth budget are refused with 429 and a Retry-After header.
+    If the request URL contains ?ack=1, wait until the Arduino has consumed the commands.
+    :param commands: The commands to be sent, in order
+    :param urgent:   Send ahead of all other queued commands (never throttled)
+    :return: Error response if the commands were not sent (or acknowledged, in ack mode), otherwise None
+    """
+    if not urgent:
+        error = api_throttle(commands)
+        if error is not None:
+            return error
+
+    wait_ack = request.args.get('ack', '').lower() in ('1', 'true', 'yes')
+    if not arduino.send_commands(commands, wait_ack, app.config.get('SERIAL_ACK_TIMEOUT', 1.0), urgent,
+                                 request_trace()):
+        return jsonify({'status': 'Error', 'msg': 'Arduino did not acknowledge the command'}), 504
+
+    return None
+
+
+def api_throttle(commands: list[str]):
+    """
+    Check API commands against the serial bandwidth budget
+    :param commands: The commands which are about to be sent
+    :return: 429 response with a Retry-After header if over budget, otherwise None
+    """
+    retry_after = arduino.admit(commands)
+    if retry_after > 0:
+        response = jsonify({'status': 'Error', 'msg': 'Serial bandwidth exceeded, slow down'})
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response, 429
+
+    return None
+
+
+# Map API servo names to command characters
+API_SERVOS: dict = {
+    'head_rotation': 'G',
+    'neck_top': 'T',
+    'neck_bottom': 'B',
+    'arm_left': 'L',
+    'arm_right': 'R',
+    'eye_left': 'E',
+    'eye_right': 'U'
+}
+
+# Keyframe animations, streamed to the servos as setpoints
+animation_engine: AnimationEngine = AnimationEngine(
+    app.config.get('ANIMATION_FOLDER', os.path.join(app.root_path, "animations/")), API_SERVOS,
+    lambda commands: arduino.send_commands(commands, trace=TraceContext('/api/keyframes')),
+    events.publish, app.config.get('ANIMATION_TICK_RATE', 25))
+
+
+def move_commands(data: dict) -> list[str]:
+    """
+    Validate a movement request
+    :param data: {"x": -100 to 100, "y": -100 to 100}
+    :return: The serial commands
+    :raise ValueError: If the request is not valid
+    """
+    x = data.get('x')
+    y = data.get('y')
+
+    if x is None or y is None:
+        raise ValueError('Both x and y values required')
+
+    if not (-100 <= x <= 100) or not (-100 <= y <= 100):
+        raise ValueError('Values must be between -100 and 100')
+
+    return [f"X{int(x)}", f"Y{int(y)}"]
+
+
+def servo_commands(servos: dict) -> list[str]:
+    """
+    Validate a servo request
+    :param servos: Dictionary of servo name to value (0-100)
+    :return: The serial commands
+    :raise ValueError: If the request is not valid
+    """
+    for servo, value in servos.items():
+        if servo not in API_SERVOS:
+            valid_servos = ', '.join(API_SERVOS.keys())
+            raise ValueError(f'Invalid servo "{servo}". Valid servos: {valid_servos}')
+
+        if not (0 <= value <= 100):
+            raise ValueError(f'Value for "{servo}" must be between 0 and 100')
+
+    return [f"{API_SERVOS[servo]}{int(value)}" for servo, value in servos.items()]
+
+
+def animation_commands(data: dict) -> list[str]:
+    """
+    Validate an animation request
+    :param data: {"animation": animation_number}
+    :return: The serial commands
+    :raise ValueError: If the request is not valid
+    """
+    animation = data.get('animation')
+    if animation is None:
+        raise ValueError('animation number required')
+
+    if not isinstance(animation, int) or animation < 0:
+        raise ValueError('animation must be a non-negative integer')
+
+    return [f"A{animation}"]
+
+
+def setting_commands(data: dict) -> list[str]:
+    """
+    Validate a settings request
+    :param data: {"setting": "setting_name", "value": value}
+    :return: The serial commands
+    :raise ValueError: If the request is not valid
+    """
+    setting = data.get('setting')
+    value = data.get('value')
+
+    if setting is None or value is None:
+        raise ValueError('Both setting and value required')
+
+    if setting == 'steering_offset':
+        if not (-100 <= value <= 100):
+            raise ValueError('steering_offset must be between -100 and 100')
+        return [f"S{int(value)}"]
+
+    elif setting == 'motor_deadzone':
+        if not (0 <= value <= 250):
+            raise ValueError('motor_deadzone must be between 0 and 250')
+        return [f"O{int(value)}"]
+
+    elif setting == 'auto_mode':
+        if value not in [0, 1]:
+            raise ValueError('auto_mode must be 0 or 1')
+        return [f"M{int(value)}"]
+
+    raise ValueError('Invalid setting. Valid settings: steering_offset, motor_deadzone, auto_mode')
+
+
+def audio_clip(data: dict) -> str:
+    """
+    Validate an audio request
+    :param data: {"clip": "name of a sound file, without extension"}
+    :return: Path of the sound file
+    :raise ValueError: If the clip does not exist
+    """
+    clip = data.get('clip')
+    if not isinstance(clip, str) or not clip:
+        raise ValueError('clip name required')
+
+    path = sound_catalog.lookup(clip)
+    if path is None:
+        raise ValueError(f'Unknown audio clip "{clip}"')
+
+    return path
+
+
 @app.route('/api/move', methods=['POST'])
 def api_move():
     """
@@ -756,20 +1666,21 @@ def api_move():
         if not data:
             return jsonify({'status': 'Error', 'msg': 'No JSON data provided'}), 400
         
-        x = data.get('x')
-        y = data.get('y')
-        
-        if x is None or y is None:
-            return jsonify({'status': 'Error', 'msg': 'Both x and y values required'}), 400
-        
-        if not (-100 <= x <= 100) or not (-100 <= y <= 100):
-            return jsonify({'status': 'Error', 'msg': 'Values must be between -100 and 100'}), 400
+        try:
+            commands = move_commands(data)
+        except ValueError as e:
+            return jsonify({'status': 'Error', 'msg': str(e)}), 400
         
+        error = api_lease()
+        if error is not None:
+            return error
+
         global arduino
-        if arduino.is_connected():
-            arduino.send_command(f"X{int(x)}")
-            arduino.send_command(f"Y{int(y)}")
-            return jsonify({'status': 'OK', 'x': int(x), 'y': int(y)})
+        if arduino.accepts_commands():
+            error = api_send(commands)
+            if error is not None:
+                return error
+            return jsonify({'status': 'OK', 'x': int(data['x']), 'y': int(data['y'])})
         else:
             return jsonify({'status': 'Error', 'msg': 'Arduino not connected'}), 503
     
@@ -796,27 +1707,16 @@ def api_servo():
         if servo is None or value is None:
             return jsonify({'status': 'Error', 'msg': 'Both servo and value required'}), 400
         
-        if not (0 <= value <= 100):
-            return jsonify({'status': 'Error', 'msg': 'Value must be between 0 and 100'}), 400
-        
-        # Map servo names to command characters
-        servo_map = {
-            'head_rotation': 'G',
-            'neck_top': 'T', 
-            'neck_bottom': 'B',
-            'arm_left': 'L',
-            'arm_right': 'R',
-            'eye_left': 'E',
-            'eye_right': 'U'
-        }
-        
-        if servo not in servo_map:
-            valid_servos = ', '.join(servo_map.keys())
-            return jsonify({'status': 'Error', 'msg': f'Invalid servo. Valid servos: {valid_servos}'}), 400
+        try:
+            commands = servo_commands({servo: value})
+        except ValueError as e:
+            return jsonify({'status': 'Error', 'msg': str(e)}), 400
         
         global arduino
-        if arduino.is_connected():
-            arduino.send_command(f"{servo_map[servo]}{int(value)}")
+        if arduino.accepts_commands():
+            error = api_send(commands)
+            if error is not None:
+                return error
             return jsonify({'status': 'OK', 'servo': servo, 'value': int(value)})
         else:
             return jsonify({'status': 'Error', 'msg': 'Arduino not connected'}), 503
@@ -841,29 +1741,17 @@ def api_servo_multiple():
         if not servos or not isinstance(servos, dict):
             return jsonify({'status': 'Error', 'msg': 'servos must be a dictionary'}), 400
         
-        servo_map = {
-            'head_rotation': 'G',
-            'neck_top': 'T', 
-            'neck_bottom': 'B',
-            'arm_left': 'L',
-            'arm_right': 'R',
-            'eye_left': 'E',
-            'eye_right': 'U'
-        }
-        
         # Validate all servos first
-        for servo, value in servos.items():
-            if servo not in servo_map:
-                valid_servos = ', '.join(servo_map.keys())
-                return jsonify({'status': 'Error', 'msg': f'Invalid servo "{servo}". Valid servos: {valid_servos}'}), 400
-            
-            if not (0 <= value <= 100):
-                return jsonify({'status': 'Error', 'msg': f'Value for "{servo}" must be between 0 and 100'}), 400
+        try:
+            commands = servo_commands(servos)
+        except ValueError as e:
+            return jsonify({'status': 'Error', 'msg': str(e)}), 400
         
         global arduino
-        if arduino.is_connected():
-            for servo, value in servos.items():
-                arduino.send_command(f"{servo_map[servo]}{int(value)}")
+        if arduino.accepts_commands():
+            error = api_send(commands)
+            if error is not None:
+                return error
             return jsonify({'status': 'OK', 'servos': {k: int(v) for k, v in servos.items()}})
         else:
             return jsonify({'status': 'Error', 'msg': 'Arduino not connected'}), 503
@@ -884,17 +1772,17 @@ def api_animation():
         if not data:
             return jsonify({'status': 'Error', 'msg': 'No JSON data provided'}), 400
         
-        animation = data.get('animation')
-        if animation is None:
-            return jsonify({'status': 'Error', 'msg': 'animation number required'}), 400
-        
-        if not isinstance(animation, int) or animation < 0:
-            return jsonify({'status': 'Error', 'msg': 'animation must be a non-negative integer'}), 400
+        try:
+            commands = animation_commands(data)
+        except ValueError as e:
+            return jsonify({'status': 'Error', 'msg': str(e)}), 400
         
         global arduino
-        if arduino.is_connected():
-            arduino.send_command(f"A{animation}")
-            return jsonify({'status': 'OK', 'animation': animation})
+        if arduino.accepts_commands():
+            error = api_send(commands)
+            if error is not None:
+                return error
+            return jsonify({'status': 'OK', 'animation': data['animation']})
         else:
             return jsonify({'status': 'Error', 'msg': 'Arduino not connected'}), 503
     
@@ -902,6 +1790,162 @@ def api_animation():
         return jsonify({'status': 'Error', 'msg': str(e)}), 500
 
 
+@app.route('/api/keyframes', methods=['GET'])
+def api_keyframes():
+    """
+    API endpoint to list the keyframe animations in ANIMATION_FOLDER
+    :return: JSON response with the name, duration, loop flag and servos of each animation
+    """
+    return jsonify({'status': 'OK', 'animations': animation_engine.get_animations(),
+                    'playing': animation_engine.get_status()['playing']})
+
+
+@app.route('/api/keyframes', methods=['POST'])
+def api_keyframes_play():
+    """
+    API endpoint to play a keyframe animation, replacing the one which is playing
+    Accepts JSON: {"name": "animation file name without .json"}
+    :return: JSON response with success or error status
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'status': 'Error', 'msg': 'No JSON data provided'}), 400
+
+        try:
+            animation = animation_engine.get(data.get('name'))
+        except ValueError as e:
+            return jsonify({'status': 'Error', 'msg': str(e)}), 400
+        if animation is None:
+            return jsonify({'status': 'Error', 'msg': f'Unknown animation "{data.get("name")}"'}), 404
+
+        global arduino
+        if arduino.accepts_commands():
+            animation_engine.play(animation)
+            return jsonify({'status': 'OK', 'animation': animation.get_info()})
+        else:
+            return jsonify({'status': 'Error', 'msg': 'Arduino not connected'}), 503
+
+    except Exception as e:
+        return jsonify({'status': 'Error', 'msg': str(e)}), 500
+
+
+@app.route('/api/keyframes/stop', methods=['POST'])
+def api_keyframes_stop():
+    """
+    API endpoint to stop the keyframe animation which is playing; the servos stay where they are
+    :return: JSON response with success or error status
+    """
+    if not animation_engine.stop():
+        return jsonify({'status': 'Error', 'msg': 'No animation is playing'}), 409
+    return jsonify({'status': 'OK'})
+
+
+@app.route('/api/recordings', methods=['GET'])
+def api_recordings():
+    """
+    API endpoint to list the recorded control sessions in RECORDING_FOLDER
+    :return: JSON response with the recordings, and the recording and replay which are running
+    """
+    return jsonify({'status': 'OK', 'recordings': recorder.get_recordings(),
+                    'recording': recorder.get_status(), 'replay': session_player.get_status()})
+
+
+@app.route('/api/recordings/start', methods=['POST'])
+def api_recordings_start():
+    """
+    API endpoint to start recording the commands, sounds and speech sent to the robot
+    Accepts JSON: {"name": "letters, digits, _ or -"}
+    :return: JSON response with success or error status
+    """
+    data = request.get_json(silent=True) or {}
+
+    try:
+        started = recorder.start(data.get('name'))
+    except ValueError as e:
+        return jsonify({'status': 'Error', 'msg': str(e)}), 400
+    except OSError as e:
+        return jsonify({'status': 'Error', 'msg': str(e)}), 500
+
+    if not started:
+        return jsonify({'status': 'Error', 'msg': 'A recording is already running'}), 409
+    return jsonify({'status': 'OK', 'recording': recorder.get_status()})
+
+
+@app.route('/api/recordings/stop', methods=['POST'])
+def api_recordings_stop():
+    """
+    API endpoint to stop recording
+    :return: JSON response with the name, duration and number of entries of the recording
+    """
+    result = recorder.stop()
+    if result is None:
+        return jsonify({'status': 'Error', 'msg': 'No recording is running'}), 409
+    return jsonify({'status': 'OK', 'recording': result})
+
+
+@app.route('/api/replay', methods=['POST'])
+def api_replay():
+    """
+    API endpoint to replay a recorded control session
+    Accepts JSON: {"name": "recording", "speed": 1.0}
+    The speed is optional: 1 keeps the original timing, 2 is twice as fast, 0 replays without waiting
+    :return: JSON response with success or error status
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'status': 'Error', 'msg': 'No JSON data provided'}), 400
+
+        speed = data.get('speed', 1.0)
+        if not isinstance(speed, (int, float)) or not (0 <= speed <= 100):
+            return jsonify({'status': 'Error', 'msg': 'speed must be between 0 and 100'}), 400
+
+        path = recorder.get_path(data.get('name'))
+        if path is None:
+            return jsonify({'status': 'Error', 'msg': f'Unknown recording "{data.get("name")}"'}), 404
+        if recorder.get_status()['recording'] == data['name']:
+            return jsonify({'status': 'Error', 'msg': 'The recording is still running'}), 409
+
+        try:
+            _, entries = read_log(path)
+        except ValueError as e:
+            return jsonify({'status': 'Error', 'msg': str(e)}), 400
+
+        client = None
+        if any(entry.type == COMMANDS and drives(entry.payload.split("\n")) for entry in entries):
+            error = api_lease()
+            if error is not None:
+                return error
+            client = request_client()
+
+        global arduino
+        if not arduino.accepts_commands():
+            return jsonify({'status': 'Error', 'msg': 'Arduino not connected'}), 503
+
+        if not session_player.play(data['name'], entries, float(speed), client):
+            return jsonify({'status': 'Error', 'msg': 'A recording is already being replayed'}), 409
+
+        duration = entries[-1].time / speed if entries and speed > 0 else 0.0
+        return jsonify({'status': 'OK', 'entries': len(entries), 'duration': round(duration, 3)})
+
+    except Exception as e:
+        return jsonify({'status': 'Error', 'msg': str(e)}), 500
+
+
+@app.route('/api/replay/stop', methods=['POST'])
+def api_replay_stop():
+    """
+    API endpoint to stop replaying a recording; the motors are stopped
+    :return: JSON response with success or error status
+    """
+    if not session_player.stop():
+        return jsonify({'status': 'Error', 'msg': 'No recording is being replayed'}), 409
+
+    arduino.stop()
+    return jsonify({'status': 'OK'})
+
+
 @app.route('/api/settings', methods=['POST'])
 def api_settings():
     """
@@ -922,33 +1966,422 @@ def api_settings():
             return jsonify({'status': 'Error', 'msg': 'Both setting and value required'}), 400
         
         global arduino
-        if not arduino.is_connected():
+        if not arduino.accepts_commands():
             return jsonify({'status': 'Error', 'msg': 'Arduino not connected'}), 503
         
-        if setting == 'steering_offset':
-            if not (-100 <= value <= 100):
-                return jsonify({'status': 'Error', 'msg': 'steering_offset must be between -100 and 100'}), 400
-            arduino.send_command(f"S{int(value)}")
-            
-        elif setting == 'motor_deadzone':
-            if not (0 <= value <= 250):
-                return jsonify({'status': 'Error', 'msg': 'motor_deadzone must be between 0 and 250'}), 400
-            arduino.send_command(f"O{int(value)}")
-            
-        elif setting == 'auto_mode':
-            if value not in [0, 1]:
-                return jsonify({'status': 'Error', 'msg': 'auto_mode must be 0 or 1'}), 400
-            arduino.send_command(f"M{int(value)}")
-            
-        else:
-            return jsonify({'status': 'Error', 'msg': 'Invalid setting. Valid settings: steering_offset, motor_deadzone, auto_mode'}), 400
+        try:
+            commands = setting_commands(data)
+        except ValueError as e:
+            return jsonify({'status': 'Error', 'msg': str(e)}), 400
         
+        error = api_send(commands)
+        if error is not None:
+            return error
+
         return jsonify({'status': 'OK', 'setting': setting, 'value': int(value)})
     
     except Exception as e:
         return jsonify({'status': 'Error', 'msg': str(e)}), 500
 
 
+# Validators for each type of /api/batch operation, returning the serial commands
+BATCH_OPERATIONS: dict = {
+    'move': move_commands,
+    'servo': lambda op: servo_commands({op.get('servo'): op.get('value')}),
+    'servos': lambda op: servo_commands(op.get('servos')),
+    'animation': animation_commands,
+    'setting': setting_commands,
+}
+
+
+@app.route('/api/batch', methods=['POST'])
+def api_batch():
+    """
+    API endpoint to run a sequence of operations in one request
+    Accepts JSON: {"operations": [{"op": "move", "x": 50, "y": 0},
+                                  {"op": "servo", "servo": "arm_left", "value": 80, "delay": 0.5}, ...]}
+    Operations: move, servo, servos, animation, setting (same fields as their /api/* endpoints) and
+    audio ({"clip": name}). The optional delay is in seconds after the previous operation.
+    All operations are validated before any are run; operations without a delay are queued together
+    straight away, and later ones are run by the server at their scheduled time.
+    :return: JSON response with the result of each operation
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'status': 'Error', 'msg': 'No JSON data provided'}), 400
+
+        operations = data.get('operations')
+        max_operations = app.config.get('BATCH_MAX_OPERATIONS', 100)
+        if not isinstance(operations, list) or not operations:
+            return jsonify({'status': 'Error', 'msg': 'operations must be a non-empty list'}), 400
+        if len(operations) > max_operations:
+            return jsonify({'status': 'Error', 'msg': f'At most {max_operations} operations per batch'}), 400
+
+        # Validate everything up front, grouping the operations into steps at each delay
+        steps: list[tuple[float, list[str], list[str]]] = []
+        results: list[dict] = []
+        offset: float = 0.0
+
+        for op in operations:
+            try:
+                if not isinstance(op, dict):
+                    raise ValueError('operation must be an object')
+
+                delay = op.get('delay', 0)
+                if not isinstance(delay, (int, float)) or delay < 0:
+                    raise ValueError('delay must be a non-negative number of seconds')
+                offset += delay
+
+                if op.get('op') == 'audio':
+                    commands, clips = [], [audio_clip(op)]
+                elif op.get('op') in BATCH_OPERATIONS:
+                    commands, clips = BATCH_OPERATIONS[op['op']](op), []
+                else:
+                    raise ValueError(f'Invalid op. Valid ops: {", ".join(list(BATCH_OPERATIONS) + ["audio"])}')
+
+            except (ValueError, TypeError, AttributeError) as e:
+                results.append({'op': op.get('op') if isinstance(op, dict) else None, 'status': 'Error', 'msg': str(e)})
+                continue
+
+            if not steps or offset > steps[-1][0]:
+                steps.append((offset, [], []))
+            steps[-1][1].extend(commands)
+            steps[-1][2].extend(clips)
+            results.append({'op': op['op'], 'status': 'OK' if offset == 0 else 'Scheduled', 'at': offset})
+
+        if any(result['status'] == 'Error' for result in results):
+            return jsonify({'status': 'Error', 'msg': 'Invalid operations, nothing was run', 'results': results}), 400
+
+        if offset > app.config.get('BATCH_MAX_DURATION', 300):
+            return jsonify({'status': 'Error', 'msg': 'Batch lasts too long'}), 400
+
+        global arduino
+        all_commands = [command for _, commands, _ in steps for command in commands]
+        client = None
+        if drives(all_commands):
+            error = api_lease()
+            if error is not None:
+                return error
+            client = request_client()
+
+        if all_commands:
+            if not arduino.accepts_commands():
+                return jsonify({'status': 'Error', 'msg': 'Arduino not connected'}), 503
+
+            error = api_throttle(all_commands)
+            if error is not None:
+                return error
+
+        def run_step(commands: list[str], clips: list[str], wait_ack: bool = False,
+                     trace: TraceContext | None = None) -> bool:
+            sent = not commands or arduino.send_commands(commands, wait_ack,
+                                                         app.config.get('SERIAL_ACK_TIMEOUT', 1.0),
+                                                         trace=trace or TraceContext('/api/batch'))
+            for clip in clips:
+                try:
+                    play_audio(clip)
+                except OSError as ex:
+                    logger.error(f'Unable to play {clip}: {repr(ex)}')
+
+            if not sent and not wait_ack:
+                logger.warning(f'Batch step dropped, Arduino not connected: {commands}')
+            return sent
+
+        # Schedule the later steps first, so that nothing is run if the scheduler is full
+        batch_id = None
+        if steps[-1][0] > 0:
+            batch_id = batch_runner.schedule([(at, lambda c=commands, a=clips: run_step(c, a))
+                                              for at, commands, clips in steps if at > 0], client)
+            if batch_id is None:
+                return jsonify({'status': 'Error', 'msg': 'Too many batches scheduled, try again later'}), 429
+
+        # The first step is queued as one group, so no other commands can get in between
+        if steps[0][0] == 0:
+            _, commands, clips = steps[0]
+            wait_ack = request.args.get('ack', '').lower() in ('1', 'true', 'yes')
+            if not run_step(commands, clips, wait_ack, request_trace()):
+                # Nothing more of a batch which failed is run
+                if batch_id is not None:
+                    batch_runner.cancel(batch_id)
+                if not wait_ack or not arduino.accepts_commands():
+                    return jsonify({'status': 'Error', 'msg': 'Arduino not connected', 'results': results}), 503
+                return jsonify({'status': 'Error', 'msg': 'Arduino did not acknowledge the command',
+                                'results': results}), 504
+
+        return jsonify({'status': 'OK', 'results': results, 'batch': batch_id})
+
+    except Exception as e:
+        return jsonify({'status': 'Error', 'msg': str(e)}), 500
+
+
+# Servo presets of the Codeblock editor -> keyboard command
+PROGRAM_PRESETS: dict = {
+    'head_up': 'f',
+    'head_down': 'h',
+    'head_neutral': 'g',
+    'arms_left': 'm',
+    'arms_right': 'b',
+    'arms_neutral': 'n',
+    'eyes_left': 'j',
+    'eyes_right': 'l',
+    'eyes_neutral': 'k',
+    'eyes_sad': 'i'
+}
+
+# Turns of the Codeblock editor -> (direction, fraction of CODEBLOCK_TURNTIME)
+PROGRAM_TURNS: dict = {
+    'left_90': (1, 1.0),
+    'left_45': (1, 0.5),
+    'right_90': (-1, 1.0),
+    'right_45': (-1, 0.5)
+}
+
+PROGRAM_MAX_REPEAT: int = 10000     # Most runs of a loop which does not repeat forever
+
+
+def program_steps(operations: list) -> list[ProgramStep]:
+    """
+    Compile the operations of a Codeblock program into steps
+    Drive and turn operations use the CODEBLOCK_* calibration of the config.
+    :param operations: The operations, see api_program()
+    :return: The steps
+    :raise ValueError: If an operation is not valid
+    """
+    steps = []
+    first_steps = []    # Index of the first step of each operation
+
+    for index, op in enumerate(operations):
+        first_steps.append(len(steps))
+        try:
+            if not isinstance(op, dict):
+                raise ValueError('operation must be an object')
+
+            name = op.get('op')
+            block = op.get('block')
+            if block is not None and not isinstance(block, str):
+                raise ValueError('block must be a string')
+
+            if name == 'drive':
+                direction = op.get('direction')
+                distance = op.get('distance')
+                if direction not in (1, -1):
+                    raise ValueError('direction must be 1 (forward) or -1 (backward)')
+                if not isinstance(distance, (int, float)) or distance < 0:
+                    raise ValueError('distance must be a non-negative number of cm')
+
+                power = round(app.config['CODEBLOCK_MOTORPOWER'] * direction * 100)
+                steps.append(ProgramStep(name, block, ["X0", f"Y{power}"], None,
+                                         distance / app.config['CODEBLOCK_MOTORSPEED']))
+                steps.append(ProgramStep(name, block, ["X0", "Y0"], None, 0.0))
+
+            elif name == 'turn':
+                if op.get('turn') not in PROGRAM_TURNS:
+                    raise ValueError(f'Invalid turn. Valid turns: {", ".join(PROGRAM_TURNS)}')
+
+                direction, fraction = PROGRAM_TURNS[op['turn']]
+                power = round(app.config['CODEBLOCK_TURNPOWER'] * direction * 100)
+                steps.append(ProgramStep(name, block, [f"X{power}", "Y0"], None,
+                                         app.config['CODEBLOCK_TURNTIME'] * fraction))
+                steps.append(ProgramStep(name, block, ["X0", "Y0"], None, 0.0))
+
+            elif name == 'wait':
+                seconds = op.get('seconds')
+                if not isinstance(seconds, (int, float)) or seconds < 0:
+                    raise ValueError('seconds must be a non-negative number')
+                steps.append(ProgramStep(name, block, [], None, float(seconds)))
+
+            elif name == 'preset':
+                if op.get('preset') not in PROGRAM_PRESETS:
+                    raise ValueError(f'Invalid preset. Valid presets: {", ".join(PROGRAM_PRESETS)}')
+                steps.append(ProgramStep(name, block, [PROGRAM_PRESETS[op['preset']] + "0"], None, 0.0))
+
+            elif name == 'speak':
+                text = op.get('text')
+                if not isinstance(text, str) or not text:
+                    raise ValueError('text required')
+
+                # Speaking takes seconds, so it runs alongside the program as it did in the browser
+                steps.append(ProgramStep(name, block, [],
+                                         lambda t=text: Thread(target=speak, args=(t,), daemon=True).start(), 0.0))
+
+            elif name == 'audio':
+                path = audio_clip(op)
+                steps.append(ProgramStep(name, block, [], lambda p=path: play_audio(p), 0.0))
+
+            elif name == 'loop':
+                start = op.get('start')
+                times = op.get('times')
+                if not isinstance(start, int) or isinstance(start, bool) or not 0 <= start < index:
+                    raise ValueError('start must be the index of an earlier operation')
+                if not isinstance(times, int) or isinstance(times, bool) or not 0 <= times <= PROGRAM_MAX_REPEAT:
+                    raise ValueError(f'times must be from 1 to {PROGRAM_MAX_REPEAT}, or 0 to repeat forever')
+
+                # The body is the steps from start on; loops inside it must end inside it
+                body = first_steps[start]
+                if any(step.jump is not None and step.jump[0] < body for step in steps[body:]):
+                    raise ValueError('loops must not overlap')
+                # A loop which repeats forever without waiting would keep the program thread busy
+                if times == 0 and not any(step.wait for step in steps[body:]):
+                    raise ValueError('a loop which repeats forever must contain a wait, drive or turn')
+                steps.append(ProgramStep(name, block, [], None, 0.0, (body, times)))
+
+            elif name in BATCH_OPERATIONS:
+                steps.append(ProgramStep(name, block, BATCH_OPERATIONS[name](op), None, 0.0))
+
+            else:
+                valid_ops = ['drive', 'turn', 'wait', 'preset', 'speak', 'audio', 'loop'] + list(BATCH_OPERATIONS)
+                raise ValueError(f'Invalid op. Valid ops: {", ".join(valid_ops)}')
+
+        except (ValueError, TypeError, AttributeError) as e:
+            raise ValueError(f'Operation {index}: {e}') from e
+
+    return steps
+
+
+@app.route('/api/program', methods=['POST'])
+def api_program():
+    """
+    API endpoint to run a compiled Codeblock program on the server
+    Accepts JSON: {"program": [{"op": "drive", "direction": 1, "distance": 30, "block": "id"},
+                               {"op": "wait", "seconds": 1.5}, {"op": "turn", "turn": "left_90"}, ...]}
+    Operations: drive (direction 1 or -1, distance in cm), turn, wait (seconds), preset, speak (text),
+    audio (clip), loop (start: index of the first operation of the loop body, times: 0 = forever)
+    and the operations of /api/batch. The optional block is the id of the Blockly block,
+    which is reported in the progress events.
+    The steps are timed by the server; progress is published as "program" events on /api/events.
+    :return: JSON response with the id of the program
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'status': 'Error', 'msg': 'No JSON data provided'}), 400
+
+        operations = data.get('program')
+        max_steps = app.config.get('CODEBLOCK_MAX_STEPS', 1000)
+        if not isinstance(operations, list) or not operations:
+            return jsonify({'status': 'Error', 'msg': 'program must be a non-empty list'}), 400
+        if len(operations) > max_steps:
+            return jsonify({'status': 'Error', 'msg': f'At most {max_steps} operations per program'}), 400
+
+        try:
+            steps = program_steps(operations)
+        except ValueError as e:
+            return jsonify({'status': 'Error', 'msg': str(e)}), 400
+
+        # Programs which repeat forever run until they are aborted
+        duration = program_duration(steps)
+        if duration != math.inf and duration > app.config.get('CODEBLOCK_MAX_DURATION', 600):
+            return jsonify({'status': 'Error', 'msg': 'Program lasts too long'}), 400
+
+        client = None
+        if any(drives(step.commands) for step in steps):
+            error = api_lease()
+            if error is not None:
+                return error
+            client = request_client()
+
+        global arduino
+        if any(step.commands for step in steps) and not arduino.accepts_commands():
+            return jsonify({'status': 'Error', 'msg': 'Arduino not connected'}), 503
+
+        program_id = program_runner.start(steps, client)
+        if program_id is None:
+            return jsonify({'status': 'Error', 'msg': 'Another program is running'}), 409
+
+        return jsonify({'status': 'OK', 'program': program_id, 'steps': len(steps),
+                        'duration': round(duration, 3) if duration != math.inf else None})
+
+    except Exception as e:
+        return jsonify({'status': 'Error', 'msg': str(e)}), 500
+
+
+@app.route('/api/program', methods=['GET'])
+def api_program_status():
+    """
+    API endpoint to get the progress of the current (or last) Codeblock program
+    :return: JSON response with the state, current step and timing of the program
+    """
+    return jsonify({'status': 'OK', 'program': program_runner.get_status()})
+
+
+@app.route('/api/program/<action>', methods=['POST'])
+def api_program_control(action: str):
+    """
+    API endpoint to pause, resume or abort the running Codeblock program
+    Pausing and aborting stop the motors; resuming continues where the program left off
+    :param action: pause, resume or abort
+    :return: JSON response with the state of the program
+    """
+    controls = {'pause': program_runner.pause, 'resume': program_runner.resume, 'abort': program_runner.abort}
+    if action not in controls:
+        return jsonify({'status': 'Error', 'msg': 'Invalid action. Valid actions: pause, resume, abort'}), 404
+
+    if not controls[action]():
+        # A paused program which drives can only be resumed while no other client holds the lease
+        if action == 'resume' and program_runner.get_status()['state'] == 'paused':
+            data, retry_header = lease_refused(control_lease.get_status()['remaining'])
+            response = jsonify(dict(data, program=program_runner.get_status()))
+            response.headers['Retry-After'] = retry_header
+            return response, 409
+
+        return jsonify({'status': 'Error', 'msg': f'No program to {action}',
+                        'program': program_runner.get_status()}), 409
+
+    return jsonify({'status': 'OK', 'program': program_runner.get_status()})
+
+
+@app.route('/api/lease', methods=['GET'])
+def api_lease_status():
+    """
+    API endpoint to see which client holds the motion lease
+    :return: JSON response with the state of the lease, and whether the caller holds it
+    """
+    client, _ = request_client()
+    return jsonify({'status': 'OK', 'lease': control_lease.get_status(), 'holding': control_lease.holds(client)})
+
+
+@app.route('/api/lease', methods=['POST'])
+def api_lease_acquire():
+    """
+    API endpoint to take the motion lease before driving
+    Accepts JSON: {"force": false}
+    With force, the lease is taken over from the client holding it: its programs, batches and replays are
+    stopped, and so are the motors.
+    :return: JSON response with the state of the lease, or 409 if another client holds it
+    """
+    data = request.get_json(silent=True) or {}
+    force = data.get('force') is True
+
+    client, _ = request_client()
+    if force and not control_lease.holds(client) and control_lease.get_status()['holder'] is not None:
+        batch_runner.cancel_others(client)
+        if program_runner.client is not None and program_runner.client[0] != client:
+            program_runner.abort()
+        if session_player.client is not None and session_player.client[0] != client:
+            session_player.stop()
+        arduino.stop()
+
+    error = api_lease(force)
+    if error is not None:
+        return error
+    return jsonify({'status': 'OK', 'lease': control_lease.get_status()})
+
+
+@app.route('/api/lease/release', methods=['POST'])
+def api_lease_release():
+    """
+    API endpoint to give up the motion lease, so that other clients can drive straight away
+    :return: JSON response with success or error status
+    """
+    client, _ = request_client()
+    if not control_lease.release(client):
+        if control_lease.holds(client) and control_lease.get_status()['runs']:
+            return jsonify({'status': 'Error', 'msg': 'A program, batch or replay of this client is still running'}), 409
+        return jsonify({'status': 'Error', 'msg': 'The motion lease is not held by this client'}), 409
+    return jsonify({'status': 'OK'})
+
+
 @app.route('/api/status', methods=['GET'])
 def api_status():
     """
@@ -960,8 +2393,23 @@ def api_status():
         
         status = {
             'arduino_connected': arduino.is_connected(),
+            'serial_link': supervisor.get_status(),
+            'control_clients': control_socket.clients,
             'battery_level': arduino.get_battery_level(),
-            'camera_active': camera.is_stream_active()
+            'camera_active': camera.is_stream_active(),
+            'serial_acks': arduino.get_ack_stats(),
+            'stop_latency': arduino.get_stop_latency(),
+            'serial_protocol': arduino.get_protocol(),
+            'serial_queue_depth': arduino.get_queue_depth(),
+            'serial_budget': arduino.get_budget_stats(),
+            'batches': batch_runner.get_stats(),
+            'program': program_runner.get_status(),
+            'keyframes': animation_engine.get_status(),
+            'recording': recorder.get_status(),
+            'replay': session_player.get_status(),
+            'lease': control_lease.get_status(),
+            'audio': audio_engine.get_status(),
+            'event_streams': events.get_stats()
         }
         
         return jsonify({'status': 'OK', 'robot_status': status})
@@ -970,17 +2418,117 @@ def api_status():
         return jsonify({'status': 'Error', 'msg': str(e)}), 500
 
 
+@app.route('/api/telemetry', methods=['GET'])
+def api_telemetry():
+    """
+    API endpoint to get the most recent messages received from the Arduino
+    Optional query parameters: type (e.g. battery, echo, error, unknown), limit
+    :return: JSON response with the messages and counters
+    """
+    try:
+        global arduino
+        event_type = request.args.get('type')
+        limit = request.args.get('limit', type=int)
+
+        return jsonify({'status': 'OK',
+                        'events': arduino.get_telemetry(event_type, limit),
+                        'stats': arduino.get_telemetry_stats()})
+
+    except Exception as e:
+        return jsonify({'status': 'Error', 'msg': str(e)}), 500
+
+
+@app.route('/api/events', methods=['GET'])
+def api_events():
+    """
+    API endpoint streaming status changes as Server-Sent Events
+    Optional query parameter: types (comma separated, default: arduino,battery,camera;
+    "ack" adds an event for every command echoed by the Arduino)
+    The first event is a "status" snapshot; a comment is sent every 15 seconds to keep the stream open
+    :return: text/event-stream response
+    """
+    types = set(request.args.get('types', 'arduino,battery,camera').split(','))
+    subscription = events.subscribe(types)
+    if subscription is None:
+        return jsonify({'status': 'Error', 'msg': 'Too many event streams open'}), 503
+
+    snapshot = {
+        'arduino_connected': arduino.is_connected(),
+        'serial_link': supervisor.get_status(),
+        'battery_level': arduino.get_battery_level(),
+        'camera_active': camera.is_stream_active()
+    }
+
+    # Waitress can report a closed connection without waiting for a write to fail
+    disconnected = request.environ.get('waitress.client_disconnected', lambda: False)
+
+    def stream():
+        try:
+            yield f"event: status\ndata: {json.dumps(snapshot)}\n\n"
+            idle = 0
+
+            while not disconnected():
+                event = subscription.get(timeout=1)
+                if event is not None:
+                    idle = 0
+                    yield f"id: {event.id}\nevent: {event.type}\ndata: {json.dumps(event.data)}\n\n"
+                else:
+                    idle += 1
+                    if idle >= 15:
+                        idle = 0
+                        yield ": keep-alive\n\n"
+
+        finally:
+            events.unsubscribe(subscription)
+
+    response = Response(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/api/traces', methods=['GET'])
+def api_traces():
+    """
+    API endpoint to get the most recent command traces
+    Query parameter: limit (default 50)
+    :return: JSON response with the traces, and the p50/p99 latency of each stage
+    """
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({'status': 'Error', 'msg': 'limit must be a number'}), 400
+
+    return jsonify({'status': 'OK', 'summary': tracer.get_summary(), 'traces': tracer.get_traces(limit)})
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Request latencies and the state of the robot, for scraping by Prometheus
+    :return: Metrics in the Prometheus text format
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/api/stop', methods=['POST'])
 def api_stop():
     """
     API endpoint to stop all robot movement
+    The stop is sent ahead of any queued commands, and drops pending movement commands.
+    Scheduled batch steps, the running Codeblock program, keyframe animation and replay are cancelled.
     :return: JSON response with success or error status
     """
     try:
         global arduino
-        if arduino.is_connected():
-            arduino.send_command("X0")
-            arduino.send_command("Y0")
+        if arduino.accepts_commands():
+            batch_runner.cancel_all()
+            program_runner.abort()
+            animation_engine.stop()
+            session_player.stop()
+            error = api_send(["X0", "Y0"], urgent=True)
+            if error is not None:
+                return error
             return jsonify({'status': 'OK', 'msg': 'Robot stopped'})
         else:
             return jsonify({'status': 'Error', 'msg': 'Arduino not connected'}), 503
@@ -990,6 +2538,216 @@ def api_stop():
 
 
 
+###############################################################
+#
+# Asynchronous serving mode (SERVER_MODE = "asgi")
+# Motion control and slow media routes run as coroutines on the
+# event loop; all other routes run on the Flask thread pool
+#
+###############################################################
+
+asgi_app: AsgiApp = AsgiApp(app, app.config.get('ASGI_THREADS', 4) + app.config.get('EVENTS_MAX_CLIENTS', 4),
+                             metrics.observe_request)
+async_arduino: AsyncArduinoDevice = AsyncArduinoDevice(arduino)
+
+
+def async_login_redirect() -> AsgiResponse:
+    """
+    Send a client which is not logged in to the login page
+    :return: Redirect response
+    """
+    return 302, [('Location', '/login')], b''
+
+
+async def async_api_send(req: AsgiRequest, commands: list[str], urgent: bool = False) -> AsgiResponse | None:
+    """
+    Send commands for an API request, see api_send()
+    :param req:      The request
+    :param commands: The commands to be sent, in order
+    :param urgent:   Send ahead of all other queued commands (never throttled)
+    :return: Error response if the commands were not sent (or acknowledged, in ack mode), otherwise None
+    """
+    if not urgent:
+        retry_after = async_arduino.admit(commands)
+        if retry_after > 0:
+            status, headers, body = json_response({'status': 'Error', 'msg': 'Serial bandwidth exceeded, slow down'}, 429)
+            return status, headers + [('Retry-After', str(max(1, math.ceil(retry_after))))], body
+
+    wait_ack = req.args.get('ack', '').lower() in ('1', 'true', 'yes')
+    trace = TraceContext(req.path, req.received, force='x-trace' in req.headers or req.args.get('trace') == '1')
+    if not await async_arduino.send_commands(commands, wait_ack, app.config.get('SERIAL_ACK_TIMEOUT', 1.0), urgent,
+                                             trace):
+        return json_response({'status': 'Error', 'msg': 'Arduino did not acknowledge the command'}, 504)
+
+    return None
+
+
+def async_lease(req: AsgiRequest) -> AsgiResponse | None:
+    """
+    Check the motion lease for the drive commands of a request, see api_lease()
+    :param req: The request
+    :return: 409 response with a Retry-After header if another client holds the lease, otherwise None
+    """
+    client, name = lease_client(req.headers, req.address, cookie_session(req.headers))
+    retry_after = control_lease.admit(client, name)
+    if retry_after > 0:
+        data, retry_header = lease_refused(retry_after)
+        status, headers, body = json_response(data, 409)
+        return status, headers + [('Retry-After', retry_header)], body
+
+    return None
+
+
+# =============================================================
+@asgi_app.route('/api/stop', methods=('POST',))
+async def async_api_stop(req: AsgiRequest) -> AsgiResponse:
+    """
+    Stop all robot movement, see api_stop()
+    :return: JSON response with success or error status
+    """
+    if not async_arduino.accepts_commands():
+        return json_response({'status': 'Error', 'msg': 'Arduino not connected'}, 503)
+
+    batch_runner.cancel_all()
+    program_runner.abort()
+    animation_engine.stop()
+    session_player.stop()
+    error = await async_api_send(req, ["X0", "Y0"], urgent=True)
+    if error is not None:
+        return error
+    return json_response({'status': 'OK', 'msg': 'Robot stopped'})
+
+
+# =============================================================
+@asgi_app.route('/api/move', methods=('POST',))
+async def async_api_move(req: AsgiRequest) -> AsgiResponse:
+    """
+    Control robot movement, see api_move()
+    :return: JSON response with success or error status
+    """
+    data = req.get_json()
+    if not data:
+        return json_response({'status': 'Error', 'msg': 'No JSON data provided'}, 400)
+
+    try:
+        commands = move_commands(data)
+    except (ValueError, TypeError) as e:
+        return json_response({'status': 'Error', 'msg': str(e)}, 400)
+
+    error = async_lease(req)
+    if error is not None:
+        return error
+
+    if not async_arduino.accepts_commands():
+        return json_response({'status': 'Error', 'msg': 'Arduino not connected'}, 503)
+
+    error = await async_api_send(req, commands)
+    if error is not None:
+        return error
+    return json_response({'status': 'OK', 'x': int(data['x']), 'y': int(data['y'])})
+
+
+# =============================================================
+@asgi_app.route('/motor', methods=('POST',))
+async def async_motor(req: AsgiRequest) -> AsgiResponse:
+    """
+    Control the main movement motors, see motor()
+    :return: JSON response with success or error status
+    """
+    if not control_socket_authorized(req.headers):
+        return async_login_redirect()
+
+    stickX = req.form.get('stickX')
+    stickY = req.form.get('stickY')
+
+    if stickX is None or stickY is None:
+        return json_response({'status': 'Error', 'msg': 'Unable to read POST data'})
+
+    client, name = lease_client(req.headers, req.address, cookie_session(req.headers))
+    retry_after = control_lease.admit(client, name)
+    if retry_after > 0:
+        return json_response(lease_refused(retry_after)[0])
+
+    if not async_arduino.accepts_commands():
+        return json_response({'status': 'Error', 'msg': 'Arduino not connected'})
+
+    await async_arduino.send_commands([f"X{int(float(stickX) * 100)}", f"Y{int(float(stickY) * 100)}"],
+                                      trace=TraceContext(req.path, req.received))
+    return json_response({'status': 'OK'})
+
+
+# =============================================================
+@asgi_app.route('/tts', methods=('POST',))
+async def async_tts(req: AsgiRequest) -> AsgiResponse:
+    """
+    Text to Speech on the Raspberry Pi, see tts()
+    The speech programs are awaited, so no thread is held while they run.
+    :return: JSON response with success or error status
+    """
+    if not control_socket_authorized(req.headers):
+        return async_login_redirect()
+
+    text = req.form.get('text')
+    if text is None or text == "":
+        return json_response({'status': 'Error', 'msg': 'Unable to read POST data'})
+
+    recorder.record(SPEECH, text)
+    with tempfile.NamedTemporaryFile() as infile, tempfile.NamedTemporaryFile() as outfile:
+        for command in tts_commands(text, infile.name, outfile.name):
+            await run_command(command)
+
+    return json_response({'status': 'OK'})
+
+
+# =============================================================
+@asgi_app.route('/settings', methods=('POST',))
+async def async_settings(req: AsgiRequest) -> AsgiResponse | None:
+    """
+    Turn the camera stream on or off, see settings()
+    Other settings are passed on to the Flask route.
+    :return: JSON response with success or error status
+    """
+    if req.form.get('type') != "streamer" or req.form.get('value') is None:
+        return None
+
+    if not control_socket_authorized(req.headers):
+        return async_login_redirect()
+
+    logging.info("Turning on/off MJPG Streamer")
+
+    if not camera.is_stream_active():
+        response, error = await asyncio.to_thread(camera.start_stream)
+        if response:
+            await asyncio.sleep(1) # Give time for the stream to start fully
+            return json_response({'status': 'OK', 'streamer': 'Active'})
+        else:
+            return json_response({'status': 'Error', 'msg': f'Unable to start stream: {error}'})
+
+    else:
+        if await asyncio.to_thread(camera.stop_stream):
+            return json_response({'status': 'OK', 'streamer': 'Offline'})
+        else:
+            return json_response({'status': 'Error', 'msg': 'Unable to stop the stream'})
+
+
+
+# =============================================================
+def serve_app(host: str, port: int, mode: str = "waitress"):
+    """
+    Serve the web-interface in production mode; only returns once the server has stopped
+    :param host: Address to listen on
+    :param port: Port to listen on
+    :param mode: "waitress" to serve on a thread pool, or "asgi" to serve on the asyncio
+                 event loop (falls back to waitress if uvicorn is not installed)
+    """
+    if mode == "asgi" and serve_asgi(asgi_app, host, port):
+        return
+
+    # Each open /api/events stream keeps a thread busy
+    serve(app, host=host, port=port,
+          threads=4 + app.config.get('EVENTS_MAX_CLIENTS', 4), channel_request_lookahead=1)
+
+
 ###############################################################
 #
 # Program start code, which initialises the web-interface
@@ -997,10 +2755,14 @@ def api_stop():
 ###############################################################
 
 if __name__ == '__main__':
+    # WebSocket control channel for the joystick and gamepad
+    if app.config.get('CONTROL_SOCKET_PORT', 5001):
+        control_socket.start()
+
     # Debug mode
     if app.config['APP_DEBUG']:
         app.run(port=app.config['APP_PORT'], debug=app.config['APP_DEBUG'], host='0.0.0.0')
     
     # Production mode
     else:
-        serve(app, host='0.0.0.0', port=app.config['APP_PORT'])
+        serve_app('0.0.0.0', app.config['APP_PORT'], app.config.get('SERVER_MODE', "waitress"))
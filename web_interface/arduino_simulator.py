@@ -0,0 +1,272 @@
+"""
+Simulated Wall-E Arduino on a pseudo-terminal
+
+Mimics the serial protocol of wall-e/wall-e.ino, so that ArduinoDevice
+and the web interface can be tested and benchmarked without a robot:
+- every command is echoed back as <firstChar><number>, after a
+  configurable processing delay (plus optional random jitter)
+- "Battery_<n>" is printed periodically
+- text commands are cut off at MAX_SERIAL_LENGTH characters, in the
+  same way as the firmware's readSerial()
+- binary pose frames and the "P" protocol query are supported
+- the link can be stalled or disconnected on demand
+
+Run on its own to get a port which the web interface can connect to:
+    python3 arduino_simulator.py --delay 0.5 --jitter 2
+"""
+
+import argparse
+import logging
+import os
+import pty
+import random
+import select
+import time
+import tty
+from threading import Event, Lock, Thread
+
+import binary_protocol
+from command_tracker import MAX_SERIAL_LENGTH, ATOI_PATTERN
+
+
+# ================================================================
+class ArduinoSimulator:
+    """Pseudo-terminal which behaves like the Wall-E Arduino sketch"""
+
+    def __init__(self, processing_delay: float = 0.0, jitter: float = 0.0,
+                 battery_interval: float = 10.0, battery_level: int = 80,
+                 binary_frames: bool = True):
+        """
+        Constructor
+        :param processing_delay: Seconds taken to evaluate each command
+        :param jitter:           Maximum random extra delay in seconds added to each command
+        :param battery_interval: Seconds between battery level messages (0 to disable)
+        :param battery_level:    Battery percentage which is reported
+        :param binary_frames:    Reply to the protocol query, accepting binary pose frames
+        """
+        self.processing_delay: float = processing_delay
+        self.jitter: float = jitter
+        self.battery_interval: float = battery_interval
+        self.battery_level: int = battery_level
+        self.binary_frames: bool = binary_frames
+
+        self.master: int | None = None
+        self.slave: int | None = None
+        self.port: str = ""
+        self.thread: Thread | None = None
+        self.exit_flag: Event = Event()
+        self.stalled_until: float = 0.0
+
+        # Commands evaluated so far, as (time, firstChar, number)
+        self.lock: Lock = Lock()
+        self.commands: list = []
+
+        # Parser state, equivalent to the globals in wall-e.ino
+        self.first_char: str = ""
+        self.serial_buffer: str = ""
+        self.serial_length: int = 0
+        self.frame: bytearray | None = None
+
+    # ------------------------------------------------------------
+    def start(self) -> str:
+        """
+        Open the pseudo-terminal and start responding to commands
+        :return: Path of the serial port to connect to
+        """
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+        self.exit_flag.clear()
+        self.thread = Thread(target=self.__simulator_thread, daemon=True)
+        self.thread.start()
+
+        self.__print("--- Wall-E Control Sketch (Simulator) ---")
+        self.__print("Starting up the servo motors")
+        self.__print("Startup complete; entering main loop")
+        return self.port
+
+    # ------------------------------------------------------------
+    def stop(self):
+        """
+        Stop the simulator and close the pseudo-terminal
+        """
+        self.exit_flag.set()
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+
+        self.master = None
+        self.slave = None
+
+    # ------------------------------------------------------------
+    def disconnect(self):
+        """
+        Simulate the USB cable being pulled; the port stops working for the connected client
+        """
+        logging.info(f'Simulator: disconnecting {self.port}')
+        self.stop()
+
+    # ------------------------------------------------------------
+    def stall(self, seconds: float):
+        """
+        Stop processing commands for a while, e.g. to simulate a blocking animation
+        :param seconds: Duration of the stall
+        """
+        self.stalled_until = time.monotonic() + seconds
+
+    # ------------------------------------------------------------
+    def get_commands(self) -> list:
+        """
+        Get the commands which have been evaluated so far
+        :return: List of (monotonic time, firstChar, number)
+        """
+        with self.lock:
+            return list(self.commands)
+
+    # ------------------------------------------------------------
+    def __simulator_thread(self):
+        """Read and evaluate incoming bytes, and send periodic status messages"""
+        next_battery = time.monotonic() + self.battery_interval
+
+        while not self.exit_flag.is_set():
+            try:
+                readable, _, _ = select.select([self.master], [], [], 0.05)
+
+                if readable:
+                    for byte in os.read(self.master, 1024):
+                        self.__read_byte(byte)
+
+                if self.battery_interval > 0 and time.monotonic() >= next_battery:
+                    next_battery = time.monotonic() + self.battery_interval
+                    self.__print(f"Battery_{self.battery_level}")
+
+            except OSError:
+                break
+
+    # ------------------------------------------------------------
+    def __read_byte(self, byte: int):
+        """
+        Equivalent of readSerial() in wall-e.ino
+        :param byte: The received byte
+        """
+        if self.frame is not None:
+            self.frame.append(byte)
+            if self.frame[0] != binary_protocol.OP_POSE:
+                self.__print("Error: Unknown binary frame")
+                self.frame = None
+            elif len(self.frame) == binary_protocol.POSE_FRAME_SIZE - 1:
+                self.__evaluate_frame(self.frame)
+                self.frame = None
+
+        elif byte == binary_protocol.FRAME_START and self.serial_length == 0 and self.binary_frames:
+            self.frame = bytearray()
+
+        elif byte in (ord('\n'), ord('\r')):
+            if self.serial_length > 0:
+                self.__evaluate()
+            self.serial_buffer = ""
+            self.serial_length = 0
+
+        else:
+            if self.serial_length == 0:
+                self.first_char = chr(byte)
+            else:
+                self.serial_buffer += chr(byte)
+            self.serial_length += 1
+
+            # The firmware evaluates the buffer as soon as it is full
+            if self.serial_length == MAX_SERIAL_LENGTH:
+                self.__evaluate()
+                self.serial_buffer = ""
+                self.serial_length = 0
+
+    # ------------------------------------------------------------
+    def __evaluate(self):
+        """Equivalent of evaluateSerial() in wall-e.ino"""
+        value = ATOI_PATTERN.match(self.serial_buffer)
+        number = int(value.group(1)) if value else 0
+
+        self.__process(self.first_char, number)
+        self.__print(f"{self.first_char}{number}")
+
+        if self.first_char == 'P' and self.binary_frames:
+            self.__print(f"Protocol_{binary_protocol.PROTOCOL_VERSION}")
+
+    # ------------------------------------------------------------
+    def __evaluate_frame(self, frame: bytearray):
+        """
+        Equivalent of evaluateFrame() in wall-e.ino
+        :param frame: Opcode, payload and checksum of a pose frame
+        """
+        checksum = 0
+        for byte in frame[:-1]:
+            checksum ^= byte
+
+        if checksum != frame[-1]:
+            self.__print("Error: Binary frame checksum")
+            return
+
+        self.__process('Q', checksum)
+        self.__print(f"Q{checksum}")
+
+    # ------------------------------------------------------------
+    def __process(self, first_char: str, number: int):
+        """
+        Spend the processing time for a command and record it
+        :param first_char: Command character
+        :param number:     Command value
+        """
+        while time.monotonic() < self.stalled_until and not self.exit_flag.is_set():
+            time.sleep(0.01)
+
+        delay = self.processing_delay + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        with self.lock:
+            self.commands.append((time.monotonic(), first_char, number))
+
+    # ------------------------------------------------------------
+    def __print(self, message: str):
+        """
+        Equivalent of Serial.println()
+        :param message: Line to send to the connected client
+        """
+        if self.master is not None:
+            os.write(self.master, f"{message}\r\n".encode())
+
+
+###############################################################
+#
+# Run the simulator on its own
+#
+###############################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulated Wall-E Arduino on a pseudo-terminal")
+    parser.add_argument('--delay', type=float, default=0.0, help="processing delay per command (ms)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="maximum random extra delay per command (ms)")
+    parser.add_argument('--battery', type=float, default=10.0, help="seconds between battery messages")
+    parser.add_argument('--text-only', action='store_true', help="do not accept binary frames")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    simulator = ArduinoSimulator(args.delay / 1000, args.jitter / 1000, args.battery,
+                                 binary_frames=not args.text_only)
+    print(f"Simulated Arduino listening on {simulator.start()}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
@@ -0,0 +1,384 @@
+"""
+Asynchronous (ASGI) serving mode for the web interface
+
+Under waitress every request holds one thread of a fixed pool until it
+has finished, so a few slow media requests (text to speech runs espeak,
+rubberband and aplay one after another) can use up every worker and
+delay an emergency stop.
+
+In this mode the app is served by uvicorn on an asyncio event loop
+instead. Latency-critical and slow routes are registered as native
+coroutines: motion commands go through AsyncArduinoDevice, which never
+blocks the loop, and subprocesses are awaited rather than waited for in
+a thread. All other Flask routes run unchanged on a bounded thread pool,
+so they cannot hold up the coroutines either.
+
+Requires uvicorn (sudo apt-get install python3-uvicorn); select it with
+SERVER_MODE = "asgi" in the config. Waitress remains the default.
+"""
+
+import asyncio
+import io
+import json
+import logging
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable
+from urllib.parse import parse_qs
+
+
+# ================================================================
+class AsyncArduinoDevice:
+    """Non-blocking facade over ArduinoDevice for use on the event loop"""
+
+    def __init__(self, device):
+        """
+        Constructor
+        :param device: The ArduinoDevice
+        """
+        self.device = device
+
+    # ------------------------------------------------------------
+    def accepts_commands(self) -> bool:
+        """
+        Check if commands can be sent, see ArduinoDevice.accepts_commands()
+        :return: True if commands can be sent
+        """
+        return self.device.accepts_commands()
+
+    # ------------------------------------------------------------
+    def admit(self, commands: list[str]) -> float:
+        """
+        Check commands against the serial bandwidth budget, see ArduinoDevice.admit()
+        :param commands: The commands which are about to be sent
+        :return: 0 if the commands can be sent, otherwise the seconds until the budget allows them
+        """
+        return self.device.admit(commands)
+
+    # ------------------------------------------------------------
+    async def send_commands(self, commands: list[str], wait_ack: bool = False, timeout: float = 1.0,
+                            urgent: bool = False, trace=None) -> bool:
+        """
+        Send a group of serial commands, see ArduinoDevice.send_commands()
+        Waiting for the echoes suspends only the calling coroutine.
+        :param commands: The commands to be sent, in order
+        :param wait_ack: Wait until the Arduino has echoed all of the commands back
+        :param timeout:  Maximum time in seconds to wait for the echoes
+        :param urgent:   Send ahead of everything else in the queue
+        :param trace:    Request the commands came from, for tracing (TraceContext)
+        :return: True if the commands have been queued (and acknowledged, if wait_ack)
+        """
+        if not wait_ack or not commands:
+            return self.device.track_commands(commands, False, urgent, trace) is not None
+
+        # The reader thread hands each echo over to the event loop, which completes the future after the last one
+        loop = asyncio.get_running_loop()
+        echoed = loop.create_future()
+        remaining = len(commands)
+
+        def on_echo():
+            nonlocal remaining
+            remaining -= 1
+            if remaining == 0 and not echoed.done():
+                echoed.set_result(True)
+
+        tracked = self.device.track_commands(commands, True, urgent, trace,
+                                             lambda: loop.call_soon_threadsafe(on_echo))
+        if tracked is None:
+            return False
+
+        try:
+            return await asyncio.wait_for(echoed, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.device.forget_commands([ticket for ticket, _ in tracked])
+
+    # ------------------------------------------------------------
+    async def stop(self, wait_ack: bool = False, timeout: float = 1.0) -> bool:
+        """
+        Stop the main motors ahead of any queued commands, see ArduinoDevice.stop()
+        :param wait_ack: Wait until the Arduino has echoed the stop commands back
+        :param timeout:  Maximum time in seconds to wait for the echoes
+        :return: True if the stop has been queued (and acknowledged, if wait_ack)
+        """
+        return await self.send_commands(["X0", "Y0"], wait_ack, timeout, urgent=True)
+
+
+# ------------------------------------------------------------
+async def run_command(command: list) -> int:
+    """
+    Run a program without blocking the event loop
+    :param command: Program and arguments
+    :return: Exit code of the program
+    """
+    process = await asyncio.create_subprocess_exec(*command,
+                                                   stdout=subprocess.DEVNULL,
+                                                   stderr=subprocess.DEVNULL)
+    return await process.wait()
+
+
+# ================================================================
+class AsgiRequest:
+    """HTTP request received by a native route"""
+
+    def __init__(self, scope: dict, body: bytes):
+        """
+        Constructor
+        :param scope: ASGI connection scope
+        :param body:  Request body
+        """
+        self.received: float = time.monotonic()
+        self.method: str = scope['method']
+        self.path: str = scope['path']
+        self.args: dict = {k: v[-1] for k, v in parse_qs(scope.get('query_string', b'').decode()).items()}
+        self.headers: dict = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+        self.address: str = (scope.get('client') or ("",))[0]
+        self.body: bytes = body
+
+    # ------------------------------------------------------------
+    @property
+    def form(self) -> dict:
+        """URL encoded form data of the request"""
+        return {k: v[-1] for k, v in parse_qs(self.body.decode()).items()}
+
+    # ------------------------------------------------------------
+    def get_json(self):
+        """
+        Decode the JSON body of the request
+        :return: The decoded data, or None if the body is not valid JSON
+        """
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            return None
+
+
+# A native route returns (status code, headers, body)
+AsgiResponse = tuple[int, list[tuple[str, str]], bytes]
+
+
+# ------------------------------------------------------------
+def json_response(data: dict, status: int = 200) -> AsgiResponse:
+    """
+    Build the response of a native route
+    :param data:   Data to be sent as JSON
+    :param status: HTTP status code
+    :return: The response
+    """
+    return status, [('Content-Type', 'application/json')], json.dumps(data).encode()
+
+
+# ================================================================
+class AsgiApp:
+    """ASGI application with native coroutine routes, falling back to a WSGI app on a thread pool"""
+
+    def __init__(self, wsgi_app, threads: int = 4, observer: Callable[[str, str, int, float], None] | None = None):
+        """
+        Constructor
+        :param wsgi_app: The Flask app
+        :param threads:  Size of the thread pool which runs the Flask routes
+        :param observer: Function called with (route, method, status, seconds) after each native route
+        """
+        self.wsgi_app = wsgi_app
+        self.observer = observer
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(threads, thread_name_prefix="wsgi")
+        self.routes: dict = {}
+
+    # ------------------------------------------------------------
+    def route(self, path: str, methods: tuple = ('GET',)):
+        """
+        Decorator registering a coroutine which handles a route on the event loop
+        If the coroutine returns None, the request is passed on to the Flask app.
+        :param path:    URL path
+        :param methods: HTTP methods handled
+        """
+        def register(handler: Callable[[AsgiRequest], Awaitable[AsgiResponse | None]]):
+            for method in methods:
+                self.routes[(method, path)] = handler
+            return handler
+
+        return register
+
+    # ------------------------------------------------------------
+    async def __call__(self, scope: dict, receive, send):
+        """ASGI entry point"""
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    self.executor.shutdown(wait=False)
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+
+        if scope['type'] != 'http':
+            return
+
+        body = bytearray()
+        while True:
+            message = await receive()
+            body.extend(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+
+        response = None
+        handler = self.routes.get((scope['method'], scope['path']))
+
+        if handler is not None:
+            start = time.perf_counter()
+            try:
+                response = await handler(AsgiRequest(scope, bytes(body)))
+            except Exception as ex:
+                logging.error(f'Error in {scope["path"]}: {repr(ex)}')
+                response = json_response({'status': 'Error', 'msg': str(ex)}, 500)
+
+            if response is not None and self.observer is not None:
+                self.observer(scope['path'], scope['method'], response[0], time.perf_counter() - start)
+
+        if response is None:
+            await self.__run_wsgi(scope, bytes(body), receive, send)
+            return
+
+        status, headers, content = response
+
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]})
+        await send({'type': 'http.response.body', 'body': content})
+
+    # ------------------------------------------------------------
+    async def __run_wsgi(self, scope: dict, body: bytes, receive, send):
+        """
+        Run a Flask route on the thread pool, streaming its response back
+        :param scope:   ASGI connection scope
+        :param body:    Request body
+        :param receive: ASGI receive function, used to notice the client disconnecting
+        :param send:    ASGI send function
+        """
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+        disconnected = asyncio.Event()
+        environ = self.__environ(scope, body)
+
+        # Streaming routes (e.g. /api/events) check this to stop when the client has gone
+        environ['waitress.client_disconnected'] = disconnected.is_set
+
+        def run():
+            started = []
+
+            def start_response(status, headers, exc_info=None):
+                started.append((int(status.split(' ', 1)[0]), headers))
+
+            try:
+                result = self.wsgi_app(environ, start_response)
+                try:
+                    for chunk in result:
+                        if disconnected.is_set():
+                            break
+                        loop.call_soon_threadsafe(chunks.put_nowait, (started[0], chunk))
+                    loop.call_soon_threadsafe(chunks.put_nowait, (started[0], None))
+                finally:
+                    if hasattr(result, 'close'):
+                        result.close()
+
+            except Exception as ex:
+                logging.error(f'Error in {scope["path"]}: {repr(ex)}')
+                loop.call_soon_threadsafe(chunks.put_nowait, ((500, []), None))
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        watcher = asyncio.create_task(watch_disconnect())
+        future = loop.run_in_executor(self.executor, run)
+        response_started = False
+
+        try:
+            while True:
+                (status, headers), chunk = await chunks.get()
+
+                if not response_started:
+                    await send({'type': 'http.response.start', 'status': status,
+                                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]})
+                    response_started = True
+
+                if chunk is None:
+                    await send({'type': 'http.response.body', 'body': b''})
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+        except OSError:
+            disconnected.set()
+
+        finally:
+            disconnected.set()
+            watcher.cancel()
+            await future
+
+    # ------------------------------------------------------------
+    @staticmethod
+    def __environ(scope: dict, body: bytes) -> dict:
+        """
+        Build the WSGI environment of a request
+        :param scope: ASGI connection scope
+        :param body:  Request body
+        :return: The WSGI environ dictionary
+        """
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': str(server[0]),
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'CONTENT_LENGTH':
+                key = f'HTTP_{name}'
+                environ[key] = f'{environ[key]},{value}' if key in environ else value
+
+        return environ
+
+
+# ------------------------------------------------------------
+def serve_asgi(asgi_app: AsgiApp, host: str, port: int) -> bool:
+    """
+    Serve the app with uvicorn
+    :param asgi_app: The application
+    :param host:     Address to listen on
+    :param port:     Port to listen on
+    :return: False if uvicorn is not installed, otherwise only returns once the server has stopped
+    """
+    try:
+        import uvicorn
+    except ImportError:
+        logging.error('SERVER_MODE "asgi" requires uvicorn (sudo apt-get install python3-uvicorn)')
+        return False
+
+    uvicorn.run(asgi_app, host=host, port=port, log_level="warning")
+    return True
@@ -0,0 +1,384 @@
+"""
+In-process playback of the sound clips
+
+Playing a clip with AUDIOPLAYER_CMD forks the web interface twice (amixer
+to set the volume, then aplay), and aplay opens and configures the sound
+card before the first sample is played. On a Raspberry Pi this adds a
+noticeable delay between a button press and the sound.
+
+This engine keeps the ALSA playback device open in one thread instead.
+The clips are decoded into memory once, converted to the format of the
+device, so starting a clip only adds it to the list of playing voices;
+its first period is written within one period time (about 6 ms at the
+default settings). Playing clips are either mixed together (policy
+"mix", at most max_voices at once, the oldest is dropped) or a new clip
+cuts off the one playing (policy "preempt").
+
+The volume is set through the ALSA mixer control if the card has one
+(the handle is opened once, and only written when the volume changes),
+otherwise the samples are scaled in software.
+
+Requires pyalsaaudio (sudo apt-get install python3-alsaaudio); without
+it the clips are played with AUDIOPLAYER_CMD as before. Only 16 bit PCM
+WAV files are loaded; other files are also left to AUDIOPLAYER_CMD.
+"""
+
+import logging
+import os
+import sys
+import time
+import wave
+from array import array
+from operator import add
+from threading import Condition, Thread
+
+
+POLICIES: tuple = ("mix", "preempt")
+
+
+# ================================================================
+class Voice:
+    """A clip which is being played"""
+
+    __slots__ = ('samples', 'position', 'requested')
+
+    def __init__(self, samples: array, requested: float):
+        """
+        Constructor
+        :param samples:   Interleaved samples of the clip, in the format of the device
+        :param requested: time.monotonic() when the clip was requested
+        """
+        self.samples: array = samples
+        self.position: int = 0
+        self.requested: float | None = requested
+
+
+# ================================================================
+class AudioEngine:
+    """Play preloaded sound clips on an ALSA device which is kept open"""
+
+    TAIL_PERIODS: int = 2       # Periods of silence written after the last voice, before the device is left idle
+
+    def __init__(self, device: str = "default", rate: int = 44100, channels: int = 2, period: int = 256,
+                 periods: int = 3, policy: str = "mix", max_voices: int = 4, mixer: str = "Master"):
+        """
+        Constructor
+        :param device:     ALSA PCM device name
+        :param rate:       Sample rate the device is opened with; clips are converted to it
+        :param channels:   Number of channels the device is opened with
+        :param period:     Frames written at a time; the latency of starting a clip is about one period
+        :param periods:    Periods in the device buffer
+        :param policy:     "mix" to play clips over each other, "preempt" to stop the playing clip
+        :param max_voices: Clips mixed at once with the "mix" policy
+        :param mixer:      ALSA mixer control used for the volume, "" to scale the samples in software
+        """
+        if policy not in POLICIES:
+            raise ValueError(f'Invalid audio policy "{policy}". Valid policies: {", ".join(POLICIES)}')
+
+        self.device: str = device
+        self.rate: int = rate
+        self.channels: int = channels
+        self.period: int = period
+        self.periods: int = periods
+        self.policy: str = policy
+        self.max_voices: int = max(1, max_voices)
+        self.mixer_control: str = mixer
+
+        self.condition: Condition = Condition()
+        self.pcm = None
+        self.mixer = None
+        self.thread: Thread | None = None
+        self.running: bool = False
+
+        self.clips: dict[str, tuple[float, array | None]] = {}     # Path -> (file mtime, samples or None if unsupported)
+        self.voices: list[Voice] = []
+        self.volume: int | None = None
+        self.gain: float = 1.0
+
+        self.played: int = 0
+        self.dropped: int = 0
+        self.errors: int = 0
+        self.last_start: float = 0.0
+        self.max_start: float = 0.0
+
+    # ------------------------------------------------------------
+    def start(self) -> bool:
+        """
+        Open the playback device and start the playback thread
+        :return: False if pyalsaaudio is not installed or the device could not be opened
+        """
+        if self.running:
+            return True
+
+        try:
+            import alsaaudio
+        except ImportError:
+            logging.warning('Sound clips are played with AUDIOPLAYER_CMD, the audio engine requires pyalsaaudio '
+                            '(sudo apt-get install python3-alsaaudio)')
+            return False
+
+        try:
+            self.pcm = alsaaudio.PCM(alsaaudio.PCM_PLAYBACK, alsaaudio.PCM_NORMAL, device=self.device,
+                                     rate=self.rate, channels=self.channels, format=alsaaudio.PCM_FORMAT_S16_LE,
+                                     periodsize=self.period, periods=self.periods)
+        except alsaaudio.ALSAAudioError as ex:
+            logging.error(f'Unable to open audio device {self.device}: {repr(ex)}')
+            return False
+
+        self.mixer = None
+        if self.mixer_control:
+            try:
+                self.mixer = alsaaudio.Mixer(self.mixer_control)
+            except alsaaudio.ALSAAudioError:
+                logging.info(f'No mixer control "{self.mixer_control}", the volume is set in software')
+
+        self.running = True
+        self.thread = Thread(target=self.__playback_thread, args=(alsaaudio.ALSAAudioError,), daemon=True)
+        self.thread.start()
+        logging.info(f'Audio engine playing on {self.device} ({self.rate} Hz, {self.channels} channels, '
+                     f'{self.policy})')
+        return True
+
+    # ------------------------------------------------------------
+    def stop(self):
+        """
+        Stop the playback thread and close the device
+        """
+        with self.condition:
+            self.running = False
+            self.voices = []
+            self.condition.notify_all()
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.pcm is not None:
+            self.pcm.close()
+            self.pcm = None
+
+    # ------------------------------------------------------------
+    def preload(self, paths: list[str]) -> int:
+        """
+        Load sound files into memory, so that they start without reading the file
+        :param paths: Paths of the files
+        :return: Number of files which can be played by the engine
+        """
+        return sum(1 for path in paths if self.__get_clip(path) is not None)
+
+    # ------------------------------------------------------------
+    def play(self, path: str) -> bool:
+        """
+        Start playing a sound file
+        Files which have not been preloaded are loaded first.
+        :param path: Path of the file
+        :return: False if the engine is not running or cannot play the file
+        """
+        requested = time.monotonic()
+        if not self.running:
+            return False
+
+        samples = self.__get_clip(path)
+        if samples is None:
+            return False
+
+        with self.condition:
+            if self.policy == "preempt":
+                self.dropped += len(self.voices)
+                self.voices = []
+            elif len(self.voices) >= self.max_voices:
+                self.dropped += 1
+                self.voices.pop(0)
+
+            self.voices.append(Voice(samples, requested))
+            self.played += 1
+            self.condition.notify_all()
+
+        return True
+
+    # ------------------------------------------------------------
+    def silence(self) -> int:
+        """
+        Stop all clips which are playing
+        :return: Number of clips which were stopped
+        """
+        with self.condition:
+            stopped = len(self.voices)
+            self.voices = []
+        return stopped
+
+    # ------------------------------------------------------------
+    def set_volume(self, percent: int):
+        """
+        Set the volume of the clips
+        :param percent: Volume from 0 to 100
+        """
+        percent = max(0, min(100, int(percent)))
+
+        if self.mixer is not None:
+            if percent == self.volume:
+                return
+            try:
+                self.mixer.setvolume(percent)
+                self.volume = percent
+                return
+            except Exception as ex:
+                logging.warning(f'Unable to set the volume with mixer {self.mixer_control}, '
+                                f'using software volume: {repr(ex)}')
+                self.mixer = None
+
+        # Square the setting, so that the steps sound even
+        self.volume = percent
+        self.gain = (percent / 100) ** 2
+
+    # ------------------------------------------------------------
+    def get_status(self) -> dict:
+        """
+        Get the state of the engine
+        :return: Dictionary with the device, policy, clips loaded and playing, and start latency of the clips
+        """
+        with self.condition:
+            return {
+                'running': self.running,
+                'device': self.device,
+                'policy': self.policy,
+                'volume': self.volume,
+                'software_volume': self.mixer is None,
+                'clips_loaded': sum(1 for _, samples in self.clips.values() if samples is not None),
+                'playing': len(self.voices),
+                'played': self.played,
+                'dropped': self.dropped,
+                'errors': self.errors,
+                'last_start_ms': round(self.last_start * 1000, 2),
+                'max_start_ms': round(self.max_start * 1000, 2),
+            }
+
+    # ------------------------------------------------------------
+    def __get_clip(self, path: str) -> array | None:
+        """
+        Get the samples of a sound file, loading it if it is new or has changed
+        :param path: Path of the file
+        :return: The samples, or None if the file cannot be played by the engine
+        """
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+
+        cached = self.clips.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        samples = self.__load(path)
+        with self.condition:
+            self.clips[path] = (mtime, samples)
+        return samples
+
+    # ------------------------------------------------------------
+    def __load(self, path: str) -> array | None:
+        """
+        Read a WAV file and convert it to the format of the device
+        :param path: Path of the file
+        :return: Interleaved 16 bit samples, or None if the file is not a 16 bit PCM WAV file
+        """
+        try:
+            with wave.open(path, 'rb') as f:
+                if f.getsampwidth() != 2:
+                    logging.info(f'{os.path.basename(path)} is not 16 bit, it is played with AUDIOPLAYER_CMD')
+                    return None
+                channels = f.getnchannels()
+                rate = f.getframerate()
+                samples = array('h', f.readframes(f.getnframes()))
+        except (OSError, EOFError, wave.Error) as ex:
+            logging.warning(f'Unable to load {os.path.basename(path)} into the audio engine: {repr(ex)}')
+            return None
+
+        if sys.byteorder == "big":
+            samples.byteswap()
+
+        # Keep the first channels, or repeat the last one
+        if channels != self.channels:
+            frames = len(samples) // channels
+            converted = array('h', bytes(frames * self.channels * 2))
+            for channel in range(self.channels):
+                converted[channel::self.channels] = samples[min(channel, channels - 1)::channels][:frames]
+            samples = converted
+
+        # Nearest-neighbour resampling; the clips are normally recorded at the rate of the device
+        if rate != self.rate:
+            frames = len(samples) // self.channels
+            step = rate / self.rate
+            samples = array('h', (samples[int(frame * step) * self.channels + channel]
+                                  for frame in range(int(frames / step)) for channel in range(self.channels)))
+
+        return samples
+
+    # ------------------------------------------------------------
+    def __mix(self, voices: list[Voice], count: int) -> bytes:
+        """
+        Take the next period of every voice, and mix them at the current volume
+        :param voices: The voices which are playing
+        :param count:  Number of samples in a period
+        :return: The period, in the format of the device
+        """
+        gain = self.gain if self.mixer is None else 1.0
+
+        # A single clip at full volume is passed on as it is
+        if len(voices) == 1 and gain == 1.0:
+            voice = voices[0]
+            data = voice.samples[voice.position:voice.position + count].tobytes()
+            voice.position += count
+            return data + bytes(count * 2 - len(data))
+
+        mixed = [0] * count
+        for voice in voices:
+            chunk = voice.samples[voice.position:voice.position + count]
+            voice.position += count
+            if len(chunk) < count:
+                chunk.extend([0] * (count - len(chunk)))
+            mixed = list(map(add, mixed, chunk))
+
+        return array('h', [-32768 if s < -32768 else 32767 if s > 32767 else s
+                           for s in (int(s * gain) for s in mixed)]).tobytes()
+
+    # ------------------------------------------------------------
+    def __playback_thread(self, device_error: type):
+        """
+        Write the mixed voices to the device, period by period
+        The device is left idle when no clip is playing, so no CPU is used while it is quiet.
+        :param device_error: Exception type of pyalsaaudio
+        """
+        count = self.period * self.channels
+        silence = bytes(count * 2)
+        tail = self.TAIL_PERIODS
+
+        while True:
+            with self.condition:
+                while self.running and not self.voices and tail >= self.TAIL_PERIODS:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                voices = list(self.voices)
+
+            if voices:
+                data = self.__mix(voices, count)
+                tail = 0
+            else:
+                data = silence
+                tail += 1
+
+            try:
+                self.pcm.write(data)
+            except device_error as ex:
+                self.errors += 1
+                logging.error(f'Audio device {self.device} failed: {repr(ex)}')
+                time.sleep(self.period / self.rate)
+
+            # Note how long the new clips took to reach the device, and forget the finished ones
+            now = time.monotonic()
+            with self.condition:
+                for voice in voices:
+                    if voice.requested is not None:
+                        self.last_start = now - voice.requested
+                        self.max_start = max(self.max_start, self.last_start)
+                        voice.requested = None
+                self.voices = [voice for voice in self.voices if voice.position < len(voice.samples)]
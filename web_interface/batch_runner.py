@@ -0,0 +1,158 @@
+"""
+Scheduler for the delayed steps of /api/batch requests
+
+A batch is split into steps at the delays between its operations. The
+first step is executed straight away by the request handler; the later
+steps are executed here, at their offset from the start of the batch,
+so that a choreographed move costs a single HTTP request. Pending steps
+are cancelled when the robot is told to stop.
+
+A batch which drives keeps the motion lease of the client which sent it
+until its last step, and is cancelled if the client loses the lease.
+"""
+
+import logging
+import time
+from itertools import count
+from threading import Event, Lock, Thread
+from typing import Callable
+
+from control_lease import ControlLease
+
+
+# ================================================================
+class BatchRunner:
+    """Run the steps of batches at their scheduled times"""
+
+    def __init__(self, max_batches: int = 8, lease: ControlLease | None = None):
+        """
+        Constructor
+        :param max_batches: Maximum number of batches which can be waiting at once
+        :param lease:       Motion lease held by batches which drive, None to run them without it
+        """
+        self.max_batches: int = max_batches
+        self.lease: ControlLease | None = lease
+        self.lock: Lock = Lock()
+        self.batches: dict = {}     # Id -> (cancel event, id of the client holding the lease for it or None)
+        self.ids = count(1)
+        self.cancelled: int = 0
+
+    # ------------------------------------------------------------
+    def schedule(self, steps: list[tuple[float, Callable[[], None]]],
+                 client: tuple[str, str] | None = None) -> int | None:
+        """
+        Run steps in the background
+        :param steps:  List of (seconds from now, function), in order of time
+        :param client: (id, description) of the client whose motion lease the batch holds, None if it does not drive
+        :return: Id of the batch, or None if too many batches are already waiting
+        """
+        if self.lease is None:
+            client = None
+
+        with self.lock:
+            if len(self.batches) >= self.max_batches:
+                return None
+
+            batch_id = next(self.ids)
+            cancel = Event()
+            self.batches[batch_id] = (cancel, client[0] if client is not None else None)
+
+        # Keep the lease taken by the request until the first step
+        if client is not None:
+            self.lease.begin_run(client[0])
+            self.lease.renew(client[0], steps[0][0] if steps else 0.0)
+
+        thread = Thread(target=self.__batch_thread, args=(batch_id, steps, cancel, client), daemon=True)
+        thread.start()
+        return batch_id
+
+    # ------------------------------------------------------------
+    def cancel(self, batch_id: int) -> bool:
+        """
+        Cancel the steps of a batch which have not been run yet, e.g. when its first step failed
+        :param batch_id: Id of the batch
+        :return: True if the batch was still waiting
+        """
+        with self.lock:
+            batch = self.batches.pop(batch_id, None)
+            if batch is None:
+                return False
+            self.cancelled += 1
+
+        batch[0].set()
+        return True
+
+    # ------------------------------------------------------------
+    def cancel_all(self) -> int:
+        """
+        Cancel the steps of all batches which have not been run yet
+        :return: Number of batches cancelled
+        """
+        with self.lock:
+            batches = [cancel for cancel, _ in self.batches.values()]
+            self.batches.clear()
+            self.cancelled += len(batches)
+
+        for cancel in batches:
+            cancel.set()
+
+        return len(batches)
+
+    # ------------------------------------------------------------
+    def cancel_others(self, client: str) -> int:
+        """
+        Cancel the batches which drive for other clients, e.g. when the client takes the motion lease over
+        :param client: Id of the client whose batches are kept
+        :return: Number of batches cancelled
+        """
+        with self.lock:
+            cancelled = [batch_id for batch_id, (_, holder) in self.batches.items()
+                         if holder is not None and holder != client]
+            batches = [self.batches.pop(batch_id)[0] for batch_id in cancelled]
+            self.cancelled += len(batches)
+
+        for cancel in batches:
+            cancel.set()
+
+        return len(batches)
+
+    # ------------------------------------------------------------
+    def get_stats(self) -> dict:
+        """
+        Get the number of scheduled batches
+        :return: Dictionary with the batches waiting and the number cancelled so far
+        """
+        with self.lock:
+            return {'pending': len(self.batches), 'cancelled': self.cancelled}
+
+    # ------------------------------------------------------------
+    def __batch_thread(self, batch_id: int, steps: list, cancel: Event, client: tuple[str, str] | None):
+        """
+        Wait for each step of a batch and run it
+        :param batch_id: Id of the batch
+        :param steps:    List of (seconds from start, function)
+        :param cancel:   Set when the batch is cancelled
+        :param client:   (id, description) of the client whose motion lease the batch holds, or None
+        """
+        start = time.monotonic()
+
+        try:
+            for index, (offset, step) in enumerate(steps):
+                if cancel.wait(max(0.0, start + offset - time.monotonic())):
+                    return
+
+                # Keep the lease until the next step, or stop if another client has taken it
+                following = steps[index + 1][0] - offset if index + 1 < len(steps) else 0.0
+                if client is not None and not self.lease.renew(client[0], following):
+                    logging.warning(f'Batch {batch_id} cancelled, {client[1]} no longer holds the motion lease')
+                    return
+                step()
+
+        except Exception as ex:
+            logging.error(f'Batch {batch_id} failed: {repr(ex)}')
+
+        finally:
+            with self.lock:
+                self.batches.pop(batch_id, None)
+            if client is not None:
+                self.lease.end_run(client[0])
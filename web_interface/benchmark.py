@@ -0,0 +1,537 @@
+"""
+HTTP load test of the web interface against a simulated Arduino
+
+Starts the Flask app from app.py in this process, connects it to an
+ArduinoSimulator and serves it on a local port in the selected serving
+mode. Client threads then drive the kind of traffic the robot sees
+while it is being driven:
+- joystick clients, each posting /motor at a fixed rate (10 Hz)
+- bursts of /api/servo/multiple requests, as sent by scripts
+- /api/status polling, as done by dashboards
+- concurrent /tts requests, which run slow subprocesses
+
+For every request type the throughput and the p50/p95/p99 latency are
+reported, together with the depth of the serial send queue (sampled
+every few milliseconds) and the serial statistics. The results are
+written as JSON, so that changes to ArduinoDevice or the serving modes
+can be compared on the same machine:
+    python3 benchmark.py --mode waitress --output waitress.json
+    python3 benchmark.py --mode asgi --output asgi.json --compare waitress.json
+
+By default text to speech is simulated by commands which sleep, so that
+espeak-ng, rubberband and aplay are not needed; use --real-tts to run
+the configured programs instead. The clients run in the same process as
+the server, so only compare results taken with the same options.
+
+A recorded control session (see session_log.py) can be replayed in a
+loop alongside the clients with --replay, to reproduce the serial
+traffic of a real session, e.g. one in which the robot lagged:
+    python3 benchmark.py --replay recordings/laggy.wlog --delay 2 --jitter 3
+"""
+
+import argparse
+import datetime
+import http.client
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from threading import Event, Lock, Thread
+from urllib.parse import urlencode
+
+
+# ================================================================
+class LatencyRecorder:
+    """Latencies and status codes of the requests made during the measurement window"""
+
+    def __init__(self):
+        """Constructor"""
+        self.lock: Lock = Lock()
+        self.start: float = 0.0
+        self.end: float = 0.0
+        self.latencies: dict[str, list[float]] = {}     # Request type -> seconds
+        self.errors: dict[str, int] = {}                # Request type -> failed requests
+        self.throttled: dict[str, int] = {}             # Request type -> 429 responses
+        self.late: dict[str, int] = {}                  # Request type -> requests sent later than scheduled
+
+    # ------------------------------------------------------------
+    def measuring(self, now: float) -> bool:
+        """
+        Check if a request started at a time is part of the measurement
+        :param now: time.monotonic() at the start of the request
+        :return: True during the measurement window (after the warm-up)
+        """
+        return self.start <= now < self.end
+
+    # ------------------------------------------------------------
+    def record(self, name: str, seconds: float, status: int | None):
+        """
+        Record a request
+        :param name:    Request type
+        :param seconds: Time until the response had been read
+        :param status:  HTTP status code, or None if the request failed
+        """
+        with self.lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            if status == 429:
+                self.throttled[name] = self.throttled.get(name, 0) + 1
+            elif status is None or status >= 400:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    # ------------------------------------------------------------
+    def record_late(self, name: str):
+        """
+        Record that a client could not keep up with its rate
+        :param name: Request type
+        """
+        with self.lock:
+            self.late[name] = self.late.get(name, 0) + 1
+
+    # ------------------------------------------------------------
+    def get_results(self) -> dict:
+        """
+        Summarise the requests
+        :return: Dictionary of request type -> throughput and latency percentiles, plus "all"
+        """
+        duration = self.end - self.start
+        with self.lock:
+            latencies = {name: sorted(values) for name, values in self.latencies.items()}
+            latencies['all'] = sorted(value for values in self.latencies.values() for value in values)
+            errors = dict(self.errors, all=sum(self.errors.values()))
+            throttled = dict(self.throttled, all=sum(self.throttled.values()))
+            late = dict(self.late, all=sum(self.late.values()))
+
+        return {name: {
+            'requests': len(values),
+            'errors': errors.get(name, 0),
+            'throttled': throttled.get(name, 0),
+            'late': late.get(name, 0),
+            'throughput_rps': round(len(values) / duration, 2),
+            'p50_ms': percentile(values, 0.50),
+            'p95_ms': percentile(values, 0.95),
+            'p99_ms': percentile(values, 0.99),
+            'max_ms': percentile(values, 1.0),
+        } for name, values in latencies.items()}
+
+
+# ------------------------------------------------------------
+def percentile(values: list[float], fraction: float) -> float | None:
+    """
+    Get a percentile of sorted values, in milliseconds
+    :param values:   Sorted values in seconds
+    :param fraction: Percentile as a fraction, e.g. 0.99
+    :return: The percentile in milliseconds, or None if there are no values
+    """
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(len(values) * fraction))] * 1000, 2)
+
+
+# ================================================================
+class Client:
+    """One HTTP connection, kept alive between requests like a browser"""
+
+    def __init__(self, port: int, cookie: str, recorder: LatencyRecorder):
+        """
+        Constructor
+        :param port:     Port the web interface is served on
+        :param cookie:   Session cookie of a logged in user
+        :param recorder: Where the requests are recorded
+        """
+        self.port: int = port
+        self.cookie: str = cookie
+        self.recorder: LatencyRecorder = recorder
+        self.connection: http.client.HTTPConnection | None = None
+
+    # ------------------------------------------------------------
+    def request(self, name: str, method: str, path: str, form: dict | None = None, data: dict | None = None):
+        """
+        Make a request and record its latency
+        :param name:   Request type the latency is recorded under
+        :param method: HTTP method
+        :param path:   URL path
+        :param form:   Form data to be sent URL encoded
+        :param data:   Data to be sent as JSON
+        """
+        headers = {'Cookie': self.cookie}
+        body = None
+        if form is not None:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            body = urlencode(form)
+        elif data is not None:
+            headers['Content-Type'] = 'application/json'
+            body = json.dumps(data)
+
+        start = time.monotonic()
+        status = None
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+            response.read()
+            status = response.status
+
+        except (OSError, http.client.HTTPException):
+            # Reconnect for the next request
+            self.connection.close()
+            self.connection = None
+
+        if self.recorder.measuring(start):
+            self.recorder.record(name, time.monotonic() - start, status)
+
+
+# ------------------------------------------------------------
+def run_periodic(client: Client, name: str, interval: float, send, stop: Event):
+    """
+    Send requests at a fixed rate until stopped
+    A client which falls behind skips the missed requests instead of catching up, as a joystick would.
+    :param client:   The HTTP connection
+    :param name:     Request type, for recording late requests
+    :param interval: Seconds between requests
+    :param send:     Function making the request(s), called with the client
+    :param stop:     Set to stop sending
+    """
+    # Spread the clients over the interval
+    next_time = time.monotonic() + random.uniform(0, interval)
+
+    while not stop.wait(max(0.0, next_time - time.monotonic())):
+        send(client)
+
+        next_time += interval
+        now = time.monotonic()
+        if now > next_time:
+            if client.recorder.measuring(now):
+                client.recorder.record_late(name)
+            next_time = now
+
+
+# ------------------------------------------------------------
+def joystick(client: Client):
+    """
+    Move the joystick along a slow circle
+    :param client: The HTTP connection
+    """
+    angle = time.monotonic() * 2
+    client.request('joystick', 'POST', '/motor', form={'stickX': round(math.sin(angle), 2),
+                                                      'stickY': round(math.cos(angle), 2)})
+
+
+# ------------------------------------------------------------
+def sample_queue_depth(device, interval: float, recorder: LatencyRecorder, stop: Event) -> list[int]:
+    """
+    Sample the depth of the serial send queue until stopped
+    :param device:   The ArduinoDevice
+    :param interval: Seconds between samples
+    :param recorder: Only samples in its measurement window are kept
+    :param stop:     Set to stop sampling
+    :return: The samples (filled in while running)
+    """
+    samples = []
+
+    def run():
+        while not stop.wait(interval):
+            if recorder.measuring(time.monotonic()):
+                samples.append(device.get_queue_depth())
+
+    Thread(target=run, daemon=True).start()
+    return samples
+
+
+# ------------------------------------------------------------
+def replay(player, entries: list, speed: float, stop: Event):
+    """
+    Replay a recorded session over and over until the benchmark ends
+    :param player:  The SessionPlayer of the app
+    :param entries: Entries of the recording
+    :param speed:   Playback speed
+    :param stop:    Set at the end of the benchmark
+    """
+    while not stop.is_set():
+        if player.get_status()['replaying'] is None:
+            player.play('benchmark', entries, speed)
+        stop.wait(0.05)
+
+
+# ------------------------------------------------------------
+def free_port() -> int:
+    """
+    Find a free local TCP port
+    :return: The port number
+    """
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# ------------------------------------------------------------
+def wait_for_server(port: int, timeout: float = 10.0):
+    """
+    Wait until the server accepts connections
+    :param port:    Port the server listens on
+    :param timeout: Maximum time in seconds to wait
+    :raise TimeoutError: If the server has not started in time
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'The web interface did not start on port {port}')
+            time.sleep(0.05)
+
+
+# ------------------------------------------------------------
+def login(port: int, password: str) -> str:
+    """
+    Log in to the web interface
+    :param port:     Port the server listens on
+    :param password: Login password
+    :return: The session cookie
+    :raise RuntimeError: If the login failed
+    """
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    connection.request('POST', '/login_request', urlencode({'password': password}),
+                       {'Content-Type': 'application/x-www-form-urlencoded'})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+
+    cookie = response.getheader('Set-Cookie')
+    if response.status != 302 or not cookie:
+        raise RuntimeError('Unable to log in to the web interface, check LOGIN_PASSWORD')
+    return cookie.split(';', 1)[0]
+
+
+# ------------------------------------------------------------
+def machine_info() -> dict:
+    """
+    Describe the machine and code version, so that results are only compared when they match
+    :return: Dictionary of machine information
+    """
+    try:
+        revision = subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        revision = None
+
+    return {
+        'host': platform.node(),
+        'machine': platform.machine(),
+        'system': platform.platform(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'revision': revision,
+    }
+
+
+# ------------------------------------------------------------
+def print_results(results: dict, baseline: dict | None = None):
+    """
+    Print the results as a table
+    :param results:  Results of this run
+    :param baseline: Results of an earlier run to compare with
+    """
+    print(f"\n{'request':<12} {'count':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'max ms':>8} {'errors':>7} {'429':>5} {'late':>5}")
+
+    for name, row in results['endpoints'].items():
+        print(f"{name:<12} {row['requests']:>7} {row['throughput_rps']:>8} {row['p50_ms'] or 0:>8} "
+              f"{row['p95_ms'] or 0:>8} {row['p99_ms'] or 0:>8} {row['max_ms'] or 0:>8} "
+              f"{row['errors']:>7} {row['throttled']:>5} {row['late']:>5}")
+
+        old = (baseline or {}).get('endpoints', {}).get(name)
+        if old is not None:
+            def change(key: str) -> str:
+                if not old.get(key) or row.get(key) is None:
+                    return '-'
+                return f"{(row[key] - old[key]) / old[key] * 100:+.0f}%"
+
+            print(f"{'  vs base':<12} {'':>7} {change('throughput_rps'):>8} {change('p50_ms'):>8} "
+                  f"{change('p95_ms'):>8} {change('p99_ms'):>8} {change('max_ms'):>8}")
+
+    depth = results['serial']['queue_depth']
+    print(f"\nSerial queue depth: mean {depth['mean']}, p99 {depth['p99']}, max {depth['max']}; "
+          f"{results['serial']['commands_per_second']} commands/s written")
+    if 'replay' in results:
+        print(f"Replay: entries replayed up to {results['replay']['max_late_ms']} ms late")
+
+
+# ------------------------------------------------------------
+def run_benchmark(args: argparse.Namespace) -> dict:
+    """
+    Run the benchmark
+    :param args: Command line options
+    :return: The results
+    """
+    # Run from this folder, so that the app finds its config, templates and static files
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    from arduino_simulator import ArduinoSimulator
+    simulator = ArduinoSimulator(args.delay / 1000, args.jitter / 1000, battery_interval=1.0,
+                                 binary_frames=not args.text_only)
+    serial_port = simulator.start()
+
+    import app as web
+    web.app.config['AUTOSTART_ARDUINO'] = False
+    web.app.config['AUTOSTART_CAM'] = False
+
+    if not args.real_tts:
+        # Each stage of the speech pipeline takes the given time; arguments are ignored by "sh -c"
+        stage = ['sh', '-c', f'sleep {args.tts_stage / 1000}', 'tts']
+        web.app.config.update(ESPEAK_CMD=stage, RB_CMD=stage, AUDIOPLAYER_CMD=stage)
+        if shutil.which('amixer') is None:
+            web.mixer_command = lambda: None
+
+    if not web.supervisor.connect(serial_port):
+        raise RuntimeError(f'Unable to connect to the simulated Arduino on {serial_port}')
+
+    port = args.port or free_port()
+    Thread(target=web.serve_app, args=('127.0.0.1', port, args.mode), daemon=True).start()
+    wait_for_server(port)
+    cookie = login(port, web.app.config['LOGIN_PASSWORD'])
+
+    recorder = LatencyRecorder()
+    recorder.start = time.monotonic() + args.warmup
+    recorder.end = recorder.start + args.duration
+    stop = Event()
+    threads = []
+
+    def start(target, *target_args):
+        thread = Thread(target=target, args=(Client(port, cookie, recorder),) + target_args, daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    for _ in range(args.joystick_clients):
+        start(run_periodic, 'joystick', 1 / args.joystick_rate, joystick, stop)
+
+    def servo_burst(client: Client):
+        for _ in range(args.burst_size):
+            servos = {servo: random.randint(0, 100) for servo in web.API_SERVOS}
+            client.request('servo_burst', 'POST', '/api/servo/multiple', data={'servos': servos})
+
+    if args.burst_size > 0:
+        start(run_periodic, 'servo_burst', args.burst_interval, servo_burst, stop)
+
+    def status(client: Client):
+        client.request('status', 'GET', '/api/status')
+
+    for _ in range(args.status_clients):
+        start(run_periodic, 'status', 1 / args.status_rate, status, stop)
+
+    def tts(client: Client):
+        client.request('tts', 'POST', '/tts', form={'text': 'Wall-E'})
+
+    for _ in range(args.tts_clients):
+        start(run_periodic, 'tts', args.tts_interval, tts, stop)
+
+    if args.replay:
+        from session_log import read_log
+        _, entries = read_log(args.replay)
+        Thread(target=replay, args=(web.session_player, entries, args.replay_speed, stop), daemon=True).start()
+
+    queue_depth = sample_queue_depth(web.arduino, 0.005, recorder, stop)
+    serial_before = web.arduino.get_serial_stats()
+
+    time.sleep(max(0.0, recorder.end - time.monotonic()))
+    serial_after = web.arduino.get_serial_stats()
+    stop.set()
+    web.session_player.stop()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    depths = sorted(queue_depth)
+    results = {
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'machine': machine_info(),
+        'options': vars(args),
+        'endpoints': recorder.get_results(),
+        'serial': {
+            'queue_depth': {
+                'samples': len(depths),
+                'mean': round(sum(depths) / len(depths), 2) if depths else None,
+                'p50': depths[len(depths) // 2] if depths else None,
+                'p99': depths[min(len(depths) - 1, int(len(depths) * 0.99))] if depths else None,
+                'max': depths[-1] if depths else None,
+            },
+            'commands_per_second': round((serial_after['commands_sent'] - serial_before['commands_sent'])
+                                         / args.duration, 1),
+            'bytes_written': serial_after['bytes_written'] - serial_before['bytes_written'],
+            'bytes_read': serial_after['bytes_read'] - serial_before['bytes_read'],
+            'protocol': web.arduino.get_protocol(),
+            'acks': web.arduino.get_ack_stats(),
+            'stop_latency': web.arduino.get_stop_latency(),
+            'traces': web.tracer.get_summary(),
+        },
+    }
+    if args.replay:
+        results['replay'] = web.session_player.get_status()
+
+    web.arduino.disconnect()
+    simulator.stop()
+    return results
+
+
+###############################################################
+#
+# Run the benchmark from the command line
+#
+###############################################################
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="HTTP load test of the web interface against a simulated Arduino")
+    parser.add_argument('--mode', choices=('waitress', 'asgi'), default="waitress", help="serving mode")
+    parser.add_argument('--port', type=int, default=0, help="port to serve on (default: any free port)")
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds of measurement")
+    parser.add_argument('--warmup', type=float, default=3.0, help="seconds of traffic before measuring")
+    parser.add_argument('--joystick-clients', type=int, default=4, help="number of joystick clients")
+    parser.add_argument('--joystick-rate', type=float, default=10.0, help="requests per second per joystick client")
+    parser.add_argument('--burst-size', type=int, default=10, help="/api/servo/multiple requests per burst (0 = none)")
+    parser.add_argument('--burst-interval', type=float, default=2.0, help="seconds between servo bursts")
+    parser.add_argument('--status-clients', type=int, default=2, help="number of /api/status pollers")
+    parser.add_argument('--status-rate', type=float, default=1.0, help="requests per second per status poller")
+    parser.add_argument('--tts-clients', type=int, default=2, help="number of clients sending /tts")
+    parser.add_argument('--tts-interval', type=float, default=5.0, help="seconds between /tts requests per client")
+    parser.add_argument('--tts-stage', type=float, default=300.0, help="duration of each simulated TTS stage (ms)")
+    parser.add_argument('--real-tts', action='store_true', help="run the configured espeak/rubberband/player")
+    parser.add_argument('--delay', type=float, default=0.0, help="simulated Arduino processing delay per command (ms)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="maximum random extra delay per command (ms)")
+    parser.add_argument('--text-only', action='store_true', help="simulated Arduino does not accept binary frames")
+    parser.add_argument('--replay', default="", help="recorded session (.wlog) to replay in a loop during the run")
+    parser.add_argument('--replay-speed', type=float, default=1.0, help="playback speed of --replay")
+    parser.add_argument('--output', default="", help="write the results to this JSON file")
+    parser.add_argument('--compare', default="", help="JSON results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    # The benchmark runs from the folder of the app
+    args.output = os.path.abspath(args.output) if args.output else ""
+    args.compare = os.path.abspath(args.compare) if args.compare else ""
+    args.replay = os.path.abspath(args.replay) if args.replay else ""
+
+    logging.basicConfig(level=logging.WARNING)
+    results = run_benchmark(args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+        print(f"Results written to {args.output}")
+
+    # The server threads cannot be shut down cleanly
+    sys.stdout.flush()
+    os._exit(0)
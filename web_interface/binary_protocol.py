@@ -0,0 +1,114 @@
+"""
+Compact binary framing for the Arduino serial link
+
+Frames start with a byte which can never appear in a text command, so
+the Arduino sketch accepts binary frames and text commands on the same
+link. Support is negotiated by sending "P<version>"; sketches which
+understand binary frames reply with "Protocol_<version>".
+
+Pose frame (12 bytes):
+    0xA5, OP_POSE, G, T, B, U, E, L, R, X, Y, checksum
+    Servo values are int8 0 to 100 (-1 = leave unchanged), motor values
+    are int8 -100 to 100 (-128 = leave unchanged). The checksum is the
+    XOR of the opcode and payload bytes. The sketch echoes "Q<checksum>".
+
+Single commands are still sent as text, since "G55\n" is no longer than
+a binary frame would be; only runs of motor/servo values are packed.
+"""
+
+import struct
+
+from command_tracker import expected_echo
+
+
+PROTOCOL_VERSION: int = 1
+FRAME_START: int = 0xA5
+OP_POSE: int = 0x01
+
+# Order matches the servo indices in wall-e.ino, followed by the two motor inputs
+POSE_CHANNELS: str = "GTBUELRXY"
+POSE_FRAME_SIZE: int = 3 + len(POSE_CHANNELS)
+
+SERVO_UNCHANGED: int = -1
+MOTOR_UNCHANGED: int = -128
+
+
+# ------------------------------------------------------------
+def pose_value(command: str) -> int | None:
+    """
+    Get the value of a command which can be packed into a pose frame
+    :param command: Text command, e.g. "G55" or "X-20"
+    :return: The value, or None if the command cannot be part of a pose
+    """
+    channel = command[:1]
+    if channel == "" or channel not in POSE_CHANNELS:
+        return None
+
+    try:
+        value = int(command[1:])
+    except ValueError:
+        return None
+
+    low = -100 if channel in "XY" else 0
+    return value if low <= value <= 100 else None
+
+
+# ------------------------------------------------------------
+def encode_pose(values: dict) -> tuple[bytes, int]:
+    """
+    Build a pose frame
+    :param values: Dictionary of channel character to value; missing channels are left unchanged
+    :return: The frame and its checksum
+    """
+    payload = bytes([OP_POSE]) + struct.pack('9b', *[
+        values.get(channel, MOTOR_UNCHANGED if channel in "XY" else SERVO_UNCHANGED)
+        for channel in POSE_CHANNELS
+    ])
+
+    checksum = 0
+    for byte in payload:
+        checksum ^= byte
+
+    return bytes([FRAME_START]) + payload + bytes([checksum]), checksum
+
+
+# ------------------------------------------------------------
+def encode_batch(batch: list[tuple[str, int | None]], binary: bool) -> tuple[bytes, list]:
+    """
+    Encode a batch of commands for the serial link
+    In binary mode, runs of motor/servo values are packed into pose frames where that is shorter.
+    A run ends at any other command, or when a channel repeats, so the order of commands is kept.
+    :param batch:  List of (command, ticket) in send order
+    :param binary: True if the Arduino accepts binary frames
+    :return: The bytes to write, and a list of (expected echo, [(command, ticket), ...]) for each frame or line
+    """
+    data = bytearray()
+    frames = []
+    run = []
+
+    def flush_run():
+        text = ''.join(f'{command}\n' for command, _ in run).encode()
+
+        if len(run) > 1 and len(text) > POSE_FRAME_SIZE:
+            frame, checksum = encode_pose({command[:1]: pose_value(command) for command, _ in run})
+            data.extend(frame)
+            frames.append((f'Q{checksum}', list(run)))
+        else:
+            data.extend(text)
+            frames.extend((expected_echo(command), [(command, ticket)]) for command, ticket in run)
+
+        run.clear()
+
+    for command, ticket in batch:
+        if binary and pose_value(command) is not None:
+            if any(queued[:1] == command[:1] for queued, _ in run):
+                flush_run()
+            run.append((command, ticket))
+            continue
+
+        flush_run()
+        data.extend(f'{command}\n'.encode())
+        frames.append((expected_echo(command), [(command, ticket)]))
+
+    flush_run()
+    return bytes(data), frames
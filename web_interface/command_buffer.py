@@ -0,0 +1,184 @@
+"""
+Send buffer for serial commands going to the Arduino
+
+Commands which set a value on a channel (motor X/Y, trims and servo
+positions) only ever need their most recent value to be sent, so a new
+value replaces any pending value for the same channel. All other
+commands (animations, modes, keyboard movements) are one-shot actions
+which are kept in FIFO order.
+
+Urgent commands (emergency stop) go into a separate lane which is always
+sent first, and remove any pending commands for the same channel.
+
+Commands which are replaced or removed that way are superseded by the
+new command; their tickets are handed to an optional callback, so that
+whoever waits for them can follow the new command instead.
+"""
+
+from collections import deque
+from threading import Condition
+from typing import Callable
+
+
+# ================================================================
+class CommandBuffer:
+    """Keyed, latest-value-wins buffer of pending serial commands"""
+
+    # Command characters which hold a value, where only the newest one matters
+    COALESCED_CHANNELS: str = "XYSOGTBLREU"
+
+    # Main motor channels, and keyboard commands which also drive the motors (see evaluateSerial() in wall-e.ino)
+    MOTOR_CHANNELS: str = "XY"
+    DRIVE_COMMANDS: str = "wsadq"
+
+    def __init__(self, superseded: Callable[[int, int | None], None] | None = None):
+        """
+        Constructor
+        :param superseded: Called with (ticket, ticket of the new command) when a pending command is replaced
+                           or removed by a newer one; called with the buffer locked, so it must not block
+        """
+        self.superseded = superseded
+        self.condition: Condition = Condition()
+        self.entries: deque = deque()
+        self.urgent: deque = deque()
+        self.pending: dict = {}
+        self.woken: bool = False
+
+    # ------------------------------------------------------------
+    def __len__(self) -> int:
+        """
+        Number of commands waiting to be sent
+        :return: Current depth of the buffer
+        """
+        with self.condition:
+            return len(self.urgent) + len(self.entries)
+
+    # ------------------------------------------------------------
+    def put(self, command: str, ticket: int | None = None):
+        """
+        Add a command to the buffer
+        :param command: The command to be sent
+        :param ticket:  Optional identifier which is handed back with the command by get_batch()
+        """
+        channel = command[:1]
+
+        with self.condition:
+            if channel and channel in self.COALESCED_CHANNELS:
+                entry = self.pending.get(channel)
+
+                # Overwrite the value which has not been sent yet
+                if entry is not None:
+                    if self.superseded is not None and entry[2] is not None:
+                        self.superseded(entry[2], ticket)
+                    entry[1] = command
+                    entry[2] = ticket
+                    return
+
+                entry = [channel, command, ticket]
+                self.pending[channel] = entry
+
+            else:
+                # One-shot commands act as a barrier; values queued after
+                # them must not be merged into entries queued before them
+                entry = [None, command, ticket]
+                self.pending.clear()
+
+            self.entries.append(entry)
+            self.condition.notify()
+
+    # ------------------------------------------------------------
+    def put_many(self, commands: list[tuple[str, int | None]]):
+        """
+        Add a group of commands, without commands from other threads getting in between
+        :param commands: List of (command, ticket) in send order, see put()
+        """
+        with self.condition:
+            for command, ticket in commands:
+                self.put(command, ticket)
+
+    # ------------------------------------------------------------
+    def put_urgent(self, command: str, ticket: int | None = None):
+        """
+        Add a command ahead of all other pending commands
+        Pending commands for the same channel are dropped, so that they cannot undo it
+        :param command: The command to be sent
+        :param ticket:  Optional identifier which is handed back with the command by get_batch()
+        """
+        channel = command[:1]
+        purged = channel + (self.DRIVE_COMMANDS if channel and channel in self.MOTOR_CHANNELS else "")
+
+        with self.condition:
+            if self.superseded is not None:
+                for entry in self.entries:
+                    if entry[1][:1] in purged and entry[2] is not None:
+                        self.superseded(entry[2], ticket)
+
+            self.entries = deque(entry for entry in self.entries if entry[1][:1] not in purged)
+            for item in purged:
+                self.pending.pop(item, None)
+
+            self.urgent.append([channel, command, ticket])
+            self.condition.notify()
+
+    # ------------------------------------------------------------
+    def get(self, timeout: float | None = None) -> str | None:
+        """
+        Take the next command from the buffer, waiting until one is available
+        :param timeout: Maximum time to wait in seconds (None waits forever)
+        :return: The command, or None if timed out or woken up by wake()
+        """
+        batch = self.get_batch(0, timeout)
+        return batch[0][0] if batch else None
+
+    # ------------------------------------------------------------
+    def get_batch(self, max_bytes: int, timeout: float | None = None) -> list[tuple[str, int | None]]:
+        """
+        Take as many commands as fit in one serial write, waiting until at least one is available
+        :param max_bytes: Maximum size of the batch including newlines (at least one command is always returned)
+        :param timeout:   Maximum time to wait in seconds (None waits forever)
+        :return: List of (command, ticket) in send order; empty if timed out or woken up by wake()
+        """
+        batch: list[tuple[str, int | None]] = []
+        size: int = 0
+
+        with self.condition:
+            self.condition.wait_for(lambda: self.urgent or self.entries or self.woken, timeout)
+
+            if self.woken:
+                self.woken = False
+                return batch
+
+            # The urgent lane is always emptied first
+            for lane in (self.urgent, self.entries):
+                while lane:
+                    length = len(lane[0][1]) + 1
+                    if batch and size + length > max_bytes:
+                        return batch
+
+                    entry = lane.popleft()
+                    if entry[0] is not None and self.pending.get(entry[0]) is entry:
+                        del self.pending[entry[0]]
+
+                    batch.append((entry[1], entry[2]))
+                    size += length
+
+        return batch
+
+    # ------------------------------------------------------------
+    def wake(self):
+        """
+        Wake up a thread which is blocked in get()
+        """
+        with self.condition:
+            self.woken = True
+            self.condition.notify_all()
+
+    # ------------------------------------------------------------
+    def clear(self):
+        """
+        Remove all pending commands
+        """
+        with self.condition:
+            self.urgent.clear()
+            self.entries.clear()
+            self.pending.clear()
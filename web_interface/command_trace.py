@@ -0,0 +1,244 @@
+"""
+Sampled end-to-end tracing of serial commands
+
+A fraction of the requests which send commands to the Arduino are
+traced. A trace records when the request was received, when its
+commands were added to the send buffer, when they were written to the
+serial port and when the Arduino echoed them back. Completed traces are
+kept in a ring buffer, so that when the robot "lags" it can be seen
+which stage the time went to:
+
+  server:   front proxy received the request -> request handler started
+            (only if the proxy sets an X-Request-Start header)
+  handling: request handler started -> commands queued
+  queued:   commands queued -> written to the serial port
+            (includes waiting for earlier writes to drain)
+  link:     written -> echoed by the Arduino (transmission and firmware)
+  total:    request received -> echoed
+
+A command which is replaced in the send buffer by a newer value for its
+channel is never sent; its trace follows the command which replaced it
+instead, since that is when the robot acted on the request.
+"""
+
+import random
+import time
+from collections import OrderedDict, deque
+from itertools import count
+from threading import Lock
+
+
+# ================================================================
+class TraceContext:
+    """Where and when the commands of a request came from"""
+
+    def __init__(self, source: str, received: float | None = None, server_delay: float | None = None,
+                 force: bool = False):
+        """
+        Constructor
+        :param source:       Name of the request, e.g. the URL rule "/api/move"
+        :param received:     time.monotonic() when the request handler started (None for now)
+        :param server_delay: Seconds the request spent before reaching the handler, if known
+        :param force:        Trace the request even if it is not sampled
+        """
+        self.source: str = source
+        self.received: float = received if received is not None else time.monotonic()
+        self.server_delay: float | None = server_delay
+        self.force: bool = force
+        self.trace_id: int | None = None    # Set once the commands have been traced
+
+
+# ================================================================
+class CommandTracer:
+    """Trace a sample of commands from request to echo"""
+
+    STAGES: tuple = ('server', 'handling', 'queued', 'link', 'total')
+    MAX_AGE: float = 5.0        # Seconds after which a trace is completed, even if commands were never echoed
+
+    def __init__(self, sample_rate: float = 0.1, capacity: int = 200, max_active: int = 64):
+        """
+        Constructor
+        :param sample_rate: Fraction of requests which are traced (0 to 1)
+        :param capacity:    Number of completed traces kept
+        :param max_active:  Maximum number of traces waiting for echoes
+        """
+        self.sample_rate: float = sample_rate
+        self.max_active: int = max_active
+        self.lock: Lock = Lock()
+        self.ids = count(1)
+        self.active: OrderedDict = OrderedDict()    # Trace id -> trace
+        self.tickets: dict = {}                     # Ticket in the send buffer -> [(trace, traced ticket), ...]
+        self.completed: deque = deque(maxlen=capacity)
+
+    # ------------------------------------------------------------
+    def begin(self, tickets: list[int], commands: list[str], context: TraceContext | None) -> int | None:
+        """
+        Start tracing commands which have just been added to the send buffer, if they are sampled
+        :param tickets:  Tickets of the commands
+        :param commands: The commands
+        :param context:  Request the commands came from (None if not from a request)
+        :return: Id of the trace, or None if the commands are not traced
+        """
+        if not (context is not None and context.force) and random.random() >= self.sample_rate:
+            return None
+
+        now = time.monotonic()
+        context = context or TraceContext("", now)
+        trace = {
+            'id': next(self.ids),
+            'time': time.time(),
+            'source': context.source,
+            'commands': list(commands),
+            'pending': {ticket: ticket for ticket in tickets},   # Traced ticket -> ticket it waits for
+            'coalesced': False,
+            'server': context.server_delay,
+            'received': context.received,
+            'enqueued': now,
+            'written': None,
+            'echoed': None,
+        }
+
+        with self.lock:
+            self.__expire(now)
+            self.active[trace['id']] = trace
+            for ticket in tickets:
+                self.tickets.setdefault(ticket, []).append((trace, ticket))
+
+        context.trace_id = trace['id']
+        return trace['id']
+
+    # ------------------------------------------------------------
+    def superseded(self, ticket: int, replacement: int | None):
+        """
+        Record that a command was replaced in the send buffer by a newer one, which its trace waits for instead
+        :param ticket:      Ticket of the replaced command
+        :param replacement: Ticket of the new command (None if it is not tracked)
+        """
+        if not self.tickets:
+            return
+
+        with self.lock:
+            waiting = self.tickets.pop(ticket, None)
+            if waiting is None or replacement is None:
+                return
+
+            for trace, traced in waiting:
+                trace['pending'][traced] = replacement
+                trace['coalesced'] = True
+            self.tickets.setdefault(replacement, []).extend(waiting)
+
+    # ------------------------------------------------------------
+    def written(self, tickets: list[int | None]):
+        """
+        Record that commands have been written to the serial port
+        :param tickets: Tickets of the commands
+        """
+        if not self.tickets:
+            return
+
+        now = time.monotonic()
+        with self.lock:
+            for ticket in tickets:
+                for trace, _ in self.tickets.get(ticket, ()):
+                    trace['written'] = now
+
+    # ------------------------------------------------------------
+    def echoed(self, tickets: list[int | None]):
+        """
+        Record that the Arduino has echoed commands back
+        :param tickets: Tickets of the commands
+        """
+        if not self.tickets:
+            return
+
+        now = time.monotonic()
+        with self.lock:
+            for ticket in tickets:
+                for trace, traced in self.tickets.pop(ticket, ()):
+                    trace['pending'].pop(traced, None)
+                    trace['echoed'] = now
+                    if not trace['pending']:
+                        self.__complete(trace)
+
+    # ------------------------------------------------------------
+    def get_traces(self, limit: int | None = None) -> list[dict]:
+        """
+        Get the most recent completed traces
+        :param limit: Maximum number of traces to return
+        :return: List of traces, oldest first, with the time of each stage in milliseconds
+        """
+        with self.lock:
+            self.__expire(time.monotonic())
+            traces = list(self.completed)
+
+        if limit is not None:
+            traces = traces[-limit:] if limit > 0 else []
+        return traces
+
+    # ------------------------------------------------------------
+    def get_summary(self) -> dict:
+        """
+        Get the latency of each stage over the completed traces
+        :return: Dictionary of stage -> {"count", "p50_ms", "p99_ms", "max_ms"}
+        """
+        with self.lock:
+            self.__expire(time.monotonic())
+            traces = list(self.completed)
+
+        summary = {}
+        for stage in self.STAGES:
+            times = sorted(trace['stages_ms'][stage] for trace in traces if trace['stages_ms'][stage] is not None)
+            if times:
+                summary[stage] = {
+                    'count': len(times),
+                    'p50_ms': times[len(times) // 2],
+                    'p99_ms': times[min(len(times) - 1, int(len(times) * 0.99))],
+                    'max_ms': times[-1],
+                }
+
+        return {'sample_rate': self.sample_rate, 'traces': len(traces), 'stages': summary}
+
+    # ------------------------------------------------------------
+    def __complete(self, trace: dict):
+        """
+        Move a trace to the completed ring buffer; the caller holds the lock
+        :param trace: The trace
+        """
+        self.active.pop(trace['id'], None)
+        for ticket in set(trace['pending'].values()):
+            waiting = [item for item in self.tickets.get(ticket, ()) if item[0] is not trace]
+            if waiting:
+                self.tickets[ticket] = waiting
+            else:
+                self.tickets.pop(ticket, None)
+
+        def span(start: float | None, end: float | None) -> float | None:
+            return round((end - start) * 1000, 2) if start is not None and end is not None else None
+
+        self.completed.append({
+            'id': trace['id'],
+            'time': trace['time'],
+            'source': trace['source'],
+            'commands': trace['commands'],
+            'complete': not trace['pending'],
+            'coalesced': trace['coalesced'],
+            'stages_ms': {
+                'server': round(trace['server'] * 1000, 2) if trace['server'] is not None else None,
+                'handling': span(trace['received'], trace['enqueued']),
+                'queued': span(trace['enqueued'], trace['written']),
+                'link': span(trace['written'], trace['echoed']),
+                'total': span(trace['received'], trace['echoed']) if not trace['pending'] else None,
+            },
+        })
+
+    # ------------------------------------------------------------
+    def __expire(self, now: float):
+        """
+        Complete traces whose commands were lost or are too old; the caller holds the lock
+        :param now: Current time.monotonic()
+        """
+        while self.active:
+            trace = next(iter(self.active.values()))
+            if len(self.active) < self.max_active and now - trace['enqueued'] < self.MAX_AGE:
+                break
+            self.__complete(trace)
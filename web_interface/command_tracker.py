@@ -0,0 +1,176 @@
+"""
+Acknowledgement tracking for serial commands sent to the Arduino
+
+The Arduino sketch echoes every command it evaluates back as
+<firstChar><number>, where the number is parsed using atoi(). These
+echoes are matched, in order, against the commands which have been
+written to the port, giving both a confirmation that the command was
+consumed and its round-trip time.
+"""
+
+import re
+import time
+from collections import deque
+from threading import Event, Lock
+from typing import Callable
+
+from command_buffer import CommandBuffer
+
+
+# Must match MAX_SERIAL_LENGTH in wall-e.ino (first character + 4 value characters)
+MAX_SERIAL_LENGTH: int = 5
+
+ECHO_PATTERN = re.compile(r'^[!-~]-?\d+$')
+ATOI_PATTERN = re.compile(r'^\s*([+-]?\d+)')
+
+
+# ------------------------------------------------------------
+def expected_echo(command: str) -> str:
+    """
+    Work out the echo the Arduino will send back for a command
+    :param command: The command which was sent
+    :return: The expected echo string
+    """
+    value = ATOI_PATTERN.match(command[1:MAX_SERIAL_LENGTH])
+    return f'{command[:1]}{int(value.group(1)) if value else 0}'
+
+
+# ================================================================
+class CommandTracker:
+    """Match echoes from the Arduino to the commands which are in flight"""
+
+    MAX_IN_FLIGHT: int = 64     # Oldest commands are dropped if echoes never arrive
+    MAX_AGE: float = 5.0        # Seconds after which an in-flight command is considered lost
+
+    def __init__(self, history: int = 256):
+        """
+        Constructor
+        :param history: Number of recent round-trip times to keep
+        """
+        self.lock: Lock = Lock()
+        self.in_flight: deque = deque(maxlen=self.MAX_IN_FLIGHT)
+        self.waiters: dict = {}
+        self.round_trips: deque = deque(maxlen=history)
+        self.acked: int = 0
+        self.lost: int = 0
+
+    # ------------------------------------------------------------
+    def watch(self, ticket: int, command: str, notify: Callable[[], None] | None = None) -> Event:
+        """
+        Register interest in the acknowledgement of a command
+        Must be called before the command is added to the send buffer
+        :param ticket:  Identifier of the command
+        :param command: The command to be sent
+        :param notify:  Also called once the command has been acknowledged, by the thread reading the echoes
+        :return: Event which is set once the command has been acknowledged
+        """
+        event = Event()
+        with self.lock:
+            self.waiters[ticket] = (command[:1], event, notify)
+        return event
+
+    # ------------------------------------------------------------
+    def forget(self, ticket: int):
+        """
+        Stop waiting for the acknowledgement of a command
+        :param ticket: Identifier of the command
+        """
+        with self.lock:
+            self.waiters.pop(ticket, None)
+
+    # ------------------------------------------------------------
+    def sent(self, echo: str, commands: list[tuple[str, int | None]]):
+        """
+        Record that commands have been written to the serial port
+        :param echo:     The echo the Arduino will send back once it has consumed them, see expected_echo()
+        :param commands: List of (command, ticket) covered by the echo
+        """
+        with self.lock:
+            self.in_flight.append((echo, commands, time.monotonic()))
+
+    # ------------------------------------------------------------
+    def received(self, message: str) -> list[tuple[str, int | None]] | None:
+        """
+        Check whether a received message acknowledges in-flight commands
+        :param message: Line received from the Arduino
+        :return: The acknowledged list of (command, ticket), or None if the message was not a command echo
+        """
+        if not ECHO_PATTERN.match(message):
+            return None
+
+        now = time.monotonic()
+
+        with self.lock:
+            for index, (echo, commands, sent_time) in enumerate(self.in_flight):
+                if echo == message:
+                    break
+            else:
+                return None
+
+            # Anything sent before the matched commands was never echoed
+            for _ in range(index):
+                self.lost += len(self.in_flight.popleft()[1])
+            self.in_flight.popleft()
+
+            self.acked += len(commands)
+            for command, ticket in commands:
+                self.round_trips.append((command, now - sent_time))
+                if ticket is not None:
+                    self.__release(command[:1], ticket)
+
+            # Expire commands which have been waiting too long
+            while self.in_flight and now - self.in_flight[0][2] > self.MAX_AGE:
+                self.lost += len(self.in_flight.popleft()[1])
+
+        return commands
+
+    # ------------------------------------------------------------
+    def clear(self):
+        """
+        Forget all in-flight commands, e.g. when the port is closed
+        """
+        with self.lock:
+            self.in_flight.clear()
+
+    # ------------------------------------------------------------
+    def get_stats(self) -> dict:
+        """
+        Summary of the command round-trip times
+        :return: Dictionary with counts and round-trip times in milliseconds
+        """
+        with self.lock:
+            times = sorted(rtt for _, rtt in self.round_trips)
+            last = self.round_trips[-1][1] if self.round_trips else 0.0
+            stats = {
+                'acked': self.acked,
+                'lost': self.lost,
+                'in_flight': len(self.in_flight),
+            }
+
+        if times:
+            stats['rtt_ms'] = {
+                'last': round(last * 1000, 2),
+                'mean': round(sum(times) / len(times) * 1000, 2),
+                'p50': round(times[len(times) // 2] * 1000, 2),
+                'p99': round(times[min(len(times) - 1, int(len(times) * 0.99))] * 1000, 2),
+                'max': round(times[-1] * 1000, 2),
+            }
+
+        return stats
+
+    # ------------------------------------------------------------
+    def __release(self, channel: str, ticket: int):
+        """
+        Set the events of all waiters covered by an acknowledged command
+        Values which were coalesced into a newer value are covered by its echo
+        :param channel: First character of the acknowledged command
+        :param ticket:  Identifier of the acknowledged command
+        """
+        coalesced = channel in CommandBuffer.COALESCED_CHANNELS
+
+        for waiting, (waiting_channel, event, notify) in list(self.waiters.items()):
+            if waiting == ticket or (coalesced and waiting_channel == channel and waiting < ticket):
+                event.set()
+                if notify is not None:
+                    notify()
+                del self.waiters[waiting]
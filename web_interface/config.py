@@ -11,8 +11,25 @@ SECRET_KEY = b'\xccCL\xb2&S\xcb\xfa&\x0e\x90\x03\xe7h5\x0f\x1e\r\xef\xd6 2\x05&'
 # Web Interface Settings
 APP_PORT = 5000                                         # Port of the application
 APP_DEBUG = False                                       # Enable / Disable Python Server Debugging
+CONTROL_SOCKET_PORT = 5001                              # Port of the WebSocket used by the joystick and gamepad (0 = use HTTP requests only)
+CONTROL_LEASE_TIMEOUT = 2.0                             # Seconds one client keeps the drive motors after its last drive command (0 = anyone can drive)
+EVENTS_MAX_CLIENTS = 4                                  # Maximum number of /api/events status streams open at once
+SERVER_MODE = "waitress"                                # "waitress" (thread pool) or "asgi" (asyncio event loop, requires uvicorn)
+ASGI_THREADS = 4                                        # In "asgi" mode, threads running the routes which are not asynchronous
 LOGIN_PASSWORD = "walle"                                # Password for web-interface
 ARDUINO_PORT = "/dev/ttyACM0"                           # Default port which will be selected
+SERIAL_BAUD_RATE = 115200                               # Baud rate of the Arduino serial link
+SERIAL_FLUSH_BYTES = 64                                 # Max bytes per serial write (Arduino receive buffer is 64 bytes, ~5.6 ms at 115200 baud)
+SERIAL_ACK_TIMEOUT = 1.0                                # Seconds API requests with ?ack=1 wait for the Arduino to echo a command
+TRACE_SAMPLE_RATE = 0.1                                 # Fraction of command requests traced from request to echo (see /api/traces)
+TRACE_BUFFER = 200                                      # Number of completed command traces kept
+SERIAL_BUDGET_BURST = 256                               # Bytes of API commands which can be queued in a burst above the link rate
+SERIAL_BUDGET_POLICY = "merge"                          # Over budget: "merge" = still accept motor/servo values (they replace pending ones), "reject" = refuse with 429
+SERIAL_BINARY_FRAMES = True                             # Pack motor/servo values into binary pose frames if the Arduino sketch supports them
+SERIAL_RECONNECT = True                                 # Automatically reconnect when the same Arduino reappears after the USB link drops
+SERIAL_OUTAGE_POLICY = "reject"                         # While reconnecting: "reject" = refuse commands, "buffer" = queue them until reconnected
+BATCH_MAX_OPERATIONS = 100                              # Maximum number of operations in one /api/batch request
+BATCH_MAX_DURATION = 300                                # Maximum seconds from the start to the last operation of a batch
 AUTOSTART_ARDUINO = True                                # False = no auto connect, True = automatically try to connect to default port
 AUTOSTART_CAM = True                                    # False = no auto start, True = automatically start up the camera
 SOUND_FOLDER = os.path.join(BASEDIR, "static/sounds/")  # Location of the folder containing all audio files
@@ -20,9 +37,21 @@ ESPEAK_CMD = ['espeak-ng', '-v', 'en', '-b', '1']       # ESpeak Command and Lan
 RB_CMD = ['rubberband', '-t', '1.1', '-p', '2', '-c', '6', '-f', '1.8', '-q']  # Rubberband for pitch shifting TTS
 AUDIOPLAYER_CMD = ['aplay']                             # Command for local audioplayer
 SOUND_FORMAT = "wav"                                    # Audio file format
+AUDIO_ENGINE = True                                     # Play sound clips in-process from memory (needs python3-alsaaudio, otherwise AUDIOPLAYER_CMD is used)
+AUDIO_DEVICE = "default"                                # ALSA device of the audio engine
+AUDIO_PERIOD_FRAMES = 256                               # Frames written at a time by the audio engine (256 = 5.8 ms at 44.1 kHz)
+AUDIO_POLICY = "mix"                                    # "mix" overlapping clips, or "preempt" to cut off the clip playing
+AUDIO_MAX_VOICES = 4                                    # Clips mixed at once with the "mix" policy
+AUDIO_MIXER = "Master"                                  # ALSA mixer control for the volume ("" = scale the samples in software)
+STATIC_BUILD_FOLDER = os.path.join(BASEDIR, "static_build/")  # Hashed and compressed copies of the static files (empty = serve them as they are)
+ANIMATION_FOLDER = os.path.join(BASEDIR, "animations/")  # Keyframe animation files (see keyframes.py)
+ANIMATION_TICK_RATE = 25                                # Servo setpoints sent per second while a keyframe animation plays
+RECORDING_FOLDER = os.path.join(BASEDIR, "recordings/")  # Recorded control sessions (see /api/recordings)
 
 # Values for Codeblock Movement
 CODEBLOCK_MOTORPOWER = 0.8   # Motorpower at which the speed below is reached
 CODEBLOCK_MOTORSPEED = 17    # this WALLE_E drives at 17 cm/s at given MOTORPOWER
 CODEBLOCK_TURNPOWER = 0.5    # Motorpower for the turn movement
 CODEBLOCK_TURNTIME = 1.8     # the time (s) it takes to move 90° at given TURNPOWER
+CODEBLOCK_MAX_STEPS = 1000   # Maximum number of operations in a compiled program (/api/program)
+CODEBLOCK_MAX_DURATION = 600 # Maximum length of a program in seconds
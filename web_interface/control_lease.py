@@ -0,0 +1,210 @@
+"""
+Arbitration of the drive motors between clients
+
+Any logged-in browser, the WebSocket control channel and any /api/*
+caller can drive the robot. When two of them do so at the same time,
+their streams of X/Y commands interleave in the serial queue and the
+robot jitters between the two inputs.
+
+One client at a time holds the motion lease. The lease is taken by the
+first drive command sent while it is free, and renewed by each drive
+command of its holder; it runs out when the holder has not driven for
+the lease time, or is released when the holder disconnects. Drive
+commands of other clients are refused before they reach the serial
+queue, with the time until the lease runs out. A client can take the
+lease over explicitly (e.g. an operator taking control from a script),
+in which case the motors are stopped first.
+
+Programs, batches and replays which drive keep the lease of the client
+which started them while they run: each step renews it until the lease
+time after the next step is due, and it is released when the last run
+of the client ends.
+A run stops when its client no longer holds the lease.
+
+Stopping the robot is never subject to the lease.
+"""
+
+import time
+from threading import Lock
+from typing import Any, Callable
+
+
+# ================================================================
+class ControlLease:
+    """Time-limited motion lease held by one client at a time"""
+
+    def __init__(self, duration: float, publish: Callable[[str, Any], None]):
+        """
+        Constructor
+        :param duration: Seconds the lease is held after its holder's last drive command (0 = no arbitration)
+        :param publish:  Function publishing an event, called with (event type, data)
+        """
+        self.duration: float = duration
+        self.publish = publish
+        self.lock: Lock = Lock()
+        self.holder: str | None = None      # Id of the client holding the lease
+        self.name: str | None = None        # Description of the holder shown to other clients, e.g. its address
+        self.acquired: float = 0.0
+        self.expires: float = 0.0
+        self.runs: dict[str, int] = {}      # Client -> programs, batches and replays of it which are running
+        self.granted: int = 0
+        self.rejected: int = 0
+
+    # ------------------------------------------------------------
+    def admit(self, client: str, name: str) -> float:
+        """
+        Check a drive command of a client, taking or renewing the lease
+        :param client: Id of the client
+        :param name:   Description of the client
+        :return: 0 if the client may drive, otherwise the seconds until the current lease runs out
+        """
+        if self.duration <= 0:
+            return 0.0
+
+        now = time.monotonic()
+        with self.lock:
+            if self.holder == client or self.holder is None or now >= self.expires:
+                changed = self.holder != client
+                if changed:
+                    self.__grant(client, name, now)
+                self.expires = now + self.duration
+            else:
+                self.rejected += 1
+                return self.expires - now
+
+        if changed:
+            self.__publish("granted")
+        return 0.0
+
+    # ------------------------------------------------------------
+    def acquire(self, client: str, name: str, force: bool = False) -> float:
+        """
+        Take the lease explicitly
+        :param client: Id of the client
+        :param name:   Description of the client
+        :param force:  Take the lease over from another client
+        :return: 0 if the client holds the lease, otherwise the seconds until the current lease runs out
+        """
+        if force:
+            now = time.monotonic()
+            with self.lock:
+                if self.holder != client:
+                    self.__grant(client, name, now)
+                self.expires = now + max(self.duration, 0.0)
+            self.__publish("granted")
+            return 0.0
+
+        return self.admit(client, name)
+
+    # ------------------------------------------------------------
+    def renew(self, client: str, seconds: float) -> bool:
+        """
+        Keep the lease of a client for a step of a program, batch or replay
+        The lease is kept for the lease time after the next step is due, so that the step still finds it
+        held when it starts a little late.
+        :param client:  Id of the client
+        :param seconds: Seconds until the next step
+        :return: False if the client no longer holds the lease
+        """
+        if self.duration <= 0:
+            return True
+
+        now = time.monotonic()
+        with self.lock:
+            if self.holder != client or now >= self.expires:
+                return False
+            self.expires = max(self.expires, now + seconds + self.duration)
+        return True
+
+    # ------------------------------------------------------------
+    def begin_run(self, client: str):
+        """
+        Note that a program, batch or replay of a client has started
+        While it runs, release() does not give up the lease of the client.
+        :param client: Id of the client
+        """
+        with self.lock:
+            self.runs[client] = self.runs.get(client, 0) + 1
+
+    # ------------------------------------------------------------
+    def end_run(self, client: str):
+        """
+        Note that a program, batch or replay of a client has ended, releasing the lease after the last one
+        :param client: Id of the client
+        """
+        with self.lock:
+            runs = self.runs.pop(client, 0) - 1
+            if runs > 0:
+                self.runs[client] = runs
+                return
+
+        self.release(client)
+
+    # ------------------------------------------------------------
+    def release(self, client: str) -> bool:
+        """
+        Give up the lease
+        :param client: Id of the client
+        :return: True if the client held the lease, False if not or if a program, batch or replay of it is running
+        """
+        with self.lock:
+            if self.holder != client or time.monotonic() >= self.expires or client in self.runs:
+                return False
+            self.holder = None
+            self.name = None
+
+        self.__publish("released")
+        return True
+
+    # ------------------------------------------------------------
+    def holds(self, client: str) -> bool:
+        """
+        Check whether a client holds the lease
+        :param client: Id of the client
+        :return: True if the client holds the lease and it has not run out, or if there is no arbitration
+        """
+        if self.duration <= 0:
+            return True
+
+        with self.lock:
+            return self.holder == client and time.monotonic() < self.expires
+
+    # ------------------------------------------------------------
+    def get_status(self) -> dict:
+        """
+        Get the state of the lease
+        :return: Dictionary with the holder's description (or None), seconds held and remaining, its runs and counters
+        """
+        now = time.monotonic()
+        with self.lock:
+            held = self.holder is not None and now < self.expires
+            return {
+                'enabled': self.duration > 0,
+                'holder': self.name if held else None,
+                'held': round(now - self.acquired, 3) if held else 0.0,
+                'remaining': round(self.expires - now, 3) if held else 0.0,
+                'runs': self.runs.get(self.holder, 0) if held else 0,
+                'granted': self.granted,
+                'rejected': self.rejected,
+            }
+
+    # ------------------------------------------------------------
+    def __grant(self, client: str, name: str, now: float):
+        """
+        Give the lease to a client; the caller holds the lock
+        :param client: Id of the client
+        :param name:   Description of the client
+        :param now:    time.monotonic()
+        """
+        self.holder = client
+        self.name = name
+        self.acquired = now
+        self.granted += 1
+
+    # ------------------------------------------------------------
+    def __publish(self, state: str):
+        """
+        Publish a change of the lease
+        :param state: "granted" or "released"
+        """
+        self.publish("lease", dict(self.get_status(), state=state))
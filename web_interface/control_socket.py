@@ -0,0 +1,440 @@
+"""
+WebSocket control channel for the joystick and gamepad
+
+Sending every joystick update as an HTTP POST costs a new request, a
+session decode, a form parse and a JSON response. This server keeps one
+WebSocket open per browser instead, so that movement values can be
+streamed at 30-50 Hz and passed straight to the ArduinoDevice queue.
+
+It runs on its own port next to the Flask app (waitress does not support
+connection upgrades), and is implemented on top of socketserver so that
+no extra libraries have to be installed on the Raspberry Pi.
+
+Client -> server (JSON text messages):
+    {"x": -100..100, "y": -100..100}    Drive motors
+    {"servos": {"G": 0..100, ...}}      Move servos (G, T, B, U, E, L, R)
+    {"stop": true}                      Stop the motors, ahead of anything queued (never refused)
+    {"subscribe": ["battery", ...]}     Telemetry types which are pushed back
+    Any message can contain an "id", which is acknowledged once the
+    Arduino has echoed all of its commands back.
+
+Server -> client:
+    {"ack": id, "ok": true/false}
+    {"error": "message", "id": id}
+    {"error": "message", "id": id, "lease": {"holder": ..., "retry_after": seconds}}
+                                        Drive refused, another client holds the motion lease
+    {"telemetry": {"time": ..., "type": ..., "message": ..., "value": ...}}
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import queue
+import socket
+import socketserver
+import struct
+import time
+from threading import Thread
+from urllib.parse import urlsplit
+
+from binary_protocol import POSE_CHANNELS
+from command_trace import TraceContext
+from control_lease import ControlLease
+
+
+WEBSOCKET_GUID: bytes = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OPCODE_CONTINUATION: int = 0x0
+OPCODE_TEXT: int = 0x1
+OPCODE_CLOSE: int = 0x8
+OPCODE_PING: int = 0x9
+OPCODE_PONG: int = 0xA
+
+CLOSE_NORMAL: int = 1000
+CLOSE_PROTOCOL_ERROR: int = 1002
+CLOSE_TOO_BIG: int = 1009
+
+SERVO_CHANNELS: str = POSE_CHANNELS.replace("X", "").replace("Y", "")
+
+
+# ================================================================
+class ControlSocketServer(socketserver.ThreadingTCPServer):
+    """WebSocket server which passes control messages to the Arduino"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    MAX_MESSAGE: int = 4096     # Largest message accepted from a client, in bytes
+    MAX_OUTBOX: int = 64        # Messages queued for a slow client before telemetry is dropped
+    DEFAULT_TELEMETRY: tuple = ("battery", "error", "startup", "protocol")
+
+    def __init__(self, device, authorize, host: str = "0.0.0.0", port: int = 5001, ack_timeout: float = 1.0,
+                 lease: ControlLease | None = None, identify=None):
+        """
+        Constructor
+        :param device:      The ArduinoDevice which receives the commands
+        :param authorize:   Function which takes the HTTP headers of the handshake, and returns
+                            True if the client is logged in
+        :param host:        Address to listen on
+        :param port:        Port to listen on
+        :param ack_timeout: Maximum time in seconds to wait for the Arduino to echo a message
+        :param lease:       Motion lease which drive messages must hold, None to let every client drive
+        :param identify:    Function which takes the HTTP headers of the handshake and the client's address,
+                            and returns the (id, description) of the client for the lease
+        """
+        super().__init__((host, port), ControlSocketHandler, bind_and_activate=False)
+        self.device = device
+        self.authorize = authorize
+        self.lease: ControlLease | None = lease
+        self.identify = identify or (lambda headers, address: ("address:" + address, address))
+        self.ack_timeout: float = ack_timeout
+        self.thread: Thread | None = None
+        self.clients: int = 0
+
+    # ------------------------------------------------------------
+    def start(self) -> bool:
+        """
+        Start accepting connections in a background thread
+        :return: True if the server is listening, False otherwise
+        """
+        try:
+            self.server_bind()
+            self.server_activate()
+        except OSError as ex:
+            logging.error(f'Unable to start control socket on port {self.server_address[1]}: {repr(ex)}')
+            return False
+
+        self.thread = Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        logging.info(f'Control socket listening on port {self.server_address[1]}')
+        return True
+
+    # ------------------------------------------------------------
+    def stop(self):
+        """
+        Stop accepting connections
+        """
+        if self.thread is not None:
+            self.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.server_close()
+
+
+# ================================================================
+class ControlSocketHandler(socketserver.StreamRequestHandler):
+    """One WebSocket connection"""
+
+    server: ControlSocketServer
+
+    # ------------------------------------------------------------
+    def setup(self):
+        """Set up the connection state"""
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.outbox: queue.Queue = queue.Queue(self.server.MAX_OUTBOX)
+        self.pending_acks: queue.Queue = queue.Queue()
+        self.subscriptions: set = set(self.server.DEFAULT_TELEMETRY)
+        self.moving: bool = False
+        self.client: tuple[str, str] = ("", "")     # (id, description) for the motion lease
+        self.open: bool = False
+        self.close_code: int = CLOSE_NORMAL
+
+    # ------------------------------------------------------------
+    def handle(self):
+        """Perform the handshake, then process messages until the client disconnects"""
+        if not self.__handshake():
+            return
+
+        self.open = True
+        self.server.clients += 1
+        self.server.device.telemetry.add_listener(self.__on_telemetry)
+        writer = Thread(target=self.__write_thread, daemon=True)
+        acker = Thread(target=self.__ack_thread, daemon=True)
+        writer.start()
+        acker.start()
+
+        try:
+            while True:
+                message = self.__read_message()
+                if message is None:
+                    break
+                self.__on_message(message)
+
+        except (OSError, ConnectionError, ValueError) as ex:
+            logging.debug(f'Control socket {self.client_address[0]} closed: {repr(ex)}')
+
+        finally:
+            self.open = False
+            self.server.clients -= 1
+            self.server.device.telemetry.remove_listener(self.__on_telemetry)
+            self.pending_acks.put(None)
+            self.__send(None, droppable=True)
+
+            # Do not keep driving if the controlling browser goes away, and let other clients drive
+            lease = self.server.lease
+            driving = lease is None or lease.holds(self.client[0])
+            if lease is not None:
+                lease.release(self.client[0])
+            if self.moving and driving:
+                self.server.device.stop()
+
+            acker.join()
+            writer.join()
+
+            try:
+                self.__send_frame(OPCODE_CLOSE, struct.pack('!H', self.close_code))
+            except OSError:
+                pass
+
+    # ------------------------------------------------------------
+    def __handshake(self) -> bool:
+        """
+        Read the HTTP upgrade request and accept it
+        :return: True if the connection has been upgraded to a WebSocket
+        """
+        request_line = self.rfile.readline(1024).decode('latin-1').strip()
+        headers = {}
+
+        while True:
+            line = self.rfile.readline(8192).decode('latin-1')
+            if line in ('\r\n', '\n', ''):
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        key = headers.get('sec-websocket-key')
+        if (not request_line.startswith('GET ') or key is None
+                or headers.get('upgrade', '').lower() != 'websocket'
+                or headers.get('sec-websocket-version') != '13'):
+            self.__reject('400 Bad Request')
+            return False
+
+        # Browsers send the session cookie along with any page's requests, so only allow our own pages
+        origin = urlsplit(headers.get('origin', '')).hostname
+        host = urlsplit('//' + headers.get('host', '')).hostname
+        if origin is not None and origin != host:
+            self.__reject('403 Forbidden')
+            return False
+
+        if not self.server.authorize(headers):
+            self.__reject('401 Unauthorized')
+            return False
+
+        self.client = self.server.identify(headers, self.client_address[0])
+
+        accept = base64.b64encode(hashlib.sha1(key.encode() + WEBSOCKET_GUID).digest()).decode()
+        self.wfile.write(("HTTP/1.1 101 Switching Protocols\r\n"
+                          "Upgrade: websocket\r\n"
+                          "Connection: Upgrade\r\n"
+                          f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+        return True
+
+    # ------------------------------------------------------------
+    def __reject(self, status: str):
+        """
+        Refuse the upgrade request
+        :param status: HTTP status line
+        """
+        self.wfile.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+
+    # ------------------------------------------------------------
+    def __read_message(self) -> str | None:
+        """
+        Read one text message, answering control frames on the way
+        :return: The message, or None if the connection was closed
+        """
+        message = bytearray()
+
+        while True:
+            header = self.rfile.read(2)
+            if len(header) < 2:
+                return None
+
+            fin = header[0] & 0x80
+            opcode = header[0] & 0x0F
+            length = header[1] & 0x7F
+
+            # Clients must mask all frames
+            if not header[1] & 0x80:
+                self.close_code = CLOSE_PROTOCOL_ERROR
+                return None
+
+            if length == 126:
+                length = struct.unpack('!H', self.rfile.read(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', self.rfile.read(8))[0]
+
+            if len(message) + length > self.server.MAX_MESSAGE:
+                self.close_code = CLOSE_TOO_BIG
+                return None
+
+            mask = self.rfile.read(4)
+            payload = bytearray(self.rfile.read(length))
+            if len(payload) < length:
+                return None
+            for i in range(length):
+                payload[i] ^= mask[i % 4]
+
+            if opcode == OPCODE_CLOSE:
+                return None
+            elif opcode == OPCODE_PING:
+                self.__send((OPCODE_PONG, bytes(payload)), droppable=True)
+            elif opcode in (OPCODE_TEXT, OPCODE_CONTINUATION):
+                message.extend(payload)
+                if fin:
+                    return message.decode()
+
+    # ------------------------------------------------------------
+    def __send_frame(self, opcode: int, payload: bytes):
+        """
+        Write a frame to the client; only called by the writer thread, or once it has stopped
+        :param opcode:  Frame type
+        :param payload: Frame data
+        """
+        if len(payload) < 126:
+            header = struct.pack('!BB', 0x80 | opcode, len(payload))
+        elif len(payload) < 65536:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, len(payload))
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, len(payload))
+
+        self.wfile.write(header + payload)
+
+    # ------------------------------------------------------------
+    def __send(self, message: dict | tuple | None, droppable: bool = False):
+        """
+        Queue a message for the client
+        :param message:   The message, or an (opcode, payload) control frame (None stops the writer)
+        :param droppable: Drop the message straight away if the client is not keeping up,
+                          instead of waiting for up to the ack timeout
+        """
+        try:
+            if droppable:
+                self.outbox.put_nowait(message)
+            else:
+                self.outbox.put(message, timeout=self.server.ack_timeout)
+        except queue.Full:
+            pass
+
+    # ------------------------------------------------------------
+    def __on_message(self, text: str):
+        """
+        Translate a client message into Arduino commands
+        :param text: JSON text message
+        """
+        received = time.monotonic()
+        message_id = None
+
+        try:
+            message = json.loads(text)
+            message_id = message.get('id')
+            commands = self.__commands(message)
+            if 'subscribe' in message:
+                self.subscriptions = set(str(event_type) for event_type in message['subscribe'])
+        except (ValueError, TypeError, AttributeError) as ex:
+            self.__send({'error': f'Invalid message: {ex}', 'id': message_id})
+            return
+
+        device = self.server.device
+
+        if not commands:
+            if message_id is not None:
+                self.__send({'ack': message_id, 'ok': True})
+            return
+
+        if not device.accepts_commands():
+            self.__send({'error': 'Arduino not connected', 'id': message_id})
+            return
+
+        urgent = bool(message.get('stop'))
+        lease = self.server.lease
+        if not urgent and lease is not None and ('x' in message or 'y' in message):
+            retry_after = lease.admit(*self.client)
+            if retry_after > 0:
+                self.moving = False
+                holder = lease.get_status()['holder'] or "Another client"
+                self.__send({'error': f'{holder} is driving the robot', 'id': message_id,
+                             'lease': {'holder': holder, 'retry_after': round(retry_after, 3)}})
+                return
+
+        if not urgent and device.admit(commands) > 0:
+            self.__send({'error': 'Serial bandwidth exceeded, slow down', 'id': message_id})
+            return
+
+        tracked = device.track_commands(commands, message_id is not None, urgent, TraceContext("websocket", received))
+        if tracked is None:
+            self.__send({'error': 'Arduino not connected', 'id': message_id})
+        elif message_id is not None:
+            self.pending_acks.put((message_id, tracked, time.monotonic() + self.server.ack_timeout))
+
+    # ------------------------------------------------------------
+    def __commands(self, message: dict) -> list[str]:
+        """
+        Get the Arduino commands for a client message
+        :param message: The decoded message
+        :return: List of commands, in send order
+        """
+        if message.get('stop'):
+            self.moving = False
+            return ["X0", "Y0"]
+
+        commands = []
+
+        if 'x' in message or 'y' in message:
+            x = max(-100, min(100, int(message.get('x', 0))))
+            y = max(-100, min(100, int(message.get('y', 0))))
+            self.moving = x != 0 or y != 0
+            commands += [f"X{x}", f"Y{y}"]
+
+        for servo, value in message.get('servos', {}).items():
+            if len(servo) != 1 or servo not in SERVO_CHANNELS:
+                raise ValueError(f'unknown servo "{servo}"')
+            commands.append(f"{servo}{max(0, min(100, int(value)))}")
+
+        return commands
+
+    # ------------------------------------------------------------
+    def __on_telemetry(self, event):
+        """
+        Called by the serial reader for every message received from the Arduino
+        :param event: The TelemetryEvent
+        """
+        if event.type in self.subscriptions:
+            self.__send({'telemetry': event._asdict()}, droppable=True)
+
+    # ------------------------------------------------------------
+    def __ack_thread(self):
+        """Report to the client when the Arduino has echoed its messages, in order"""
+        while True:
+            item = self.pending_acks.get()
+            if item is None:
+                break
+
+            message_id, tracked, deadline = item
+            ok = all(event.wait(max(0.0, deadline - time.monotonic())) for _, event in tracked)
+            self.server.device.forget_commands([ticket for ticket, _ in tracked])
+            self.__send({'ack': message_id, 'ok': ok})
+
+        # Release the tickets of messages which will never be reported
+        while not self.pending_acks.empty():
+            item = self.pending_acks.get()
+            if item is not None:
+                self.server.device.forget_commands([ticket for ticket, _ in item[1]])
+
+    # ------------------------------------------------------------
+    def __write_thread(self):
+        """Send queued messages to the client"""
+        while True:
+            message = self.outbox.get()
+            if message is None or not self.open:
+                break
+
+            try:
+                if isinstance(message, tuple):
+                    self.__send_frame(*message)
+                else:
+                    self.__send_frame(OPCODE_TEXT, json.dumps(message).encode())
+            except OSError:
+                break
@@ -0,0 +1,150 @@
+"""
+In-process publish/subscribe hub for robot status events
+
+The ArduinoDevice and camera streamer publish events here when their
+state changes (connection, battery level, camera on/off, command acks).
+Each open /api/events stream subscribes to the types it wants, so that
+dashboards are updated straight away instead of polling the status.
+
+Publishing never blocks: if a subscriber is not keeping up, its oldest
+events are dropped.
+"""
+
+import time
+from collections import deque
+from itertools import count
+from threading import Condition, Lock
+from typing import Any, NamedTuple
+
+
+# ================================================================
+class HubEvent(NamedTuple):
+    """An event published to the hub"""
+    id: int             # Sequence number of the event
+    time: float         # Wall-clock time the event was published
+    type: str           # Event type, e.g. "battery"
+    data: Any           # JSON serialisable event data
+
+
+# ================================================================
+class Subscription:
+    """Queue of events for one subscriber"""
+
+    def __init__(self, types: set | None, max_queue: int):
+        """
+        Constructor
+        :param types:     Event types which are received (None for all types)
+        :param max_queue: Number of events buffered before the oldest are dropped
+        """
+        self.types: set | None = types
+        self.condition: Condition = Condition()
+        self.events: deque = deque(maxlen=max_queue)
+        self.dropped: int = 0
+        self.closed: bool = False
+
+    # ------------------------------------------------------------
+    def put(self, event: HubEvent):
+        """
+        Add an event, if the subscriber is interested in its type
+        :param event: The event
+        """
+        if self.types is not None and event.type not in self.types:
+            return
+
+        with self.condition:
+            if len(self.events) == self.events.maxlen:
+                self.dropped += 1
+            self.events.append(event)
+            self.condition.notify()
+
+    # ------------------------------------------------------------
+    def get(self, timeout: float | None = None) -> HubEvent | None:
+        """
+        Take the next event, waiting until one is available
+        :param timeout: Maximum time to wait in seconds (None waits forever)
+        :return: The event, or None if timed out or closed
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.events or self.closed, timeout)
+            return self.events.popleft() if self.events else None
+
+    # ------------------------------------------------------------
+    def close(self):
+        """
+        Wake up the subscriber, and stop it from waiting for more events
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+# ================================================================
+class EventHub:
+    """Fan out status events to any number of subscribers"""
+
+    def __init__(self, max_subscribers: int = 4, max_queue: int = 100):
+        """
+        Constructor
+        :param max_subscribers: Maximum number of subscribers at once
+        :param max_queue:       Events buffered per subscriber
+        """
+        self.max_subscribers: int = max_subscribers
+        self.max_queue: int = max_queue
+        self.lock: Lock = Lock()
+        self.subscribers: list[Subscription] = []
+        self.ids = count(1)
+        self.published: int = 0
+
+    # ------------------------------------------------------------
+    def subscribe(self, types: set | None = None) -> Subscription | None:
+        """
+        Start receiving events
+        :param types: Event types to receive (None for all types)
+        :return: The subscription, or None if there are too many subscribers
+        """
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None
+
+            subscription = Subscription(types, self.max_queue)
+            self.subscribers.append(subscription)
+            return subscription
+
+    # ------------------------------------------------------------
+    def unsubscribe(self, subscription: Subscription):
+        """
+        Stop receiving events
+        :param subscription: The subscription returned by subscribe()
+        """
+        with self.lock:
+            if subscription in self.subscribers:
+                self.subscribers.remove(subscription)
+        subscription.close()
+
+    # ------------------------------------------------------------
+    def publish(self, event_type: str, data: Any = None):
+        """
+        Send an event to all subscribers; never blocks
+        :param event_type: Type of the event
+        :param data:       JSON serialisable event data
+        """
+        with self.lock:
+            event = HubEvent(next(self.ids), time.time(), event_type, data)
+            self.published += 1
+            subscribers = list(self.subscribers)
+
+        for subscription in subscribers:
+            subscription.put(event)
+
+    # ------------------------------------------------------------
+    def get_stats(self) -> dict:
+        """
+        Get the number of subscribers and events
+        :return: Dictionary with the subscribers, events published and events dropped for slow subscribers
+        """
+        with self.lock:
+            return {
+                'subscribers': len(self.subscribers),
+                'published': self.published,
+                'dropped': sum(subscription.dropped for subscription in self.subscribers),
+            }
@@ -0,0 +1,64 @@
+"""
+Directory change notifications using inotify
+
+Shared by the watchers of the serial device directory (port_registry.py)
+and of the sound folder (sound_catalog.py). inotify is called through
+ctypes, so that no extra libraries have to be installed.
+"""
+
+import ctypes
+import os
+import struct
+import sys
+
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE: int = 0x00000008
+IN_MOVED_FROM: int = 0x00000040
+IN_MOVED_TO: int = 0x00000080
+IN_CREATE: int = 0x00000100
+IN_DELETE: int = 0x00000200
+IN_EVENT_HEADER = struct.Struct('iIII')
+
+
+# ------------------------------------------------------------
+def open_inotify(path: str, mask: int) -> int:
+    """
+    Start watching a directory using inotify
+    :param path: The directory
+    :param mask: Events to watch for (IN_* constants)
+    :return: The inotify file descriptor, to be closed by the caller
+    :raise OSError: If inotify is not available
+    """
+    if sys.platform != "linux":
+        raise OSError("inotify is only available on linux")
+
+    libc = ctypes.CDLL(None, use_errno=True)
+    fd = libc.inotify_init1(os.O_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    if libc.inotify_add_watch(fd, path.encode(), mask) < 0:
+        error = ctypes.get_errno()
+        os.close(fd)
+        raise OSError(error, "inotify_add_watch failed")
+
+    return fd
+
+
+# ------------------------------------------------------------
+def inotify_names(data: bytes) -> list[bytes]:
+    """
+    Get the file names from a block of inotify events
+    :param data: Raw events read from the inotify file descriptor
+    :return: Name of the file of each event
+    """
+    names = []
+    offset = 0
+    while offset + IN_EVENT_HEADER.size <= len(data):
+        _, _, _, length = IN_EVENT_HEADER.unpack_from(data, offset)
+        offset += IN_EVENT_HEADER.size
+        names.append(data[offset:offset + length].rstrip(b'\0'))
+        offset += length
+
+    return names
@@ -0,0 +1,340 @@
+"""
+Keyframe animations played by streaming servo setpoints
+
+The animations built into the Arduino sketch (animations.ino) can only
+be changed by re-flashing it. The animations here are JSON files in the
+animation folder instead, with a curve of keyframes per servo:
+
+    {
+        "loop": false,
+        "tracks": {
+            "arm_right": [[0, 40], [0.6, 100, "out"], [1.2, 60, "in_out"], [1.8, 100]],
+            "head_rotation": [[0, 50], [1.8, 30, "in_out"]]
+        }
+    }
+
+Each keyframe is [seconds, value 0-100] or [seconds, value, easing],
+where the easing shapes the curve arriving at the keyframe: "linear"
+(default), "in", "out", "in_out" (cubic) or "step" (jump at the
+keyframe). Servos are named as in /api/servo.
+
+When a file is loaded, the curves are sampled at the tick rate into one
+flat array of values, so playing a tick costs one array lookup. The
+player sends only the servos whose value changed; the values go through
+the ArduinoDevice send buffer, where a setpoint which has not been sent
+yet is replaced by the next one if the link falls behind.
+"""
+
+import json
+import logging
+import os
+import time
+from array import array
+from threading import Event, Lock, Thread
+from typing import Any, Callable
+
+
+# Easing of the curve between two keyframes, as a function of the fraction of time passed (0 to 1)
+EASINGS: dict[str, Callable[[float], float]] = {
+    'linear': lambda x: x,
+    'in': lambda x: x * x * x,
+    'out': lambda x: 1 - (1 - x) ** 3,
+    'in_out': lambda x: 4 * x * x * x if x < 0.5 else 1 - (-2 * x + 2) ** 3 / 2,
+    'step': lambda x: 0.0,
+}
+
+UNCHANGED: int = -1     # Value of a servo without a track
+
+
+# ================================================================
+class KeyframeAnimation:
+    """An animation sampled at a fixed tick rate"""
+
+    def __init__(self, name: str, data: dict, servos: dict, tick_rate: float):
+        """
+        Constructor - samples the keyframe curves
+        :param name:      Name of the animation
+        :param data:      Contents of the keyframe file
+        :param servos:    Servo name -> serial command letter
+        :param tick_rate: Ticks per second
+        :raise ValueError: If the keyframes are not valid
+        """
+        tracks = data.get('tracks')
+        if not isinstance(tracks, dict) or not tracks:
+            raise ValueError('tracks must be a non-empty object')
+
+        curves = {}
+        for servo, keyframes in tracks.items():
+            if servo not in servos:
+                raise ValueError(f'Invalid servo "{servo}". Valid servos: {", ".join(servos)}')
+            curves[servos[servo]] = self.__parse_track(servo, keyframes)
+
+        self.name: str = name
+        self.tick_rate: float = tick_rate
+        self.loop: bool = bool(data.get('loop', False))
+        self.servos: list[str] = list(tracks)
+        self.channels: str = "".join(servos.values())
+        self.duration: float = max(curve[-1][0] for curve in curves.values())
+        self.ticks: int = int(round(self.duration * tick_rate)) + 1
+
+        # Values of every channel at every tick: frames[tick * len(channels) + channel]
+        self.frames: array = array('b', [UNCHANGED]) * (self.ticks * len(self.channels))
+        for index, channel in enumerate(self.channels):
+            if channel in curves:
+                for tick, value in enumerate(self.__sample(curves[channel])):
+                    self.frames[tick * len(self.channels) + index] = value
+
+    # ------------------------------------------------------------
+    def frame(self, tick: int) -> array:
+        """
+        Get the values of all channels at a tick
+        :param tick: Index of the tick (0 to ticks - 1)
+        :return: Value of each channel in the order of channels (UNCHANGED if it has no track)
+        """
+        width = len(self.channels)
+        return self.frames[tick * width:(tick + 1) * width]
+
+    # ------------------------------------------------------------
+    def get_info(self) -> dict:
+        """
+        Describe the animation
+        :return: Dictionary with the name, duration, loop flag and servos
+        """
+        return {'name': self.name, 'duration': self.duration, 'loop': self.loop, 'servos': self.servos}
+
+    # ------------------------------------------------------------
+    @staticmethod
+    def __parse_track(servo: str, keyframes) -> list[tuple[float, int, Callable[[float], float]]]:
+        """
+        Validate the keyframes of a servo
+        :param servo:     Name of the servo
+        :param keyframes: List of [seconds, value] or [seconds, value, easing]
+        :return: List of (seconds, value, easing function), in order of time
+        :raise ValueError: If the keyframes are not valid
+        """
+        if not isinstance(keyframes, list) or not keyframes:
+            raise ValueError(f'{servo}: keyframes must be a non-empty list')
+
+        curve = []
+        for keyframe in keyframes:
+            if not isinstance(keyframe, list) or len(keyframe) not in (2, 3):
+                raise ValueError(f'{servo}: keyframes must be [seconds, value] or [seconds, value, easing]')
+
+            seconds, value = keyframe[0], keyframe[1]
+            easing = keyframe[2] if len(keyframe) == 3 else 'linear'
+            if not isinstance(seconds, (int, float)) or seconds < 0 or (curve and seconds < curve[-1][0]):
+                raise ValueError(f'{servo}: keyframe times must be non-negative and in order')
+            if not isinstance(value, (int, float)) or not (0 <= value <= 100):
+                raise ValueError(f'{servo}: values must be between 0 and 100')
+            if easing not in EASINGS:
+                raise ValueError(f'{servo}: invalid easing "{easing}". Valid easings: {", ".join(EASINGS)}')
+
+            curve.append((float(seconds), value, EASINGS[easing]))
+
+        return curve
+
+    # ------------------------------------------------------------
+    def __sample(self, curve: list) -> list[int]:
+        """
+        Sample a curve at every tick
+        The first value is held before the first keyframe, and the last value after the last keyframe.
+        :param curve: List of (seconds, value, easing function)
+        :return: Value at each tick
+        """
+        values = []
+        segment = 0
+
+        for tick in range(self.ticks):
+            seconds = tick / self.tick_rate
+            while segment < len(curve) - 1 and curve[segment + 1][0] <= seconds:
+                segment += 1
+
+            start_time, start_value, _ = curve[segment]
+            if segment == len(curve) - 1 or seconds <= start_time:
+                values.append(int(round(start_value)))
+                continue
+
+            end_time, end_value, easing = curve[segment + 1]
+            fraction = easing((seconds - start_time) / (end_time - start_time))
+            values.append(int(round(start_value + (end_value - start_value) * fraction)))
+
+        return values
+
+
+# ================================================================
+class AnimationEngine:
+    """Load keyframe animations and play one at a time"""
+
+    def __init__(self, folder: str, servos: dict, send: Callable[[list[str]], bool],
+                 publish: Callable[[str, Any], None], tick_rate: float = 25.0):
+        """
+        Constructor
+        :param folder:    Folder containing the keyframe files (*.json)
+        :param servos:    Servo name -> serial command letter
+        :param send:      Function sending serial commands, returning False if they could not be queued
+        :param publish:   Function publishing an event, called with (event type, data)
+        :param tick_rate: Setpoints sent per second
+        """
+        self.folder: str = folder
+        self.servos: dict = servos
+        self.send = send
+        self.publish = publish
+        self.tick_rate: float = tick_rate
+        self.lock: Lock = Lock()
+        self.cache: dict[str, tuple[float, KeyframeAnimation]] = {}    # Name -> (file mtime, animation)
+
+        self.playing: KeyframeAnimation | None = None
+        self.cancel: Event = Event()
+        self.ticks_played: int = 0
+        self.ticks_skipped: int = 0
+
+    # ------------------------------------------------------------
+    def get(self, name: str) -> KeyframeAnimation | None:
+        """
+        Get an animation, loading its file again if it has changed
+        :param name: Name of the animation (file name without .json)
+        :return: The animation, or None if there is no such file
+        :raise ValueError: If the file is not a valid animation
+        """
+        if not name or os.path.basename(name) != name:
+            return None
+
+        path = os.path.join(self.folder, name + ".json")
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+
+        with self.lock:
+            cached = self.cache.get(name)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as ex:
+            raise ValueError(f'Unable to read {name}.json: {ex}') from ex
+        if not isinstance(data, dict):
+            raise ValueError(f'{name}.json must contain an object')
+
+        animation = KeyframeAnimation(name, data, self.servos, self.tick_rate)
+        with self.lock:
+            self.cache[name] = (mtime, animation)
+        return animation
+
+    # ------------------------------------------------------------
+    def get_animations(self) -> list[dict]:
+        """
+        List the animations in the folder
+        :return: Description of each valid animation, see KeyframeAnimation.get_info()
+        """
+        try:
+            names = sorted(file[:-5] for file in os.listdir(self.folder) if file.endswith(".json"))
+        except OSError:
+            return []
+
+        animations = []
+        for name in names:
+            try:
+                animation = self.get(name)
+            except ValueError as ex:
+                logging.warning(f'Keyframe animation {repr(ex)}')
+                continue
+            if animation is not None:
+                animations.append(animation.get_info())
+
+        return animations
+
+    # ------------------------------------------------------------
+    def play(self, animation: KeyframeAnimation):
+        """
+        Play an animation in the background, replacing the one which is playing
+        :param animation: The animation
+        """
+        self.stop()
+
+        cancel = Event()
+        with self.lock:
+            self.cancel = cancel
+            self.playing = animation
+
+        thread = Thread(target=self.__play_thread, args=(animation, cancel), daemon=True)
+        thread.start()
+        self.publish("keyframes", {'name': animation.name, 'state': "playing"})
+
+    # ------------------------------------------------------------
+    def stop(self) -> bool:
+        """
+        Stop the animation which is playing; the servos stay where they are
+        :return: True if an animation was playing
+        """
+        with self.lock:
+            animation = self.playing
+            self.playing = None
+            self.cancel.set()
+
+        if animation is not None:
+            self.publish("keyframes", {'name': animation.name, 'state': "stopped"})
+        return animation is not None
+
+    # ------------------------------------------------------------
+    def get_status(self) -> dict:
+        """
+        Get the animation which is playing
+        :return: Dictionary with the name of the animation (or None) and the ticks played and skipped
+        """
+        with self.lock:
+            return {
+                'playing': self.playing.name if self.playing is not None else None,
+                'tick_rate': self.tick_rate,
+                'ticks_played': self.ticks_played,
+                'ticks_skipped': self.ticks_skipped,
+            }
+
+    # ------------------------------------------------------------
+    def __play_thread(self, animation: KeyframeAnimation, cancel: Event):
+        """
+        Send the setpoints of each tick at its time
+        Ticks are timed from the start on the monotonic clock; ticks which are missed are skipped.
+        :param animation: The animation
+        :param cancel:    Set when the animation is stopped
+        """
+        channels = animation.channels
+        sent = [UNCHANGED] * len(channels)
+        start = time.monotonic()
+        previous = -1
+
+        while True:
+            position = int((time.monotonic() - start) * animation.tick_rate)
+            if not animation.loop and position >= animation.ticks:
+                position = animation.ticks - 1
+            tick = position % animation.ticks
+
+            with self.lock:
+                self.ticks_played += 1
+                self.ticks_skipped += max(0, position - previous - 1)
+
+            commands = []
+            for index, value in enumerate(animation.frame(tick)):
+                if value != UNCHANGED and value != sent[index]:
+                    commands.append(f"{channels[index]}{value}")
+                    sent[index] = value
+
+            # Send everything again once the link is back
+            if commands and not self.send(commands):
+                sent = [UNCHANGED] * len(channels)
+
+            if not animation.loop and position == animation.ticks - 1:
+                break
+
+            previous = position
+            if cancel.wait(max(0.0, start + (position + 1) / animation.tick_rate - time.monotonic())):
+                return
+
+        with self.lock:
+            if self.playing is not animation:
+                return
+            self.playing = None
+
+        self.publish("keyframes", {'name': animation.name, 'state': "finished"})
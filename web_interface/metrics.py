@@ -0,0 +1,193 @@
+"""
+Request latency histograms and a Prometheus text exporter
+
+Every HTTP request is timed and counted in a histogram per route,
+method and status code. Other parts of the web-interface (the serial
+link, camera, event hub...) register collectors, which are only called
+when /metrics is scraped. Recording a request costs a bisect and a few
+additions under a lock, so this can be left on in production.
+
+Output follows the Prometheus text exposition format, version 0.0.4:
+https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+import time
+from bisect import bisect_left
+from threading import Lock
+from typing import Callable, NamedTuple
+
+
+# Upper bounds of the latency buckets in seconds; motion commands take a few ms, TTS several seconds
+LATENCY_BUCKETS: tuple = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# ================================================================
+class Metric(NamedTuple):
+    """A metric family returned by a collector"""
+    name: str           # Metric name, e.g. "walle_serial_queue_depth"
+    type: str           # "counter" or "gauge"
+    help: str           # Description of the metric
+    samples: list       # List of (labels dictionary, value)
+
+
+# ================================================================
+class Histogram:
+    """Counts of observed values in fixed buckets"""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        """
+        Constructor
+        :param buckets: Upper bounds of the buckets, in ascending order
+        """
+        self.buckets: tuple = buckets
+        self.counts: list[int] = [0] * (len(buckets) + 1)
+        self.sum: float = 0.0
+
+    # ------------------------------------------------------------
+    def observe(self, value: float):
+        """
+        Add a value; the caller holds the lock of the registry
+        :param value: The observed value
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    # ------------------------------------------------------------
+    def cumulative(self) -> list[int]:
+        """
+        Get the number of values less than or equal to each bucket bound
+        :return: Cumulative counts, the last item being the total count
+        """
+        total = 0
+        result = []
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+
+# ================================================================
+class RateMeter:
+    """Events per second, averaged over a sliding window"""
+
+    def __init__(self, window: int = 10):
+        """
+        Constructor
+        :param window: Length of the window in seconds
+        """
+        self.window: int = window
+        self.slots: list[int] = [0] * window
+        self.seconds: list[int] = [0] * window
+        self.lock: Lock = Lock()
+
+    # ------------------------------------------------------------
+    def mark(self, count: int = 1):
+        """
+        Record that events have happened
+        :param count: Number of events
+        """
+        second = int(time.monotonic())
+        index = second % self.window
+
+        with self.lock:
+            if self.seconds[index] != second:
+                self.seconds[index] = second
+                self.slots[index] = 0
+            self.slots[index] += count
+
+    # ------------------------------------------------------------
+    def rate(self) -> float:
+        """
+        Get the average rate over the window
+        :return: Events per second
+        """
+        now = int(time.monotonic())
+        with self.lock:
+            total = sum(count for second, count in zip(self.seconds, self.slots) if now - second < self.window)
+        return total / self.window
+
+
+# ================================================================
+class MetricsRegistry:
+    """Request histograms, plus collectors which are read when the metrics are scraped"""
+
+    def __init__(self, prefix: str = "walle", buckets: tuple = LATENCY_BUCKETS):
+        """
+        Constructor
+        :param prefix:  Prefix of all metric names
+        :param buckets: Upper bounds of the request latency buckets in seconds
+        """
+        self.prefix: str = prefix
+        self.buckets: tuple = buckets
+        self.lock: Lock = Lock()
+        self.requests: dict[tuple, Histogram] = {}
+        self.collectors: list[Callable[[], list[Metric]]] = []
+
+    # ------------------------------------------------------------
+    def observe_request(self, route: str, method: str, status: int, seconds: float):
+        """
+        Record the time taken by an HTTP request
+        :param route:   URL rule of the route, e.g. "/api/move"
+        :param method:  HTTP method
+        :param status:  HTTP status code of the response
+        :param seconds: Time from receiving the request until the response was ready
+        """
+        key = (route, method, str(status))
+
+        with self.lock:
+            histogram = self.requests.get(key)
+            if histogram is None:
+                histogram = self.requests[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    # ------------------------------------------------------------
+    def add_collector(self, collector: Callable[[], list[Metric]]):
+        """
+        Register a function which returns metrics when they are scraped
+        :param collector: Function returning a list of Metric
+        """
+        self.collectors.append(collector)
+
+    # ------------------------------------------------------------
+    def render(self) -> str:
+        """
+        Get all metrics in the Prometheus text format
+        :return: The metrics text
+        """
+        lines = []
+        name = f'{self.prefix}_http_request_duration_seconds'
+        lines.append(f'# HELP {name} Time taken to handle HTTP requests')
+        lines.append(f'# TYPE {name} histogram')
+
+        with self.lock:
+            requests = [(key, histogram.cumulative(), histogram.sum) for key, histogram in sorted(self.requests.items())]
+
+        for (route, method, status), counts, total in requests:
+            labels = f'route="{escape(route)}",method="{method}",status="{status}"'
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {counts[-1]}')
+            lines.append(f'{name}_sum{{{labels}}} {total}')
+            lines.append(f'{name}_count{{{labels}}} {counts[-1]}')
+
+        for collector in self.collectors:
+            for metric in collector():
+                name = f'{self.prefix}_{metric.name}'
+                lines.append(f'# HELP {name} {metric.help}')
+                lines.append(f'# TYPE {name} {metric.type}')
+
+                for labels, value in metric.samples:
+                    label_text = ','.join(f'{k}="{escape(str(v))}"' for k, v in labels.items())
+                    lines.append(f'{name}{{{label_text}}} {float(value)}' if label_text else f'{name} {float(value)}')
+
+        return '\n'.join(lines) + '\n'
+
+
+# ------------------------------------------------------------
+def escape(value: str) -> str:
+    """
+    Escape a label value for the Prometheus text format
+    :param value: The label value
+    :return: The escaped value
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
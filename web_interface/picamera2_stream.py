@@ -10,7 +10,7 @@ import io
 import logging
 import socketserver
 from http import server
-from threading import Thread, Condition, Event
+from threading import Thread, Condition, Event, Lock
 from picamera2 import Picamera2
 from picamera2.encoders import MJPEGEncoder
 from picamera2.outputs import FileOutput
@@ -29,6 +29,30 @@ PAGE = """\
 """
 
 
+# ================================================================
+class StreamStats:
+    """Counters of the camera stream, kept across restarts of the stream"""
+
+    def __init__(self):
+        """Constructor"""
+        self.lock: Lock = Lock()
+        self.frames_captured: int = 0
+        self.frames_sent: int = 0
+        self.clients: int = 0
+
+    def add(self, name: str, amount: int = 1):
+        """
+        Add to a counter
+        :param name:   Name of the counter, e.g. "frames_sent"
+        :param amount: Amount to add (negative to subtract)
+        """
+        with self.lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+
+stats: StreamStats = StreamStats()
+
+
 # ================================================================
 class StreamingOutput(io.BufferedIOBase):
     def __init__(self):
@@ -38,6 +62,7 @@ class StreamingOutput(io.BufferedIOBase):
     def write(self, buf):
         with self.condition:
             self.frame = buf
+            stats.add('frames_captured')
             self.condition.notify_all()
 
 
@@ -67,6 +92,7 @@ class StreamingHandler(server.BaseHTTPRequestHandler):
             self.send_header('Pragma', 'no-cache')
             self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=FRAME')
             self.end_headers()
+            stats.add('clients')
             try:
                 while True:
                     with output.condition:
@@ -78,10 +104,13 @@ class StreamingHandler(server.BaseHTTPRequestHandler):
                     self.end_headers()
                     self.wfile.write(frame)
                     self.wfile.write(b'\r\n')
+                    stats.add('frames_sent')
             except Exception as e:
                 logging.warning(
                     'Removed streaming client %s: %s',
                     self.client_address, str(e))
+            finally:
+                stats.add('clients', -1)
         else:
             self.send_error(404)
             self.end_headers()
@@ -103,9 +132,13 @@ class PiCameraStreamer:
     #output: StreamingOutput | None = None
     streaming_server: StreamingServer | None = None
 
-    def __init__(self):
-        """Constructor"""
-        pass
+    def __init__(self, events=None):
+        """
+        Constructor
+        :param events: Optional EventHub which changes of the stream state are published to
+        """
+        self.events = events
+        self.published_active: bool = False
 
     # ------------------------------------------------------------
     def is_stream_active(self) -> bool:
@@ -146,6 +179,7 @@ class PiCameraStreamer:
             logging.error(f'Failed to start PiCamera2 stream: {repr(ex)}')
             self.stop_stream()
 
+        self.__publish_state()
         return (self.is_stream_active(), error)
 
     # ------------------------------------------------------------
@@ -178,8 +212,30 @@ class PiCameraStreamer:
             print(repr(ex))
             logging.error(f'Failed to stop PiCamera2 stream: {repr(ex)}')
 
+        self.__publish_state()
         return not self.is_stream_active()
 
+    # ------------------------------------------------------------
+    def get_stats(self) -> dict:
+        """
+        Get the number of frames and viewers of the stream
+        :return: Dictionary with frames captured, frames sent to clients and clients connected
+        """
+        with stats.lock:
+            return {
+                'frames_captured': stats.frames_captured,
+                'frames_sent': stats.frames_sent,
+                'clients': stats.clients,
+            }
+
+    # ------------------------------------------------------------
+    def __publish_state(self):
+        """Publish the stream state to the event hub if it has changed"""
+        active = self.is_stream_active()
+        if self.events is not None and active != self.published_active:
+            self.published_active = active
+            self.events.publish("camera", {'active': active})
+
     # ------------------------------------------------------------
     def __stream_thread(self):
         """Run the streaming server in a thread"""
@@ -0,0 +1,155 @@
+"""
+Cached inventory of the serial ports connected to the Raspberry Pi
+
+Listing the serial ports walks through sysfs, which takes tens of
+milliseconds on a Raspberry Pi. The list is therefore built once and
+kept in memory, and only refreshed when a device node is added to or
+removed from /dev (using inotify). On systems without inotify the list
+is refreshed periodically instead.
+"""
+
+import logging
+import os
+import select
+from threading import Event, Lock, Thread
+
+import serial.tools.list_ports
+
+from inotify import IN_CREATE, IN_DELETE, open_inotify, inotify_names
+
+
+# ================================================================
+class PortRegistry:
+    """Cached list of serial ports, refreshed when devices are plugged in or removed"""
+
+    SETTLE_TIME: float = 0.5    # Seconds to wait after a change, for udev to finish setting up the device
+
+    def __init__(self, watch_dir: str = "/dev", poll_interval: float = 5.0):
+        """
+        Constructor
+        :param watch_dir:     Directory which is watched for new device nodes
+        :param poll_interval: Seconds between refreshes if inotify is not available
+        """
+        self.watch_dir: str = watch_dir
+        self.poll_interval: float = poll_interval
+        self.lock: Lock = Lock()
+        self.ports: list = []
+        self.listeners: list = []
+        self.exit_flag: Event = Event()
+        self.watch_thread: Thread | None = None
+
+    # ------------------------------------------------------------
+    def start(self):
+        """
+        Build the port list and start watching for changes
+        """
+        self.refresh()
+
+        if self.watch_thread is None:
+            self.exit_flag.clear()
+            self.watch_thread = Thread(target=self.__watch_thread, daemon=True)
+            self.watch_thread.start()
+
+    # ------------------------------------------------------------
+    def stop(self):
+        """
+        Stop watching for changes
+        """
+        self.exit_flag.set()
+        if self.watch_thread is not None:
+            self.watch_thread.join()
+            self.watch_thread = None
+
+    # ------------------------------------------------------------
+    def refresh(self):
+        """
+        Rebuild the list of serial ports
+        """
+        try:
+            ports = sorted(serial.tools.list_ports.comports(), key=lambda p: p.device)
+        except Exception as ex:
+            logging.error(f'Failed to list serial ports: {repr(ex)}')
+            return
+
+        with self.lock:
+            changed = [p.device for p in ports] != [p.device for p in self.ports]
+            self.ports = ports
+            listeners = list(self.listeners)
+
+        if changed:
+            logging.info(f'Serial ports: {[p.device for p in ports]}')
+            for listener in listeners:
+                listener(ports)
+
+    # ------------------------------------------------------------
+    def get_ports(self) -> list:
+        """
+        Get the cached list of serial ports
+        :return: List of serial.tools.list_ports ListPortInfo objects
+        """
+        with self.lock:
+            return list(self.ports)
+
+    # ------------------------------------------------------------
+    def add_listener(self, listener):
+        """
+        Register a function to be called when the list of ports changes
+        :param listener: Function which takes the new list of ports
+        """
+        with self.lock:
+            self.listeners.append(listener)
+
+    # ------------------------------------------------------------
+    def __watch_thread(self):
+        """Refresh the port list when device nodes change"""
+        fd = self.__open_inotify()
+
+        try:
+            while not self.exit_flag.is_set():
+                if fd is None:
+                    self.exit_flag.wait(self.poll_interval)
+                    self.refresh()
+                    continue
+
+                readable, _, _ = select.select([fd], [], [], 1.0)
+                if not readable or not self.__tty_changed(os.read(fd, 4096)):
+                    continue
+
+                # Wait for the burst of events from one device to finish
+                while not self.exit_flag.wait(self.SETTLE_TIME):
+                    readable, _, _ = select.select([fd], [], [], 0)
+                    if not readable:
+                        break
+                    os.read(fd, 4096)
+
+                self.refresh()
+
+        except Exception as ex:
+            logging.error(f'Serial port watcher error: {repr(ex)}')
+
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    # ------------------------------------------------------------
+    def __open_inotify(self) -> int | None:
+        """
+        Start watching the device directory using inotify
+        :return: The inotify file descriptor, or None if inotify is not available
+        """
+        try:
+            return open_inotify(self.watch_dir, IN_CREATE | IN_DELETE)
+
+        except Exception as ex:
+            logging.warning(f'Unable to watch {self.watch_dir}, polling serial ports instead: {repr(ex)}')
+            return None
+
+    # ------------------------------------------------------------
+    @staticmethod
+    def __tty_changed(data: bytes) -> bool:
+        """
+        Check whether a block of inotify events includes a serial device
+        :param data: Raw events read from the inotify file descriptor
+        :return: True if a tty device node was added or removed
+        """
+        return any(name.startswith(b'tty') for name in inotify_names(data))
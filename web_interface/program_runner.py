@@ -0,0 +1,331 @@
+"""
+Server-side execution of compiled Codeblock programs
+
+The browser compiles a Blockly program into a flat list of steps and
+sends it to /api/program. The steps are run here, by one scheduler
+thread, instead of by timers in the browser: each step starts at a
+deadline measured from the start of the program on the monotonic
+clock, so waits do not add up Wi-Fi delays, and the program keeps its
+timing when the browser tab is in the background.
+
+Only one program runs at a time. While it is paused the motors are
+stopped and the clock of the program stands still; when it is resumed
+the last drive command is sent again and the remaining steps keep their
+spacing. Progress is published as "program" events.
+
+A program which drives holds the motion lease of the client which
+started it, and is aborted if the client loses the lease.
+
+Loops of the program are not unrolled by the browser: the step at the
+end of a loop jumps back to the first step of its body, until the body
+has been run the given number of times (or forever).
+"""
+
+import logging
+import math
+import time
+from itertools import count
+from threading import Condition, Thread
+from typing import Any, Callable, NamedTuple
+
+from control_lease import ControlLease
+
+
+# ================================================================
+class ProgramStep(NamedTuple):
+    """One step of a compiled program"""
+    op: str                                 # Operation of the step, e.g. "drive"
+    block: str | None                       # Id of the Blockly block the step came from
+    commands: list[str]                     # Serial commands sent at the start of the step
+    action: Callable[[], None] | None       # Run at the start of the step (must not block), e.g. play a sound
+    wait: float                             # Seconds from the start of this step until the next one
+    jump: tuple[int, int] | None = None     # End of a loop: (index of its first step, times to run it, 0 = forever)
+
+
+# ------------------------------------------------------------
+def program_duration(steps: list[ProgramStep]) -> float:
+    """
+    Get the running time of a program, counting each run of its loops
+    :param steps: The steps of the program
+    :return: Seconds, or math.inf if the program repeats forever
+    """
+    repeats = [1] * len(steps)
+    for index, step in enumerate(steps):
+        if step.jump is not None:
+            start, times = step.jump
+            for body in range(start, index):
+                repeats[body] *= times if times else math.inf
+
+    return sum(step.wait * repeat for step, repeat in zip(steps, repeats) if step.wait)
+
+
+# ================================================================
+class ProgramRunner:
+    """Run one compiled program at a time, with pause and abort"""
+
+    def __init__(self, send: Callable[[list[str]], bool], stop: Callable[[], None],
+                 publish: Callable[[str, Any], None], lease: ControlLease | None = None):
+        """
+        Constructor
+        :param send:    Function sending serial commands, returning False if they could not be queued
+        :param stop:    Function stopping the main motors straight away
+        :param publish: Function publishing an event, called with (event type, data)
+        :param lease:   Motion lease held by programs which drive, None to run them without it
+        """
+        self.send = send
+        self.stop_motors = stop
+        self.publish = publish
+        self.lease: ControlLease | None = lease
+        self.condition: Condition = Condition()
+        self.ids = count(1)
+
+        # State of the current (or last) program
+        self.program_id: int | None = None
+        self.steps: list[ProgramStep] = []
+        self.client: tuple[str, str] | None = None  # (id, description) of the client holding the lease for it
+        self.state: str = "idle"            # idle, running, paused, finished, aborted, failed
+        self.step: int = -1                 # Index of the step which was run last
+        self.duration: float = 0.0          # Running time of the program, math.inf if it repeats forever
+        self.started: float = 0.0           # time.monotonic() at the start of the program
+        self.paused_at: float = 0.0         # time.monotonic() when the program was paused or ended
+        self.paused_total: float = 0.0      # Seconds spent paused so far
+        self.drive: dict[str, str] = {}     # Last "X" and "Y" commands, re-sent on resume
+        self.max_late: float = 0.0          # Latest start of a step after its deadline, in seconds
+
+    # ------------------------------------------------------------
+    def start(self, steps: list[ProgramStep], client: tuple[str, str] | None = None) -> int | None:
+        """
+        Run a program in the background
+        :param steps:  The steps of the program, in order
+        :param client: (id, description) of the client whose motion lease the program holds, None if it does not drive
+        :return: Id of the program, or None if another program is still running
+        """
+        if self.lease is None:
+            client = None
+
+        with self.condition:
+            if self.state in ("running", "paused"):
+                return None
+
+            self.program_id = next(self.ids)
+            self.steps = steps
+            self.client = client
+            self.state = "running"
+            self.step = -1
+            self.duration = program_duration(steps)
+            self.started = time.monotonic()
+            self.paused_total = 0.0
+            self.drive = {}
+            self.max_late = 0.0
+            program_id = self.program_id
+
+        if client is not None:
+            self.lease.begin_run(client[0])
+
+        self.__publish()
+        thread = Thread(target=self.__program_thread, args=(program_id, steps, client), daemon=True)
+        thread.start()
+        return program_id
+
+    # ------------------------------------------------------------
+    def pause(self) -> bool:
+        """
+        Pause the running program and stop the motors
+        :return: True if the program was paused
+        """
+        with self.condition:
+            if self.state != "running":
+                return False
+
+            self.state = "paused"
+            self.paused_at = time.monotonic()
+            self.stop_motors()
+            self.condition.notify_all()
+
+        self.__publish()
+        return True
+
+    # ------------------------------------------------------------
+    def resume(self) -> bool:
+        """
+        Continue a paused program where it left off
+        :return: True if the program was resumed, False if not paused or another client holds the motion lease
+        """
+        with self.condition:
+            if self.state != "paused":
+                return False
+            # Take the lease again, and keep it for the rest of the current step
+            if self.client is not None:
+                if self.lease.admit(*self.client) > 0:
+                    return False
+                if 0 <= self.step < len(self.steps):
+                    self.lease.renew(self.client[0], self.steps[self.step].wait)
+
+            # Drive on as before the pause, for the rest of the current step
+            if any(command[1:] != "0" for command in self.drive.values()):
+                self.send(list(self.drive.values()))
+
+            self.paused_total += time.monotonic() - self.paused_at
+            self.state = "running"
+            self.condition.notify_all()
+
+        self.__publish()
+        return True
+
+    # ------------------------------------------------------------
+    def abort(self) -> bool:
+        """
+        Abort the program and stop the motors
+        :return: True if a program was running
+        """
+        with self.condition:
+            if self.state not in ("running", "paused"):
+                return False
+
+            self.__end("aborted")
+            self.stop_motors()
+            self.condition.notify_all()
+
+        self.__publish()
+        return True
+
+    # ------------------------------------------------------------
+    def get_status(self) -> dict:
+        """
+        Get the progress of the current (or last) program
+        :return: Dictionary with the program id, state, step, number of steps and timing (duration None = forever)
+        """
+        with self.condition:
+            step = self.steps[self.step] if 0 <= self.step < len(self.steps) else None
+            now = time.monotonic() if self.state == "running" else self.paused_at
+
+            return {
+                'program': self.program_id,
+                'state': self.state,
+                'step': self.step,
+                'steps': len(self.steps),
+                'op': step.op if step is not None else None,
+                'block': step.block if step is not None else None,
+                'elapsed': round(now - self.started - self.paused_total, 3) if self.program_id else 0.0,
+                'duration': round(self.duration, 3) if self.duration != math.inf else None,
+                'max_late_ms': round(self.max_late * 1000, 2),
+            }
+
+    # ------------------------------------------------------------
+    def __end(self, state: str):
+        """
+        End the program; the caller holds the lock
+        :param state: Final state of the program
+        """
+        if self.state == "running":
+            self.paused_at = time.monotonic()
+        self.state = state
+
+    # ------------------------------------------------------------
+    def __publish(self):
+        """Publish the progress of the program"""
+        self.publish("program", self.get_status())
+
+    # ------------------------------------------------------------
+    def __wait_until(self, program_id: int, offset: float) -> bool:
+        """
+        Wait until a step is due; the caller holds the lock
+        The time spent paused is added to the deadline, so the program's clock stands still while paused.
+        :param program_id: Id of the program
+        :param offset:     Seconds from the start of the program at which the step is due
+        :return: False if the program has been aborted or replaced
+        """
+        while self.program_id == program_id and self.state in ("running", "paused"):
+            if self.state == "paused":
+                self.condition.wait()
+                continue
+
+            remaining = self.started + self.paused_total + offset - time.monotonic()
+            if remaining <= 0:
+                self.max_late = max(self.max_late, -remaining)
+                return True
+            self.condition.wait(remaining)
+
+        return False
+
+    # ------------------------------------------------------------
+    def __program_thread(self, program_id: int, steps: list[ProgramStep], client: tuple[str, str] | None):
+        """
+        Run each step of a program at its deadline
+        :param program_id: Id of the program
+        :param steps:      The steps of the program
+        :param client:     (id, description) of the client whose motion lease the program holds, or None
+        """
+        offset = 0.0
+        index = 0
+        runs: dict[int, int] = {}           # Index of the step ending a loop -> runs of the loop body so far
+
+        try:
+            while index < len(steps):
+                step = steps[index]
+                with self.condition:
+                    if not self.__wait_until(program_id, offset):
+                        return
+
+                    # Keep the lease until the next step, or stop if another client has taken it
+                    if client is not None and not self.lease.renew(client[0], step.wait):
+                        logging.warning(f'Program {program_id} aborted, {client[1]} no longer holds the motion lease')
+                        self.__end("aborted")
+                        self.stop_motors()
+                        break
+
+                    self.step = index
+                    for command in step.commands:
+                        if command[:1] in ("X", "Y"):
+                            self.drive[command[:1]] = command
+
+                # Sending and the action run without the lock, so that pause() and abort() never wait for them
+                if step.commands and not self.send(step.commands):
+                    logging.warning(f'Program {program_id} step {index} dropped, Arduino not connected')
+                if step.action is not None:
+                    try:
+                        step.action()
+                    except Exception as ex:
+                        logging.error(f'Program {program_id} step {index} ({step.op}) failed: {repr(ex)}')
+
+                # Stop again if the program was paused or aborted while the step was being sent
+                with self.condition:
+                    if self.program_id != program_id:
+                        return
+                    if self.state != "running" and step.commands:
+                        self.stop_motors()
+                    if self.state not in ("running", "paused"):
+                        return
+
+                self.__publish()
+                offset += step.wait
+
+                # Go back to the start of the loop, or on once it has run often enough
+                if step.jump is not None:
+                    start, times = step.jump
+                    runs[index] = runs.get(index, 0) + 1
+                    if times == 0 or runs[index] < times:
+                        index = start
+                        continue
+                    del runs[index]
+                index += 1
+
+            else:
+                # Let the last step take its time before the program counts as finished
+                with self.condition:
+                    if not self.__wait_until(program_id, offset):
+                        return
+                    self.__end("finished")
+
+        except Exception as ex:
+            logging.error(f'Program {program_id} failed: {repr(ex)}')
+            with self.condition:
+                if self.program_id == program_id:
+                    self.__end("failed")
+                    self.stop_motors()
+
+        finally:
+            if client is not None:
+                self.lease.end_run(client[0])
+
+        self.__publish()
@@ -0,0 +1,74 @@
+"""
+Token bucket used to limit how fast commands can be queued for the serial link
+
+Tokens are bytes; the bucket refills at the rate the link can actually
+transmit, so clients cannot queue commands faster than the Arduino is
+able to receive them.
+"""
+
+import time
+from threading import Lock
+
+
+# ================================================================
+class TokenBucket:
+    """Token bucket rate limiter"""
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        Constructor
+        :param rate:     Tokens added per second
+        :param capacity: Maximum number of tokens which can be saved up for a burst
+        """
+        self.lock: Lock = Lock()
+        self.rate: float = rate
+        self.capacity: float = capacity
+        self.tokens: float = capacity
+        self.updated: float = time.monotonic()
+        self.consumed: int = 0
+        self.throttled: int = 0
+
+    # ------------------------------------------------------------
+    def consume(self, amount: float) -> float:
+        """
+        Take tokens from the bucket if enough are available
+        :param amount: Number of tokens required
+        :return: 0 if the tokens were taken, otherwise the seconds until enough tokens will be available
+        """
+        # Requests larger than the bucket are allowed through once it is full
+        amount = min(amount, self.capacity)
+
+        with self.lock:
+            self.__refill()
+
+            if amount <= self.tokens:
+                self.tokens -= amount
+                self.consumed += amount
+                return 0.0
+
+            self.throttled += 1
+            return (amount - self.tokens) / self.rate
+
+    # ------------------------------------------------------------
+    def get_stats(self) -> dict:
+        """
+        Current state of the bucket
+        :return: Dictionary with the rate, capacity, remaining tokens and usage
+        """
+        with self.lock:
+            self.__refill()
+            return {
+                'rate': self.rate,
+                'capacity': self.capacity,
+                'available': round(self.tokens, 1),
+                'usage': round(1.0 - self.tokens / self.capacity, 3),
+                'consumed': self.consumed,
+                'throttled': self.throttled,
+            }
+
+    # ------------------------------------------------------------
+    def __refill(self):
+        """Add the tokens which have accumulated since the last update"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
@@ -0,0 +1,174 @@
+"""
+Supervisor which reconnects to the Arduino after the serial link drops
+
+When the USB link is lost (e.g. the Arduino browns out when the motors
+start), the ArduinoDevice threads stop and report the failure. The
+supervisor then waits for the same device, matched by USB VID/PID and
+serial number, to reappear in the port list and reconnects to it, with
+an exponential backoff between failed attempts.
+
+While the link is down, commands are either rejected or buffered and
+sent after reconnecting, depending on the outage policy. Pending drive
+commands are always dropped on reconnect, so that the robot does not
+start moving on stale joystick values.
+"""
+
+import logging
+import os
+from threading import Event, Lock, Thread
+
+from port_registry import PortRegistry
+
+
+# ================================================================
+class SerialSupervisor:
+    """Keep the connection to the Arduino alive"""
+
+    def __init__(self, device, port_registry: PortRegistry, outage_policy: str = "reject",
+                 initial_backoff: float = 0.5, max_backoff: float = 30.0):
+        """
+        Constructor
+        :param device:          The ArduinoDevice which is supervised
+        :param port_registry:   Cached list of the available serial ports
+        :param outage_policy:   "reject" to refuse commands while the link is down, "buffer" to queue them
+        :param initial_backoff: Seconds to wait after the first failed reconnection attempt
+        :param max_backoff:     Maximum seconds between reconnection attempts
+        """
+        self.device = device
+        self.port_registry: PortRegistry = port_registry
+        self.outage_policy: str = outage_policy
+        self.initial_backoff: float = initial_backoff
+        self.max_backoff: float = max_backoff
+
+        self.lock: Lock = Lock()
+        self.wanted: bool = False
+        self.identity: tuple | None = None
+        self.reconnects: int = 0
+        self.wake: Event = Event()
+        self.thread: Thread | None = None
+
+        self.device.on_link_lost = self.__link_lost
+        self.port_registry.add_listener(lambda ports: self.wake.set())
+
+    # ------------------------------------------------------------
+    def start(self):
+        """
+        Start supervising the connection
+        """
+        if self.thread is None:
+            self.thread = Thread(target=self.__supervisor_thread, daemon=True)
+            self.thread.start()
+
+    # ------------------------------------------------------------
+    def connect(self, port: str | int = "") -> bool:
+        """
+        Connect to the Arduino, and keep the connection alive from now on
+        :param port: The port to connect to, as an index or a path (leave blank to use previous port)
+        :return: True if connected successfully, False otherwise
+        """
+        with self.lock:
+            if not self.device.connect(port):
+                return False
+
+            self.wanted = True
+            self.identity = self.__identify(self.device.port_name)
+            self.device.set_outage(False)
+            return True
+
+    # ------------------------------------------------------------
+    def disconnect(self) -> bool:
+        """
+        Disconnect from the Arduino, without reconnecting
+        :return: True if disconnected successfully, False otherwise
+        """
+        with self.lock:
+            self.wanted = False
+            self.device.set_outage(False)
+            return self.device.disconnect()
+
+    # ------------------------------------------------------------
+    def get_status(self) -> dict:
+        """
+        Get the state of the supervisor
+        :return: Dictionary with the link state and number of reconnections
+        """
+        if not self.wanted:
+            state = "disconnected"
+        elif self.device.is_connected():
+            state = "connected"
+        else:
+            state = "reconnecting"
+
+        return {'state': state, 'reconnects': self.reconnects, 'outage_policy': self.outage_policy}
+
+    # ------------------------------------------------------------
+    def __link_lost(self):
+        """Called by the device when its serial port stops working"""
+        self.wake.set()
+
+    # ------------------------------------------------------------
+    def __supervisor_thread(self):
+        """Detect dead connections and reconnect when the device reappears"""
+        backoff = self.initial_backoff
+
+        while True:
+            self.wake.wait(1.0)
+            self.wake.clear()
+
+            with self.lock:
+                if not self.wanted or self.device.is_connected():
+                    backoff = self.initial_backoff
+                    continue
+
+                # Tear down what is left of the old connection
+                if not self.device.in_outage():
+                    logging.warning(f'Serial link to {self.device.port_name} lost, waiting for it to reappear')
+                    self.device.disconnect()
+                    self.device.set_outage(True, self.outage_policy == "buffer")
+
+                port = self.__find()
+                if port is None:
+                    continue
+
+                if self.device.connect(port):
+                    logging.info(f'Reconnected to Arduino on {port}')
+                    self.reconnects += 1
+                    self.device.set_outage(False)
+                    self.device.stop()
+                    backoff = self.initial_backoff
+                    continue
+
+            logging.warning(f'Reconnecting to {port} failed, retrying in {backoff:.1f}s')
+            self.wake.wait(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    # ------------------------------------------------------------
+    def __identify(self, device: str) -> tuple:
+        """
+        Get the identity of a port which stays the same when it is plugged in again
+        :param device: Path of the port
+        :return: (vid, pid, serial number) for USB devices, otherwise the path
+        """
+        for port in self.port_registry.get_ports():
+            if port.device == device and port.vid is not None:
+                return (port.vid, port.pid, port.serial_number)
+
+        return (device,)
+
+    # ------------------------------------------------------------
+    def __find(self) -> str | None:
+        """
+        Look for the supervised device in the list of ports
+        :return: Path of the port, or None if the device is not present
+        """
+        if self.identity is None:
+            return None
+
+        if len(self.identity) == 1:
+            return self.identity[0] if os.path.exists(self.identity[0]) else None
+
+        for port in self.port_registry.get_ports():
+            if (port.vid, port.pid, port.serial_number) == self.identity:
+                return port.device
+
+        return None
@@ -0,0 +1,444 @@
+"""
+Recording and replay of control sessions
+
+While a recording is running, every command sent to the Arduino and
+every sound and text to speech which is played is appended to a binary
+log, with the time since the previous entry. A recording can then be
+replayed with its original timing (or faster or slower), without an
+operator or any HTTP requests - to rehearse a show once and repeat it,
+or to reproduce a latency problem against the Arduino simulator.
+
+Log format (little endian):
+    header: b"WLOG", version (uint8), wall-clock start time (float64)
+    entry:  microseconds since the previous entry (uint32), type (uint8),
+            payload length (uint16), payload (UTF-8)
+
+Entries are appended with a single write each, so a log which was cut
+off (e.g. by a power failure) can be read up to its last entry. The
+writes are done by a thread of the recorder, so recording never blocks
+the caller (e.g. the event loop in the ASGI serving mode) on the disk.
+
+A replay which drives keeps the motion lease of the client which started
+it, and stops if the client loses the lease.
+
+List or inspect a recording: python3 session_log.py recordings/show.wlog
+"""
+
+import logging
+import os
+import re
+import struct
+import time
+from threading import Condition, Event, Lock, Thread
+from typing import Any, Callable, NamedTuple
+
+from control_lease import ControlLease
+
+
+MAGIC: bytes = b"WLOG"
+VERSION: int = 1
+HEADER = struct.Struct("<4sBd")
+ENTRY = struct.Struct("<IBH")
+EXTENSION: str = ".wlog"
+
+# Entry types
+COMMANDS: int = 1           # Serial commands, separated by "\n"
+URGENT_COMMANDS: int = 2    # Serial commands sent ahead of the queue (e.g. stop)
+AUDIO: int = 3              # Path of a sound file which was played
+SPEECH: int = 4             # Text which was spoken
+
+ENTRY_NAMES: dict = {COMMANDS: "commands", URGENT_COMMANDS: "urgent", AUDIO: "audio", SPEECH: "speech"}
+
+# Names of recordings, used as file names
+VALID_NAME = re.compile(r'^[A-Za-z0-9_\-]{1,64}$')
+
+
+# ================================================================
+class LogEntry(NamedTuple):
+    """An entry of a recording"""
+    time: float         # Seconds since the start of the recording
+    type: int           # COMMANDS, URGENT_COMMANDS, AUDIO or SPEECH
+    payload: str        # Commands separated by "\n", sound file path or text
+
+
+# ------------------------------------------------------------
+def read_log(path: str) -> tuple[float, list[LogEntry]]:
+    """
+    Read a recording
+    :param path: Path of the log file
+    :return: (wall-clock time the recording started, entries)
+    :raise ValueError: If the file is not a recording
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if len(data) < HEADER.size:
+        raise ValueError(f'{os.path.basename(path)} is not a recording')
+    magic, version, started = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'{os.path.basename(path)} is not a recording (version {VERSION})')
+
+    entries = []
+    offset = HEADER.size
+    elapsed = 0.0
+
+    while offset + ENTRY.size <= len(data):
+        delta, entry_type, length = ENTRY.unpack_from(data, offset)
+        offset += ENTRY.size
+        if offset + length > len(data):
+            break
+
+        elapsed += delta / 1_000_000
+        entries.append(LogEntry(elapsed, entry_type, data[offset:offset + length].decode('utf-8', 'replace')))
+        offset += length
+
+    return started, entries
+
+
+# ================================================================
+class SessionRecorder:
+    """Append commands, sounds and speech to a recording"""
+
+    def __init__(self, folder: str):
+        """
+        Constructor
+        :param folder: Folder the recordings are written to
+        """
+        self.folder: str = folder
+        self.lock: Condition = Condition()
+        self.file = None
+        self.writer: Thread | None = None
+        self.queued: list[bytes] = []   # Entries of the recording waiting to be written
+        self.name: str | None = None
+        self.started: float = 0.0
+        self.last: float = 0.0
+        self.entries: int = 0
+        self.recording: bool = False    # Checked without the lock, so that sending costs nothing while idle
+
+    # ------------------------------------------------------------
+    def start(self, name: str) -> bool:
+        """
+        Start a new recording
+        :param name: Name of the recording (letters, digits, "_" and "-")
+        :return: False if a recording is already running
+        :raise ValueError: If the name is not valid or a recording with this name exists
+        """
+        if not isinstance(name, str) or not VALID_NAME.match(name):
+            raise ValueError('name must be 1 to 64 letters, digits, "_" or "-"')
+
+        with self.lock:
+            if self.file is not None:
+                return False
+
+            os.makedirs(self.folder, exist_ok=True)
+            try:
+                self.file = open(os.path.join(self.folder, name + EXTENSION), 'xb')
+            except FileExistsError:
+                raise ValueError(f'A recording named "{name}" already exists')
+
+            self.file.write(HEADER.pack(MAGIC, VERSION, time.time()))
+            self.file.flush()
+            self.name = name
+            self.started = self.last = time.monotonic()
+            self.entries = 0
+            self.recording = True
+            self.queued = []
+            self.writer = Thread(target=self.__writer_thread, args=(self.file, self.queued, name), daemon=True)
+            self.writer.start()
+
+        logging.info(f'Recording session to {name}{EXTENSION}')
+        return True
+
+    # ------------------------------------------------------------
+    def stop(self) -> dict | None:
+        """
+        Stop recording
+        :return: The name, duration and number of entries of the recording, or None if none was running
+        """
+        with self.lock:
+            if self.file is None:
+                return None
+
+            self.recording = False
+            self.file = None
+            writer = self.writer
+            self.writer = None
+            self.lock.notify_all()
+            result = {'name': self.name, 'duration': round(self.last - self.started, 3), 'entries': self.entries}
+
+        # The writer closes the file once the entries queued so far have been written
+        writer.join()
+
+        logging.info(f'Recorded {result["entries"]} entries to {result["name"]}{EXTENSION}')
+        return result
+
+    # ------------------------------------------------------------
+    def record(self, entry_type: int, payload: str):
+        """
+        Append an entry to the recording, if one is running
+        :param entry_type: COMMANDS, URGENT_COMMANDS, AUDIO or SPEECH
+        :param payload:    Commands separated by "\n", sound file path or text
+        """
+        if not self.recording:
+            return
+
+        data = payload.encode('utf-8')[:0xFFFF]
+        with self.lock:
+            if self.file is None:
+                return
+
+            now = time.monotonic()
+            delta = min(int((now - self.last) * 1_000_000), 0xFFFFFFFF)
+            self.last = now
+            self.entries += 1
+
+            self.queued.append(ENTRY.pack(delta, entry_type, len(data)) + data)
+            self.lock.notify_all()
+
+    # ------------------------------------------------------------
+    def record_commands(self, commands: list[str], urgent: bool = False):
+        """
+        Append serial commands to the recording, if one is running
+        :param commands: The commands
+        :param urgent:   The commands were sent ahead of the queue
+        """
+        if self.recording:
+            self.record(URGENT_COMMANDS if urgent else COMMANDS, "\n".join(commands))
+
+    # ------------------------------------------------------------
+    def __writer_thread(self, file, queued: list[bytes], name: str):
+        """
+        Write the queued entries to the recording, each with one write, until the recording is stopped
+        :param file:   The file of the recording
+        :param queued: Entries of the recording waiting to be written
+        :param name:   Name of the recording
+        """
+        while True:
+            with self.lock:
+                self.lock.wait_for(lambda: queued or self.file is not file)
+                entries = queued[:]
+                queued.clear()
+                stopped = self.file is not file
+
+            try:
+                for entry in entries:
+                    file.write(entry)
+                file.flush()
+            except OSError as ex:
+                logging.error(f'Unable to write to recording {name}: {repr(ex)}')
+
+            if stopped:
+                file.close()
+                return
+
+    # ------------------------------------------------------------
+    def get_recordings(self) -> list[dict]:
+        """
+        List the recordings in the folder
+        :return: Name, start time, duration, number of entries and size of each recording
+        """
+        try:
+            files = sorted(file for file in os.listdir(self.folder) if file.endswith(EXTENSION))
+        except OSError:
+            return []
+
+        recordings = []
+        for file in files:
+            path = os.path.join(self.folder, file)
+            try:
+                started, entries = read_log(path)
+            except (OSError, ValueError):
+                continue
+
+            recordings.append({
+                'name': file[:-len(EXTENSION)],
+                'started': started,
+                'duration': round(entries[-1].time, 3) if entries else 0.0,
+                'entries': len(entries),
+                'bytes': os.path.getsize(path),
+            })
+
+        return recordings
+
+    # ------------------------------------------------------------
+    def get_path(self, name: str) -> str | None:
+        """
+        Get the path of a recording
+        :param name: Name of the recording
+        :return: The path, or None if there is no such recording
+        """
+        if not isinstance(name, str) or not VALID_NAME.match(name):
+            return None
+
+        path = os.path.join(self.folder, name + EXTENSION)
+        return path if os.path.isfile(path) else None
+
+    # ------------------------------------------------------------
+    def get_status(self) -> dict:
+        """
+        Get the recording which is running
+        :return: Dictionary with the name (or None), elapsed seconds and number of entries
+        """
+        with self.lock:
+            if self.file is None:
+                return {'recording': None}
+            return {'recording': self.name, 'elapsed': round(time.monotonic() - self.started, 3),
+                    'entries': self.entries}
+
+
+# ================================================================
+class SessionPlayer:
+    """Replay a recording with its original timing, or at another speed"""
+
+    def __init__(self, handlers: dict[int, Callable[[str], None]], publish: Callable[[str, Any], None],
+                 lease: ControlLease | None = None):
+        """
+        Constructor
+        :param handlers: Entry type -> function called with the payload when the entry is replayed
+        :param publish:  Function publishing an event, called with (event type, data)
+        :param lease:    Motion lease held by replays which drive, None to replay without it
+        """
+        self.handlers: dict = handlers
+        self.publish = publish
+        self.lease: ControlLease | None = lease
+        self.lock: Lock = Lock()
+        self.cancel: Event = Event()
+        self.name: str | None = None
+        self.client: tuple[str, str] | None = None  # (id, description) of the client holding the lease for it
+        self.speed: float = 1.0
+        self.position: int = 0
+        self.count: int = 0
+        self.max_late: float = 0.0
+
+    # ------------------------------------------------------------
+    def play(self, name: str, entries: list[LogEntry], speed: float = 1.0,
+             client: tuple[str, str] | None = None) -> bool:
+        """
+        Replay a recording in the background
+        :param name:    Name of the recording
+        :param entries: Entries of the recording
+        :param speed:   Playback speed (1 = original timing, 2 = twice as fast, 0 = without waiting)
+        :param client:  (id, description) of the client whose motion lease the replay holds, None if it does not drive
+        :return: False if a recording is already being replayed
+        """
+        if self.lease is None:
+            client = None
+
+        cancel = Event()
+        with self.lock:
+            if self.name is not None:
+                return False
+            self.name = name
+            self.client = client
+            self.speed = speed
+            self.cancel = cancel
+            self.position = 0
+            self.count = len(entries)
+            self.max_late = 0.0
+
+        # Keep the lease taken by the request until the first entry
+        if client is not None:
+            self.lease.begin_run(client[0])
+            self.lease.renew(client[0], entries[0].time / speed if entries and speed > 0 else 0.0)
+
+        thread = Thread(target=self.__replay_thread, args=(name, entries, speed, cancel, client), daemon=True)
+        thread.start()
+        self.publish("replay", {'name': name, 'state': "playing", 'speed': speed})
+        return True
+
+    # ------------------------------------------------------------
+    def stop(self) -> bool:
+        """
+        Stop replaying
+        :return: True if a recording was being replayed
+        """
+        with self.lock:
+            name = self.name
+            self.name = None
+            self.cancel.set()
+
+        if name is not None:
+            self.publish("replay", {'name': name, 'state': "stopped"})
+        return name is not None
+
+    # ------------------------------------------------------------
+    def get_status(self) -> dict:
+        """
+        Get the recording which is being replayed
+        :return: Dictionary with the name (or None), speed, progress, and how late the latest entry was replayed
+        """
+        with self.lock:
+            return {'replaying': self.name, 'speed': self.speed, 'entry': self.position, 'entries': self.count,
+                    'max_late_ms': round(self.max_late * 1000, 2)}
+
+    # ------------------------------------------------------------
+    def __replay_thread(self, name: str, entries: list[LogEntry], speed: float, cancel: Event,
+                        client: tuple[str, str] | None):
+        """
+        Replay each entry at its time from the start, on the monotonic clock
+        :param name:    Name of the recording
+        :param entries: Entries of the recording
+        :param speed:   Playback speed (0 = without waiting)
+        :param cancel:  Set when the replay is stopped
+        :param client:  (id, description) of the client whose motion lease the replay holds, or None
+        """
+        start = time.monotonic()
+
+        try:
+            for index, entry in enumerate(entries):
+                if speed > 0:
+                    due = start + entry.time / speed
+                    remaining = due - time.monotonic()
+                    if remaining > 0 and cancel.wait(remaining):
+                        return
+                    late = max(0.0, time.monotonic() - due)
+                else:
+                    late = 0.0
+                if cancel.is_set():
+                    return
+
+                # Keep the lease until the next entry, or stop if another client has taken it
+                following = 0.0
+                if speed > 0 and index + 1 < len(entries):
+                    following = (entries[index + 1].time - entry.time) / speed
+                if client is not None and not self.lease.renew(client[0], following):
+                    logging.warning(f'Replay of {name} stopped, {client[1]} no longer holds the motion lease')
+                    self.stop()
+                    return
+
+                handler = self.handlers.get(entry.type)
+                try:
+                    if handler is not None:
+                        handler(entry.payload)
+                except Exception as ex:
+                    logging.error(f'Replay of {name} entry {index} ({ENTRY_NAMES.get(entry.type)}) failed: {repr(ex)}')
+
+                with self.lock:
+                    self.position = index + 1
+                    self.max_late = max(self.max_late, late)
+
+            with self.lock:
+                if cancel.is_set() or self.cancel is not cancel:
+                    return
+                self.name = None
+
+        finally:
+            if client is not None:
+                self.lease.end_run(client[0])
+
+        self.publish("replay", {'name': name, 'state': "finished"})
+
+
+# ------------------------------------------------------------
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Show the entries of a recorded control session")
+    parser.add_argument('path', help="recording (.wlog file)")
+    args = parser.parse_args()
+
+    started, entries = read_log(args.path)
+    print(f"Recorded {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started))}, "
+          f"{len(entries)} entries, {entries[-1].time if entries else 0:.3f} s")
+    for entry in entries:
+        print(f"{entry.time:10.3f}  {ENTRY_NAMES.get(entry.type, entry.type):<8}  {entry.payload.replace(chr(10), ' ')}")
@@ -0,0 +1,225 @@
+"""
+Cached index of the sound clips which can be played by the robot
+
+Sound files are named "Group_Name_Duration.wav" (the group and the
+duration in milliseconds are optional). Rather than listing the sound
+folder and parsing every file name each time the main page is loaded,
+the index is built once and kept in memory. It is only rebuilt when
+inotify reports that a file in the folder was added, removed or
+rewritten; on systems without inotify it is refreshed periodically.
+
+Clips are looked up by name in the index, so a sound can only be played
+if it is a file in the sound folder.
+"""
+
+import logging
+import os
+import select
+from threading import Event, Lock, Thread
+from typing import NamedTuple
+
+from inotify import IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_MOVED_FROM, IN_MOVED_TO, open_inotify, inotify_names
+
+
+# ================================================================
+class SoundClip(NamedTuple):
+    """A sound file in the catalog"""
+    group: str          # Group the sound is listed under, "Other" if not given
+    clip: str           # File name without extension, used to play the sound
+    name: str           # Name shown on the button
+    duration: float     # Length of the sound in seconds (0 if not given)
+    path: str           # Full path of the file
+
+
+# ================================================================
+class SoundCatalog:
+    """In-memory index of the sound folder, refreshed when its files change"""
+
+    SETTLE_TIME: float = 0.5    # Seconds to wait after a change, for files to finish being copied
+
+    def __init__(self, folder: str, extension: str, poll_interval: float = 30.0):
+        """
+        Constructor
+        :param folder:        Folder containing the sound files
+        :param extension:     File extension of the sound files, e.g. "wav"
+        :param poll_interval: Seconds between refreshes if inotify is not available
+        """
+        self.folder: str = folder
+        self.extension: str = f".{extension}"
+        self.poll_interval: float = poll_interval
+        self.lock: Lock = Lock()
+        self.sounds: list[SoundClip] = []
+        self.clips: dict[str, SoundClip] = {}
+        self.error: str | None = None
+        self.refreshes: int = 0
+        self.exit_flag: Event = Event()
+        self.watch_thread: Thread | None = None
+
+    # ------------------------------------------------------------
+    def start(self):
+        """
+        Build the index and start watching for changes
+        """
+        if self.watch_thread is not None:
+            self.refresh()
+            return
+
+        # Watch before listing the folder, so that no change is missed in between
+        fd = self.__open_inotify()
+        self.refresh()
+
+        self.exit_flag.clear()
+        self.watch_thread = Thread(target=self.__watch_thread, args=(fd,), daemon=True)
+        self.watch_thread.start()
+
+    # ------------------------------------------------------------
+    def stop(self):
+        """
+        Stop watching for changes
+        """
+        self.exit_flag.set()
+        if self.watch_thread is not None:
+            self.watch_thread.join()
+            self.watch_thread = None
+
+    # ------------------------------------------------------------
+    def refresh(self):
+        """
+        Rebuild the index from the files in the sound folder
+        """
+        sounds = []
+        error = None
+
+        try:
+            for item in sorted(os.listdir(self.folder)):
+                if item.endswith(self.extension):
+                    sounds.append(self.parse_name(os.path.join(self.folder, item)))
+
+        except Exception as ex:
+            error = repr(ex)
+            logging.error(f'Failed to initialise audio files: {error}')
+
+        with self.lock:
+            self.sounds = sounds
+            self.clips = {sound.clip: sound for sound in sounds}
+            self.error = error
+            self.refreshes += 1
+
+    # ------------------------------------------------------------
+    def get_sounds(self) -> list[SoundClip]:
+        """
+        Get all of the sounds, sorted by file name
+        :return: List of sound clips
+        """
+        with self.lock:
+            return self.sounds
+
+    # ------------------------------------------------------------
+    def lookup(self, clip: str) -> str | None:
+        """
+        Find the file of a sound clip
+        :param clip: File name of the clip, without extension
+        :return: Full path of the file, or None if there is no such clip
+        """
+        with self.lock:
+            sound = self.clips.get(clip)
+        return sound.path if sound is not None else None
+
+    # ------------------------------------------------------------
+    def get_stats(self) -> dict:
+        """
+        Get the size of the index
+        :return: Dictionary with the number of clips and how often the index was built
+        """
+        with self.lock:
+            return {'clips': len(self.sounds), 'refreshes': self.refreshes, 'error': self.error}
+
+    # ------------------------------------------------------------
+    @staticmethod
+    def parse_name(path: str) -> SoundClip:
+        """
+        Get the details of a sound from its file name
+        :param path: Path of the sound file
+        :return: The sound clip
+        """
+        audiofiles = os.path.splitext(os.path.basename(path))[0]
+
+        # Set up default details
+        audiogroup = "Other"
+        audionames = audiofiles
+        audiotimes = 0
+
+        audio_details = audiofiles.split('_')
+
+        # Get item details from name, and make sure they are valid
+        if len(audio_details) == 2:
+            if audio_details[1].isdigit():
+                audionames = audio_details[0]
+                audiotimes = float(audio_details[1]) / 1000.0
+            else:
+                audiogroup = audio_details[0]
+                audionames = audio_details[1]
+        elif len(audio_details) == 3:
+            audiogroup = audio_details[0]
+            audionames = audio_details[1]
+            if audio_details[2].isdigit():
+                audiotimes = float(audio_details[2]) / 1000.0
+
+        return SoundClip(audiogroup, audiofiles, audionames, audiotimes, path)
+
+    # ------------------------------------------------------------
+    def __watch_thread(self, fd: int | None):
+        """
+        Refresh the index when files in the sound folder change
+        :param fd: The inotify file descriptor, or None to poll instead
+        """
+        try:
+            while not self.exit_flag.is_set():
+                if fd is None:
+                    if not self.exit_flag.wait(self.poll_interval):
+                        self.refresh()
+                    continue
+
+                readable, _, _ = select.select([fd], [], [], 1.0)
+                if not readable or not self.__sound_changed(os.read(fd, 4096)):
+                    continue
+
+                # Wait until a batch of files has finished being copied
+                while not self.exit_flag.wait(self.SETTLE_TIME):
+                    readable, _, _ = select.select([fd], [], [], 0)
+                    if not readable:
+                        break
+                    os.read(fd, 4096)
+
+                self.refresh()
+
+        except Exception as ex:
+            logging.error(f'Sound folder watcher error: {repr(ex)}')
+
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    # ------------------------------------------------------------
+    def __open_inotify(self) -> int | None:
+        """
+        Start watching the sound folder using inotify
+        :return: The inotify file descriptor, or None if inotify is not available
+        """
+        try:
+            return open_inotify(self.folder,
+                                IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE)
+
+        except Exception as ex:
+            logging.warning(f'Unable to watch {self.folder}, polling sound files instead: {repr(ex)}')
+            return None
+
+    # ------------------------------------------------------------
+    def __sound_changed(self, data: bytes) -> bool:
+        """
+        Check whether a block of inotify events includes a sound file
+        :param data: Raw events read from the inotify file descriptor
+        :return: True if a sound file was added, removed or rewritten
+        """
+        extension = self.extension.encode()
+        return any(name.endswith(extension) for name in inotify_names(data))
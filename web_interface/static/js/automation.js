@@ -5,9 +5,7 @@
 
 
 var workspace;
-var myInterpreter;
 var fileSelector;
-var runnerPid;
 
 /*
  * Init Blockly
@@ -55,16 +53,6 @@ function init_blocks() {
     startBlock.initSvg();
     startBlock.render();
 
-    let myInterpreter = null;
-    let runnerPid = 0;
-
-    workspace.addChangeListener(function (event) {
-        if (!event.isUiEvent) {
-            // Something changed.  Interpreter needs to be reloaded.
-            resetStepUi(true);
-        }
-    });
-
     // Monitor the load file selector
 
     fileSelector = document.getElementById('customFile');
@@ -79,7 +67,9 @@ function init_blocks() {
 
 /*
  * Create Wrapper functions for JS Interpreter,
- * so the blocks can call external functions
+ * so the blocks can call external functions.
+ * The blocks are not run in the browser: their actions are collected
+ * into a program, which the robot runs with its own timing.
  */
 function initApi(interpreter, globalObject) {
     // Add an API function for the alert() block, generated for "text_print" blocks.
@@ -107,8 +97,7 @@ function initApi(interpreter, globalObject) {
 
     // Add an API function for highlighting blocks.
     const wrapperHighlight = function (id) {
-        id = String(id || '');
-        return highlightBlock(id);
+        programBlock = String(id || '');
     };
 
     interpreter.setProperty(
@@ -120,10 +109,8 @@ function initApi(interpreter, globalObject) {
     // Add an API for the wait block
     javascript.javascriptGenerator.addReservedWords('waitForSeconds');
 
-    const wrapperWaitSeconds = interpreter.createAsyncFunction(
-        function (timeInSeconds, callback) {
-            // Delay the call to the callback.
-            setTimeout(callback, timeInSeconds * 1000);
+    const wrapperWaitSeconds = interpreter.createNativeFunction(function(timeInSeconds) {
+            addOperation({"op": "wait", "seconds": Math.max(0, Number(timeInSeconds) || 0)});
         }
     );
 
@@ -132,8 +119,8 @@ function initApi(interpreter, globalObject) {
 
     // Add API for TTS
     const wrapperTTS = interpreter.createNativeFunction(function(text) {
-            text = arguments.length ? text : '';
-            return playTTS(text);
+            text = arguments.length ? String(text) : '';
+            if (text != '') addOperation({"op": "speak", "text": text});
         }
     );
 
@@ -152,6 +139,19 @@ function initApi(interpreter, globalObject) {
         interpreter.createNativeFunction(wrapperMove),
     );
 
+    // Drive a distance and turn, timed by the server
+    const wrapperDrive = interpreter.createNativeFunction(function(direction, distance) {
+            addOperation({"op": "drive", "direction": Number(direction), "distance": Math.max(0, Number(distance) || 0)});
+        }
+    );
+    interpreter.setProperty(globalObject, 'blockDrive', wrapperDrive);
+
+    const wrapperTurn = interpreter.createNativeFunction(function(turn) {
+            addOperation({"op": "turn", "turn": String(turn)});
+        }
+    );
+    interpreter.setProperty(globalObject, 'blockTurn', wrapperTurn);
+
     //  ServoControl
     const wrapperServo = interpreter.createNativeFunction(function(servo, value) {
             return blockServo(servo, value);
@@ -166,6 +166,19 @@ function initApi(interpreter, globalObject) {
     );
     interpreter.setProperty(globalObject,'blockAudio', wrapperAudio);
 
+    //  Loops, repeated by the server
+    const wrapperLoopStart = interpreter.createNativeFunction(function(times) {
+            return blockLoopStart(times);
+        }
+    );
+    interpreter.setProperty(globalObject,'blockLoopStart', wrapperLoopStart);
+
+    const wrapperLoopEnd = interpreter.createNativeFunction(function() {
+            return blockLoopEnd();
+        }
+    );
+    interpreter.setProperty(globalObject,'blockLoopEnd', wrapperLoopEnd);
+
 }
 
 
@@ -177,131 +190,200 @@ function highlightBlock(id) {
 }
 
 /*
- * Reset the block editor and stop code execution
+ * Reset the block editor and stop following the program
  */
 function resetStepUi(clearOutput) {
-    clearTimeout(runnerPid);
     workspace.highlightBlock(null);
-    myInterpreter = null;
+    if (programEvents !== null) {
+        programEvents.close();
+        programEvents = null;
+    }
+    programId = null;
+    setPauseButton(false);
 }
 
 /*
- * Generate JavaScript code and run it.
+ * Compile the blocks into a program and send it to the robot, which runs it.
  */
 function runCode() {
-    if (!myInterpreter) {
-        // First statement of this code.
-        // Clear the program output.
-        resetStepUi(true);
-        const latestCode =
-            javascript.javascriptGenerator.workspaceToCode(workspace);
-
-        // And then show generated code in an alert.
-        // In a timeout to allow the outputArea.value to reset first.
-        setTimeout(function () {
-            /*
-            alert(
-                'Ready to execute the following code\n' +
-                '===================================\n' +
-                latestCode,
-            );
-            */
-
-            // Begin execution
-            myInterpreter = new Interpreter(latestCode, initApi);
-
-            function runner() {
-                if (myInterpreter) {
-                    const hasMore = myInterpreter.run();
-                    if (hasMore) {
-                        // Execution is currently blocked by some async call.
-                        // Try again later.
-                        runnerPid = setTimeout(runner, 10);
-                    }
-                    else {
-                        // Program is complete.
-                        resetStepUi(false);
-                    }
-                }
-            }
-
-            runner();
-        }, 1);
+    resetStepUi(true);
+    const latestCode = javascript.javascriptGenerator.workspaceToCode(workspace);
+
+    // Run the generated code straight through, collecting the actions of the blocks
+    program = [];
+    programBlock = null;
+    programLoops = [];
+    try {
+        const interpreter = new Interpreter(latestCode, initApi);
+        var steps = 0;
+        while (interpreter.step()) {
+            if (++steps > MAX_INTERPRETER_STEPS) throw new Error('The program does not end, check its loops.');
+        }
+    }
+    catch (error) {
+        showAlert(1, 'Error!', error.message, 1);
         return;
     }
-}
 
+    if (program.length == 0) return;
+
+    // Follow the progress of the program, to highlight the block which is running
+    followProgram();
 
-/*
- * Send Motor XY commands via Block
- */
-function blockMoveMotor(x,y) {
     $.ajax({
-        url: "/motor",
+        url: "/api/program",
         type: "POST",
-        data: {"stickX": x, "stickY": y},
+        data: JSON.stringify({"program": program}),
+        contentType: "application/json",
         dataType: "json",
-        success: function(data){
-            if(data.status == "Error"){
-                showAlert(1, ' Error!', data.msg, 1);
-            }
+        success: function(data) {
+            programId = data.program;
+
+            // The program may have made progress before its id was known
+            $.getJSON("/api/program", function(data) {
+                showProgress(data.program);
+            });
         },
         error: function(error) {
-            showAlert(1, ' Error!', 'Unable to send movement command.', 1);
+            resetStepUi(false);
+            var msg = (error.responseJSON && error.responseJSON.msg) ? error.responseJSON.msg : 'Unable to run the program.';
+            showAlert(1, 'Error!', msg, 1);
         }
     });
 }
 
 /*
- * Send a manual servo control command via Block
+ * Receive the progress events of the program which is running
  */
-function blockServo(servo, value) {
-    $.ajax({
-        url: "/servoControl",
-        type: "POST",
-        data: {"servo": servo, "value": value},
-        dataType: "json",
-        success: function(data){
-            // If a response is received from the python backend, but it contains an error
-            if(data.status == "Error"){
-                showAlert(1, 'Error!', data.msg, 0);
-            }
-        },
-        error: function(error) {
-            // If no response was recevied from the python backend, show an "unknown" error
-            showAlert(1, 'Unknown Error!', 'Unable to update servo position.', 1);
-        }
+function followProgram() {
+    programEvents = new EventSource("/api/events?types=program");
+
+    programEvents.addEventListener('program', function(event) {
+        showProgress(JSON.parse(event.data));
     });
 }
 
+function showProgress(progress) {
+    if (programId === null || progress.program != programId) return;
+
+    if (progress.state == 'running' || progress.state == 'paused') {
+        highlightBlock(progress.block);
+        setPauseButton(progress.state == 'paused');
+    }
+    else {
+        resetStepUi(false);
+    }
+}
+
+/*
+ * Actions of the blocks, added to the program
+ */
+var program = [];
+var programBlock = null;
+var programLoops = [];
+var programId = null;
+var programEvents = null;
+var MAX_INTERPRETER_STEPS = 1000000;
+var batchServos = {'G': 'head_rotation', 'T': 'neck_top', 'B': 'neck_bottom', 'L': 'arm_left',
+                   'R': 'arm_right', 'E': 'eye_left', 'U': 'eye_right'};
+var programPresets = {'f': 'head_up', 'h': 'head_down', 'g': 'head_neutral', 'm': 'arms_left',
+                      'b': 'arms_right', 'n': 'arms_neutral', 'j': 'eyes_left', 'l': 'eyes_right',
+                      'k': 'eyes_neutral', 'i': 'eyes_sad'};
+
+function addOperation(operation) {
+    operation.block = programBlock;
+    program.push(operation);
+}
+
+/*
+ * Send Motor XY commands via Block
+ */
+function blockMoveMotor(x,y) {
+    x = Math.max(-100, Math.min(100, Math.round(x * 100)));
+    y = Math.max(-100, Math.min(100, Math.round(y * 100)));
+    addOperation({"op": "move", "x": x, "y": y});
+}
+
 /*
  * Send a manual servo control command via Block
  */
+function blockServo(servo, value) {
+    if (servo in batchServos) {
+        addOperation({"op": "servo", "servo": batchServos[servo], "value": Number(value)});
+    }
+    else if (servo in programPresets) {
+        addOperation({"op": "preset", "preset": programPresets[servo]});
+    }
+    else {
+        throw new Error('Unknown servo "' + servo + '"');
+    }
+}
+
+/*
+ * Start and end of a loop block, which the server repeats
+ * The body is compiled once; the loop operation at its end jumps back to its start.
+ */
+function blockLoopStart(times) {
+    times = Number(times);
+    programLoops.push({"start": program.length, "block": programBlock, "forever": times == Infinity,
+                       "times": Math.floor(times) || 0});
+}
+
+function blockLoopEnd() {
+    var loop = programLoops.pop();
+
+    // A loop which does not run leaves out its body, one which runs once needs no loop operation
+    if (!loop.forever && loop.times < 1) {
+        program.length = loop.start;
+    }
+    else if (program.length > loop.start && (loop.forever || loop.times > 1)) {
+        program.push({"op": "loop", "start": loop.start, "times": loop.forever ? 0 : loop.times,
+                      "block": loop.block});
+    }
+}
+
 /*
  * Play an audio clip from a blockly block
  */
 function blockAudio(clip) {
+    addOperation({"op": "audio", "clip": clip});
+}
+
+/*
+ * Pause or resume the program
+ */
+function pauseCode() {
+    var paused = $('#pause').data('paused') === true;
+
     $.ajax({
-        url: "/audio",
+        url: paused ? "/api/program/resume" : "/api/program/pause",
         type: "POST",
-        data: {"clip": clip},
         dataType: "json",
-
-        success: function(data){
-            // If a response is received from the python backend, but it contains an error
-            if(data.status == "Error") showAlert(1, 'Error!', data.msg, 1);
+        success: function(data) {
+            setPauseButton(data.program.state == 'paused');
         },
         error: function(error) {
-            showAlert(1, 'Unknown Error!', 'Unable to play audio file.', 1);
+            var msg = (error.responseJSON && error.responseJSON.msg) ? error.responseJSON.msg : 'Unable to pause the program.';
+            showAlert(1, 'Error!', msg, 1);
         }
     });
 }
 
+function setPauseButton(paused) {
+    $('#pause').data('paused', paused);
+    $('#pause i').attr('class', paused ? 'far fa-play-circle' : 'far fa-pause-circle');
+    $('#pause .indicator-text').text(paused ? 'Resume' : 'Pause');
+}
+
 /*
- * Stop the code executions and stop motors
+ * Stop the program and the motors
  */
 function stopCode() {
-    blockMoveMotor(0.0, 0.0);
+    $.ajax({
+        url: "/api/program/abort",
+        type: "POST",
+        dataType: "json"
+    });
     resetStepUi(false);
 }
 
@@ -281,17 +281,14 @@ Blockly.defineBlocksWithJsonArray([
 
 /*
  * Move block generator
+ * The server converts the distance into a drive time, using the calibration in config.py
  */
 javascript.javascriptGenerator.forBlock['move'] = function(block, generator) {
   var dropdown_direction = Number(block.getFieldValue('direction'));
   var value_distance = generator.valueToCode(block, 'distance', javascript.Order.ATOMIC);
   if (value_distance <= 0) return '';
 
-  var code = 'blockMoveMotor( 0.0, ' + code_motorpower * dropdown_direction + ');\n';
-  var wait = 'waitForSeconds(' + value_distance / code_motorspeed + ');\n';
-  var stop = 'blockMoveMotor( 0.0, 0.0);\n';
-
-  return code + wait + stop;
+  return 'blockDrive(' + dropdown_direction + ', ' + value_distance + ');\n';
 };
 
 /*
@@ -379,34 +376,12 @@ Blockly.defineBlocksWithJsonArray([
 
 /*
  * Turn block generator
+ * The server converts the angle into a turn time, using the calibration in config.py
  */
 javascript.javascriptGenerator.forBlock['turn'] = function(block, generator) {
   var dropdown_direction = block.getFieldValue('direction');
-  var movement = 0.0;
-  var wait = 0.0;
-
-  if (dropdown_direction == "left_90") {
-    movement = code_turnpower;
-    wait = 'waitForSeconds(' + code_turntime + ');\n';
-  }
-  else if (dropdown_direction == "left_45") {
-    movement = code_turnpower;
-    wait = 'waitForSeconds(' + code_turntime/2 + ');\n';
-  }
-  else if (dropdown_direction == "right_90") {
-    movement = -code_turnpower;
-    wait = 'waitForSeconds(' + code_turntime + ');\n';
-  }
-  else if (dropdown_direction == "right_45") {
-    movement = -code_turnpower;
-    wait = 'waitForSeconds(' + code_turntime/2 + ');\n';
-  }
-
-  var code = 'blockMoveMotor( ' + movement +', 0.0);\n';
-  code += wait;
-  code += 'blockMoveMotor( 0.0, 0.0);\n';
-  return code;
 
+  return "blockTurn('" + dropdown_direction + "');\n";
 };
 
 
@@ -460,3 +435,50 @@ javascript.javascriptGenerator.forBlock['audioplayer'] = function(block, generat
     code = 'blockAudio("' + dropdown_clip + '");\n';
     return code;
 };
+
+/*
+ * Loop generators
+ * The body of a loop is compiled once, between blockLoopStart() and blockLoopEnd(), and the
+ * server repeats it. Loops whose runs can differ (variables, random values, break) are still
+ * repeated by the compiler, which adds their body to the program once per run.
+ */
+var loopGenerators = {
+    'controls_repeat_ext': javascript.javascriptGenerator.forBlock['controls_repeat_ext'],
+    'controls_repeat': javascript.javascriptGenerator.forBlock['controls_repeat'],
+    'controls_whileUntil': javascript.javascriptGenerator.forBlock['controls_whileUntil']
+};
+var loopUnrolledBlocks = ['controls_flow_statements', 'controls_for', 'controls_forEach', 'variables_set',
+                          'math_change', 'math_random_int', 'math_random_float', 'lists_setIndex', 'text_append',
+                          'procedures_callnoreturn', 'procedures_callreturn'];
+
+function serverLoop(block, generator, times) {
+    var unrolled = block.getDescendants(false).some(function(child) {
+        return loopUnrolledBlocks.includes(child.type);
+    });
+    if (unrolled) return loopGenerators[block.type](block, generator);
+
+    return 'blockLoopStart(' + times + ');\n' + generator.statementToCode(block, 'DO') + 'blockLoopEnd();\n';
+}
+
+javascript.javascriptGenerator.forBlock['controls_repeat_ext'] = function(block, generator) {
+    var times = generator.valueToCode(block, 'TIMES', javascript.Order.NONE) || '0';
+    return serverLoop(block, generator, times);
+};
+
+javascript.javascriptGenerator.forBlock['controls_repeat'] = function(block, generator) {
+    return serverLoop(block, generator, Number(block.getFieldValue('TIMES')));
+};
+
+/*
+ * Only "repeat while true" and "repeat until false" are repeated by the server,
+ * other conditions are evaluated by the compiler
+ */
+javascript.javascriptGenerator.forBlock['controls_whileUntil'] = function(block, generator) {
+    var condition = block.getInputTargetBlock('BOOL');
+    var forever = block.getFieldValue('MODE') == 'WHILE' ? 'TRUE' : 'FALSE';
+
+    if (condition && condition.type == 'logic_boolean' && condition.getFieldValue('BOOL') == forever) {
+        return serverLoop(block, generator, 'Infinity');
+    }
+    return loopGenerators['controls_whileUntil'](block, generator);
+};
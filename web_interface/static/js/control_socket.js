@@ -0,0 +1,70 @@
+/**
+ * Robot Webinterface - Control Socket
+ * Streams joystick and gamepad values over a WebSocket, instead of
+ * sending a separate HTTP request for every update. If the socket is
+ * not available, send() returns false and the caller falls back to HTTP.
+ */
+
+var controlSocket = {
+	socket: null,
+	retryDelay: 1000,
+	handlers: {},
+
+	// Open the socket, and keep trying to reopen it if it closes
+	connect: function() {
+		if (typeof control_socket_port === 'undefined' || !control_socket_port) return;
+
+		var scheme = (window.location.protocol == "https:") ? "wss://" : "ws://";
+		var socket = new WebSocket(scheme + window.location.hostname + ":" + control_socket_port + "/");
+		var self = this;
+
+		socket.onopen = function() {
+			self.retryDelay = 1000;
+		};
+
+		socket.onmessage = function(e) {
+			var data = JSON.parse(e.data);
+			if (data.telemetry && self.handlers[data.telemetry.type]) {
+				self.handlers[data.telemetry.type](data.telemetry);
+			} else if (data.error && self.handlers.error) {
+				self.handlers.error(data.error, data.lease);
+			}
+		};
+
+		socket.onclose = function() {
+			self.socket = null;
+			setTimeout(function() { self.connect(); }, self.retryDelay);
+			self.retryDelay = Math.min(self.retryDelay * 2, 30000);
+		};
+
+		this.socket = socket;
+	},
+
+	// Send a control message, e.g. {"x": 20, "y": -50} or {"servos": {"G": 50}}
+	send: function(message) {
+		if (this.socket === null || this.socket.readyState !== WebSocket.OPEN) return false;
+		this.socket.send(JSON.stringify(message));
+		return true;
+	},
+
+	// Call a function for pushed telemetry of a certain type (e.g. "battery"), or for "error" messages
+	// (the error handler also gets {"holder", "retry_after"} if another client holds the motion lease)
+	on: function(type, handler) {
+		this.handlers[type] = handler;
+	}
+};
+
+// The joystick keeps sending while another client holds the motion lease;
+// report the refusal once until that lease could run out, not for every update
+var leaseAlert = {
+	until: 0,
+
+	// Return true if a drive error should be shown; retryAfter is in seconds (undefined for other errors)
+	show: function(retryAfter) {
+		if (retryAfter === undefined || retryAfter === null) return true;
+		var now = Date.now();
+		if (now < this.until) return false;
+		this.until = now + retryAfter * 1000;
+		return true;
+	}
+};
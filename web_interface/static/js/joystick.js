@@ -54,6 +54,7 @@ var VirtualJoystick	= function(opts)
 	this._touchIdx	= null;
 	this._currentX = 0.0;
 	this._currentY = 0.0;
+	this._lastPost = 0;
 
 	//if(this._stationaryBase === true){
 	//	this._baseEl.style.display	= "";
@@ -72,7 +73,7 @@ var VirtualJoystick	= function(opts)
 	this._container.addEventListener( 'touchstart'	, this._$onTouchStart	, false );
 	this._container.addEventListener( 'touchend'	, this._$onTouchEnd	, false );
 	this._container.addEventListener( 'touchmove'	, this._$onTouchMove	, false );
-	this._timer = setInterval(this._$updateValues, 100); 			// << Send joystick value every 100ms (10Hz)
+	this._timer = setInterval(this._$updateValues, 33); 			// << Send joystick value every 33ms (30Hz), or 100ms (10Hz) without the control socket
 	if( this._mouseSupport ){
 		this._$onMouseDown	= __bind(this._onMouseDown	, this);
 		this._$onMouseUp	= __bind(this._onMouseUp	, this);
@@ -206,7 +207,17 @@ VirtualJoystick.prototype._updateValues = function(){
 	this._updateText.innerHTML = 'x: ' + Math.round(stickNormalizedX*100) + ', y: ' + Math.round(stickNormalizedY*100);
 	var text = this._updateText;
 
-	// Send data to python app, so that it can be passed on
+	// Stream data over the control socket if it is open
+	if (controlSocket.send({"x": Math.round(stickNormalizedX*100), "y": Math.round(stickNormalizedY*100)})) {
+		text.style.color = "#3498DB";
+		return true;
+	}
+
+	// Otherwise send it to python app at 10Hz (always send the final stop)
+	var now = Date.now();
+	if (this._pressed && now - this._lastPost < 100) return true;
+	this._lastPost = now;
+
 	$.ajax({
 		url: "/motor",
 		type: "POST",
@@ -216,6 +227,7 @@ VirtualJoystick.prototype._updateValues = function(){
 		success: function(data){
 			if(data.status == "Error"){
 				text.style.color = "#E74C3C";
+				if (!leaseAlert.show(data.retry_after)) return;
 				$('#alert-space').html('<div class="alert alert-dismissible alert-danger set-alert">\
 											<button type="button" class="close" data-dismiss="alert">&times;</button>\
 											<strong>Error! </strong>' + data.msg + ' \
@@ -21,7 +21,9 @@ var jsJoystick;
 var alertVisible = false
 
 // Timer to periodically check if Arduino has sent a message
+// (only used if the status event stream is not available)
 var arduinoTimer;
+var statusEvents = null;
 
 
 /*
@@ -132,7 +134,7 @@ function arduinoConnect(item) {
 						$('#ardu-area').removeClass('bg-danger');
 						$('#ardu-area').addClass('bg-success');
 						showAlert(0, 'Success!', 'Arduino now connected.', 1);
-						arduinoTimer = setInterval(checkArduinoStatus, 10000);
+						startStatusPolling();
 						checkArduinoStatus();
 					} else if(data.arduino == "Disconnected"){
 						$('#conn-arduino').html('Reconnect');
@@ -343,6 +345,14 @@ function playTTS(text) {
  * Send a manual servo control command
  */
 function servoControl(item, servo, value) {
+	var servos = {};
+	servos[servo] = parseInt(value);
+	if (controlSocket.send({"servos": servos})) {
+		item.value = value;
+		item.oldvalue = value;
+		return true;
+	}
+
 	$.ajax({
 		url: "/servoControl",
 		type: "POST",
@@ -501,6 +511,84 @@ function servoInputs(enabled) {
 }
 
 
+/*
+ * Show the battery level reported by the Arduino (-999 = unknown)
+ */
+function showBatteryLevel(batteryLevel) {
+	if (batteryLevel != -999) {
+		if (batteryLevel < 0) batteryLevel = 0;
+		$('#batt-area').removeClass('d-none');
+		$('#batt-text').html(batteryLevel + '%');
+		if (batteryLevel > 65 && !$('#batt-icon').hasClass('fa-battery-full')) {
+			$('#batt-icon').removeClass('fa-battery-quarter');
+			$('#batt-icon').removeClass('fa-battery-half');
+			$('#batt-icon').addClass('fa-battery-full');
+			$('#batt-area').removeClass('bg-danger');
+			$('#batt-area').removeClass('bg-warning');
+			$('#batt-area').addClass('bg-success');
+		} else if (batteryLevel > 35 && batteryLevel <= 65  && !$('#batt-icon').hasClass('fa-battery-half')) {
+			$('#batt-icon').removeClass('fa-battery-quarter');
+			$('#batt-icon').addClass('fa-battery-half');
+			$('#batt-icon').removeClass('fa-battery-full');
+			$('#batt-area').removeClass('bg-danger');
+			$('#batt-area').addClass('bg-warning');
+			$('#batt-area').removeClass('bg-success');
+		} if (batteryLevel <= 35 && !$('#batt-icon').hasClass('fa-battery-quarter')) {
+			$('#batt-icon').addClass('fa-battery-quarter');
+			$('#batt-icon').removeClass('fa-battery-half');
+			$('#batt-icon').removeClass('fa-battery-full');
+			$('#batt-area').addClass('bg-danger');
+			$('#batt-area').removeClass('bg-warning');
+			$('#batt-area').removeClass('bg-success');
+		}
+	} else {
+		$('#batt-area').addClass('d-none');
+	}
+}
+
+
+/*
+ * Subscribe to the status event stream, so that the status does not need to be polled
+ */
+function startStatusEvents() {
+	if (!window.EventSource) return;
+
+	statusEvents = new EventSource("/api/events");
+
+	statusEvents.addEventListener('status', function(e) {
+		var status = JSON.parse(e.data);
+		if (status.battery_level !== null) showBatteryLevel(parseInt(status.battery_level));
+	});
+
+	statusEvents.addEventListener('battery', function(e) {
+		showBatteryLevel(JSON.parse(e.data).level);
+	});
+
+	statusEvents.addEventListener('arduino', function(e) {
+		if (!JSON.parse(e.data).connected) $('#batt-area').addClass('d-none');
+	});
+
+	// The browser reconnects by itself, unless the server refused the stream
+	statusEvents.onerror = function() {
+		if (statusEvents.readyState == EventSource.CLOSED) {
+			statusEvents = null;
+			if ($('#ardu-area').hasClass('bg-success')) startStatusPolling();
+		}
+	};
+
+	clearInterval(arduinoTimer);
+}
+
+
+/*
+ * Poll the battery level every 10 seconds, if the status event stream is not available
+ */
+function startStatusPolling() {
+	clearInterval(arduinoTimer);
+	if (statusEvents === null) arduinoTimer = setInterval(checkArduinoStatus, 10000);
+}
+
+
 /*
  * This function checks if the Arduino has sent any messages to the 
  * Raspberry Pi; for example, the current battery level
@@ -513,36 +601,7 @@ function checkArduinoStatus() {
 		dataType: "json",
 		success: function(data){
 			if(data.status != "Error" && data.status != "Info"){
-				var batteryLevel = parseInt(data.battery);
-				if (batteryLevel != -999) {
-					if (batteryLevel < 0) batteryLevel = 0;
-					$('#batt-area').removeClass('d-none');
-					$('#batt-text').html(batteryLevel + '%');
-					if (batteryLevel > 65 && !$('#batt-icon').hasClass('fa-battery-full')) {
-						$('#batt-icon').removeClass('fa-battery-quarter');
-						$('#batt-icon').removeClass('fa-battery-half');
-						$('#batt-icon').addClass('fa-battery-full');
-						$('#batt-area').removeClass('bg-danger');
-						$('#batt-area').removeClass('bg-warning');
-						$('#batt-area').addClass('bg-success');
-					} else if (batteryLevel > 35 && batteryLevel <= 65  && !$('#batt-icon').hasClass('fa-battery-half')) {
-						$('#batt-icon').removeClass('fa-battery-quarter');
-						$('#batt-icon').addClass('fa-battery-half');
-						$('#batt-icon').removeClass('fa-battery-full');
-						$('#batt-area').removeClass('bg-danger');
-						$('#batt-area').addClass('bg-warning');
-						$('#batt-area').removeClass('bg-success');
-					} if (batteryLevel <= 35 && !$('#batt-icon').hasClass('fa-battery-quarter')) {
-						$('#batt-icon').addClass('fa-battery-quarter');
-						$('#batt-icon').removeClass('fa-battery-half');
-						$('#batt-icon').removeClass('fa-battery-full');
-						$('#batt-area').addClass('bg-danger');
-						$('#batt-area').removeClass('bg-warning');
-						$('#batt-area').removeClass('bg-success');
-					}
-				} else {
-					$('#batt-area').addClass('d-none');
-				}
+				showBatteryLevel(parseInt(data.battery));
 				return true;
 			} else if (data.status == "Error") {
 				showAlert(1, 'Error!', data.msg, 1);
@@ -771,14 +830,16 @@ function sendMovementValues() {
 		$('#joytext').html('x: ' + Math.round(moveXY[1]*100) + ', y: ' + Math.round(moveXY[3]*-100));
 		
 		// Send data to python app, so that it can be passed on
-		$.ajax({
+		if (controlSocket.send({"x": Math.round(moveXY[1]*100), "y": Math.round(moveXY[3]*-100)})) {
+			// Sent over the control socket
+		} else $.ajax({
 			url: "/motor",
 			type: "POST",
 			data: {"stickX": moveXY[1], "stickY": -moveXY[3]},
 			dataType: "json",
 			success: function(data){
 				if(data.status == "Error"){
-					showAlert(1, 'Error!', data.msg, 0);
+					if (leaseAlert.show(data.retry_after)) showAlert(1, 'Error!', data.msg, 0);
 				} else {
 					// Do nothing
 				}
@@ -951,9 +1012,18 @@ $(document).ready(function () {
 	  $('[data-toggle="tooltip"]').tooltip()
 	})
 
+	// Stream joystick/gamepad values over the control socket
+	controlSocket.on('error', function(msg, lease) {
+		if (leaseAlert.show(lease ? lease.retry_after : undefined)) showAlert(1, 'Error!', msg, 0);
+	});
+	controlSocket.connect();
+
+	// Receive status changes as they happen
+	startStatusEvents();
+
 	// If arduino has already been connected, start the status check
 	if ($('#ardu-area').hasClass('bg-success')) {
-		arduinoTimer = setInterval(checkArduinoStatus, 10000);
+		startStatusPolling();
 		checkArduinoStatus();
 	}
 
@@ -0,0 +1,265 @@
+"""
+Precompressed, content-hashed copies of the static files
+
+The control page loads several megabytes of scripts, stylesheets and
+fonts. Flask serves these uncompressed and with a short cache lifetime,
+which makes the first page load over the robot's Wi-Fi slow.
+
+The build step below copies every file in the static folder to a build
+folder under a name containing a hash of its contents (for example
+"js/main.3f2a9c1b04de.js"), together with gzip and brotli compressed
+variants. Because the name changes whenever the contents do, browsers
+can cache these files forever. Relative url() references in stylesheets
+are rewritten to the hashed names, so fonts are cached the same way.
+
+Hashed files which already exist are not compressed again, so only
+files which have changed are rebuilt when the web-interface starts.
+The build can also be run ahead of time: python3 static_assets.py
+
+Brotli is optional (sudo apt-get install python3-brotli); without it
+only gzip variants are written.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import re
+from threading import Lock
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Files which are worth compressing; images, audio and woff fonts are already compressed
+COMPRESSIBLE: tuple = ('.css', '.js', '.map', '.json', '.svg', '.ttf', '.eot', '.ico', '.html', '.txt')
+
+# Relative url() references in stylesheets
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+# ================================================================
+class StaticAssets:
+    """Build and look up the precompressed, hashed copies of the static files"""
+
+    MANIFEST: str = "manifest.json"
+    HASH_LENGTH: int = 12
+
+    def __init__(self, static_folder: str, build_folder: str, exclude: tuple = ()):
+        """
+        Constructor
+        :param static_folder: Folder containing the static files
+        :param build_folder:  Folder the hashed and compressed files are written to
+        :param exclude:       Sub-folders of the static folder which are not built (e.g. sounds)
+        """
+        self.static_folder: str = os.path.abspath(static_folder)
+        self.build_folder: str = os.path.abspath(build_folder)
+        self.exclude: tuple = exclude
+        self.lock: Lock = Lock()
+        self.hashed: dict[str, str] = {}        # Static file name -> hashed name
+        self.files: dict[str, str] = {}         # Hashed name -> static file name
+        self.encodings: dict[str, tuple] = {}   # Hashed name -> compressed variants ("br", "gzip")
+
+    # ------------------------------------------------------------
+    def load(self) -> bool:
+        """
+        Load the manifest of a previous build
+        :return: True if the manifest was loaded
+        """
+        try:
+            with open(os.path.join(self.build_folder, self.MANIFEST)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        self.__set_manifest(manifest)
+        return True
+
+    # ------------------------------------------------------------
+    def build(self):
+        """
+        Write the hashed and compressed files, and remove those of files which no longer exist
+        """
+        manifest = {}
+        stylesheets = []
+
+        for name in self.__static_files():
+            if name.endswith('.css'):
+                stylesheets.append(name)
+            else:
+                with open(os.path.join(self.static_folder, name), 'rb') as f:
+                    manifest[name] = self.__write(name, f.read())
+
+        # Stylesheets last, so that their references can be rewritten to hashed names
+        for name in stylesheets:
+            with open(os.path.join(self.static_folder, name), 'rb') as f:
+                manifest[name] = self.__write(name, self.__rewrite_css(name, f.read(), manifest))
+
+        self.__remove_stale(manifest)
+
+        path = os.path.join(self.build_folder, self.MANIFEST)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(path + '.tmp', path)
+
+        self.__set_manifest(manifest)
+        logging.info(f'Static assets: {len(manifest)} files built in {self.build_folder}')
+
+    # ------------------------------------------------------------
+    def url_name(self, filename: str) -> str | None:
+        """
+        Get the hashed name of a static file
+        :param filename: Name of the file in the static folder, e.g. "js/main.js"
+        :return: The hashed name, or None if the file has not been built
+        """
+        with self.lock:
+            return self.hashed.get(filename)
+
+    # ------------------------------------------------------------
+    def find(self, hashed_name: str, accept_encoding: str) -> tuple[str, str | None] | None:
+        """
+        Find the best variant of a hashed file for a request
+        :param hashed_name:     Hashed name of the file
+        :param accept_encoding: Accept-Encoding header of the request
+        :return: (path of the file, content encoding or None), or None if there is no such file
+        """
+        with self.lock:
+            if hashed_name not in self.files:
+                return None
+            encodings = self.encodings[hashed_name]
+
+        accepted = {item.split(';')[0].strip().lower() for item in accept_encoding.split(',')}
+        path = os.path.join(self.build_folder, hashed_name)
+
+        if 'br' in encodings and 'br' in accepted:
+            return path + '.br', 'br'
+        if 'gzip' in encodings and 'gzip' in accepted:
+            return path + '.gz', 'gzip'
+        return path, None
+
+    # ------------------------------------------------------------
+    def __set_manifest(self, manifest: dict):
+        """
+        Use the files of a build
+        :param manifest: Static file name -> {"name": hashed name, "encodings": [...]}
+        """
+        with self.lock:
+            self.hashed = {name: entry['name'] for name, entry in manifest.items()}
+            self.files = {entry['name']: name for name, entry in manifest.items()}
+            self.encodings = {entry['name']: tuple(entry['encodings']) for entry in manifest.values()}
+
+    # ------------------------------------------------------------
+    def __static_files(self) -> list[str]:
+        """
+        List the files in the static folder
+        :return: File names relative to the static folder, with "/" separators
+        """
+        names = []
+        for root, dirs, files in os.walk(self.static_folder):
+            relative = os.path.relpath(root, self.static_folder)
+            dirs[:] = sorted(d for d in dirs if os.path.normpath(os.path.join(relative, d)) not in self.exclude)
+
+            for file in sorted(files):
+                names.append(posixpath.normpath(posixpath.join(relative.replace(os.sep, '/'), file)))
+
+        return names
+
+    # ------------------------------------------------------------
+    def __write(self, name: str, content: bytes) -> dict:
+        """
+        Write the hashed file and its compressed variants, unless they already exist
+        :param name:    Name of the file in the static folder
+        :param content: Contents of the file
+        :return: Manifest entry of the file
+        """
+        root, extension = posixpath.splitext(name)
+        digest = hashlib.sha256(content).hexdigest()[:self.HASH_LENGTH]
+        hashed_name = f'{root}.{digest}{extension}'
+        path = os.path.join(self.build_folder, hashed_name)
+
+        if not os.path.isfile(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.__write_file(path, content)
+
+        if extension.lower() in COMPRESSIBLE:
+            if not os.path.isfile(path + '.gz'):
+                self.__write_file(path + '.gz', gzip.compress(content, 9, mtime=0))
+            if brotli is not None and not os.path.isfile(path + '.br'):
+                self.__write_file(path + '.br', brotli.compress(content, quality=11))
+
+        # Only serve the compressed variants which are smaller than the file itself
+        encodings = [encoding for encoding, suffix in (('br', '.br'), ('gzip', '.gz'))
+                     if os.path.isfile(path + suffix) and os.path.getsize(path + suffix) < len(content)]
+
+        return {'name': hashed_name, 'encodings': encodings}
+
+    # ------------------------------------------------------------
+    @staticmethod
+    def __write_file(path: str, content: bytes):
+        """
+        Write a file so that it never appears partially written
+        :param path:    Path of the file
+        :param content: Contents of the file
+        """
+        with open(path + '.tmp', 'wb') as f:
+            f.write(content)
+        os.replace(path + '.tmp', path)
+
+    # ------------------------------------------------------------
+    @staticmethod
+    def __rewrite_css(name: str, content: bytes, manifest: dict) -> bytes:
+        """
+        Point the relative url() references of a stylesheet at hashed names
+        :param name:     Name of the stylesheet in the static folder
+        :param content:  Contents of the stylesheet
+        :param manifest: Manifest entries of the files built so far
+        :return: The rewritten stylesheet
+        """
+        folder = posixpath.dirname(name)
+
+        def replace(match: re.Match) -> str:
+            quote, url = match.group(1), match.group(2)
+            if url.startswith(('data:', '/', '#')) or '://' in url:
+                return match.group(0)
+
+            # Keep any query or fragment, e.g. font.eot?#iefix
+            split = min((url.index(c) for c in '?#' if c in url), default=len(url))
+            target = posixpath.normpath(posixpath.join(folder, url[:split]))
+            if target not in manifest:
+                return match.group(0)
+
+            relative = posixpath.relpath(manifest[target]['name'], folder or '.')
+            return f'url({quote}{relative}{url[split:]}{quote})'
+
+        return CSS_URL.sub(replace, content.decode('utf-8')).encode('utf-8')
+
+    # ------------------------------------------------------------
+    def __remove_stale(self, manifest: dict):
+        """
+        Delete hashed files which are not part of a build
+        :param manifest: Manifest entries of the build
+        """
+        keep = {self.MANIFEST}
+        for entry in manifest.values():
+            keep.update({entry['name'], entry['name'] + '.gz', entry['name'] + '.br'})
+
+        for root, _, files in os.walk(self.build_folder):
+            for file in files:
+                path = os.path.join(root, file)
+                if os.path.relpath(path, self.build_folder).replace(os.sep, '/') not in keep:
+                    os.remove(path)
+
+
+# ------------------------------------------------------------
+if __name__ == '__main__':
+    import importlib
+    logging.basicConfig(level=logging.INFO)
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    config = importlib.import_module("local_config" if os.path.isfile("local_config.py") else "config")
+    StaticAssets("static", config.STATIC_BUILD_FOLDER,
+                 (os.path.relpath(config.SOUND_FOLDER, "static"),)).build()
@@ -0,0 +1,148 @@
+"""
+Parser for the messages which the Arduino prints on the serial port
+
+Each message prefix is mapped to a handler, which turns the line into a
+typed event. The most recent events of each type are kept in ring
+buffers, so that the web interface can read them at any time without
+having to interact with the serial thread.
+"""
+
+import time
+from collections import deque
+from threading import Lock
+from typing import Any, Callable, NamedTuple
+
+
+# ================================================================
+class TelemetryEvent(NamedTuple):
+    """A message received from the Arduino"""
+    time: float         # Wall-clock time the message was received
+    type: str           # Event type, e.g. "battery"
+    message: str        # The raw line
+    value: Any          # Value returned by the handler for the message
+
+
+# ================================================================
+class TelemetryParser:
+    """Table-driven parser of serial messages into telemetry events"""
+
+    def __init__(self, history: int = 50):
+        """
+        Constructor
+        :param history: Number of events of each type which are kept
+        """
+        self.history: int = history
+        self.lock: Lock = Lock()
+        self.handlers: list = []
+        self.events: dict = {}
+        self.counts: dict = {}
+        self.unknown: int = 0
+        self.parse_errors: int = 0
+        self.listeners: list = []
+
+    # ------------------------------------------------------------
+    def add_listener(self, listener: Callable[[TelemetryEvent], None]):
+        """
+        Register a function to be called for every event; it runs in the serial reader thread, so must not block
+        :param listener: Function which takes the event
+        """
+        with self.lock:
+            self.listeners.append(listener)
+
+    # ------------------------------------------------------------
+    def remove_listener(self, listener: Callable[[TelemetryEvent], None]):
+        """
+        Stop calling a function registered with add_listener()
+        :param listener: The function
+        """
+        with self.lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    # ------------------------------------------------------------
+    def register(self, prefix: str, event_type: str, handler: Callable[[str], Any] | None = None):
+        """
+        Add a message type to the dispatch table
+        :param prefix:     Start of the messages handled
+        :param event_type: Type of the events which are created
+        :param handler:    Function which takes the message and returns its value; raising
+                           an exception marks the message as a parse error
+        """
+        self.handlers.append((prefix, event_type, handler))
+
+    # ------------------------------------------------------------
+    def parse(self, message: str) -> TelemetryEvent | None:
+        """
+        Dispatch a message to its handler and record the event
+        :param message: Line received from the Arduino
+        :return: The event, or None if the message was unknown or could not be parsed
+        """
+        for prefix, event_type, handler in self.handlers:
+            if message.startswith(prefix):
+                try:
+                    value = handler(message) if handler is not None else None
+                except Exception:
+                    with self.lock:
+                        self.parse_errors += 1
+                    self.record("parse_error", message)
+                    return None
+
+                return self.record(event_type, message, value)
+
+        with self.lock:
+            self.unknown += 1
+        self.record("unknown", message)
+        return None
+
+    # ------------------------------------------------------------
+    def record(self, event_type: str, message: str, value: Any = None) -> TelemetryEvent:
+        """
+        Add an event to the ring buffer of its type
+        :param event_type: Type of the event
+        :param message:    The raw line
+        :param value:      Parsed value of the message
+        :return: The event
+        """
+        event = TelemetryEvent(time.time(), event_type, message, value)
+
+        with self.lock:
+            if event_type not in self.events:
+                self.events[event_type] = deque(maxlen=self.history)
+                self.counts[event_type] = 0
+            self.events[event_type].append(event)
+            self.counts[event_type] += 1
+            listeners = list(self.listeners)
+
+        for listener in listeners:
+            listener(event)
+
+        return event
+
+    # ------------------------------------------------------------
+    def get_events(self, event_type: str | None = None, limit: int | None = None) -> list[TelemetryEvent]:
+        """
+        Get the most recent events
+        :param event_type: Only return events of this type (None for all types)
+        :param limit:      Maximum number of events to return
+        :return: List of events, oldest first
+        """
+        with self.lock:
+            if event_type is None:
+                events = sorted((e for buffer in self.events.values() for e in buffer), key=lambda e: e.time)
+            else:
+                events = list(self.events.get(event_type, ()))
+
+        return events[-limit:] if limit else events
+
+    # ------------------------------------------------------------
+    def get_stats(self) -> dict:
+        """
+        Get the number of messages received
+        :return: Dictionary with the count per event type, unknown lines and parse errors
+        """
+        with self.lock:
+            return {
+                'counts': dict(self.counts),
+                'unknown': self.unknown,
+                'parse_errors': self.parse_errors,
+            }
@@ -0,0 +1,79 @@
+"""
+Shared setup of the unit tests
+
+The modules of the web interface import each other by name, as they do
+when app.py is run from its folder, so that folder is put on the path.
+"""
+
+import os
+import select
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from arduino_simulator import ArduinoSimulator
+
+
+# ================================================================
+class SimulatedPort:
+    """Client end of the pseudo-terminal of an ArduinoSimulator"""
+
+    def __init__(self, path: str):
+        """
+        Constructor
+        :param path: Path of the pseudo-terminal
+        """
+        self.fd: int = os.open(path, os.O_RDWR | os.O_NOCTTY)
+        self.received: bytes = b""
+
+    # ------------------------------------------------------------
+    def write(self, data: bytes):
+        """
+        Send bytes to the simulator
+        :param data: The bytes
+        """
+        os.write(self.fd, data)
+
+    # ------------------------------------------------------------
+    def read_line(self, timeout: float = 2.0) -> str | None:
+        """
+        Read the next line printed by the simulator
+        :param timeout: Seconds to wait for it
+        :return: The line without its line ending, or None if timed out
+        """
+        deadline = time.monotonic() + timeout
+        while b"\n" not in self.received:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self.fd], [], [], remaining)[0]:
+                return None
+            self.received += os.read(self.fd, 1024)
+
+        line, self.received = self.received.split(b"\n", 1)
+        return line.decode().rstrip("\r")
+
+    # ------------------------------------------------------------
+    def close(self):
+        """Close the port"""
+        os.close(self.fd)
+
+
+# ------------------------------------------------------------
+@pytest.fixture
+def simulator():
+    """
+    Simulated Arduino which has finished starting up
+    :return: (ArduinoSimulator, SimulatedPort connected to it)
+    """
+    arduino = ArduinoSimulator(battery_interval=0)
+    port = SimulatedPort(arduino.start())
+
+    while (line := port.read_line()) is not None and not line.startswith("Startup complete"):
+        pass
+
+    yield arduino, port
+
+    port.close()
+    arduino.stop()
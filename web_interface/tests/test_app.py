@@ -0,0 +1,187 @@
+"""
+Tests of the API of the web interface, driving the Arduino simulator
+
+The web interface imports the camera streamer, so these tests only run
+where picamera2 is installed.
+"""
+
+import time
+
+import pytest
+
+pytest.importorskip("picamera2")
+
+from arduino_simulator import ArduinoSimulator
+
+
+# ------------------------------------------------------------
+@pytest.fixture(scope="module")
+def web():
+    """
+    The web interface, connected to a simulated Arduino
+    :return: (app module, ArduinoSimulator)
+    """
+    arduino = ArduinoSimulator(battery_interval=0)
+    port = arduino.start()
+
+    import app
+    app.app.config['AUTOSTART_ARDUINO'] = False
+    assert app.supervisor.connect(port)
+    time.sleep(0.5)     # Until the serial protocol has been negotiated
+
+    yield app, arduino
+
+    app.supervisor.disconnect()
+    arduino.stop()
+
+
+# ------------------------------------------------------------
+@pytest.fixture
+def client(web):
+    """
+    Test client of the web interface, with the robot stopped after each test
+    :return: Flask test client
+    """
+    app, _ = web
+    client = app.app.test_client()
+    yield client
+    client.post('/api/stop')
+
+
+# ------------------------------------------------------------
+def received(arduino: ArduinoSimulator, since: int, timeout: float = 1.0) -> list[str]:
+    """
+    Get the commands the simulator has evaluated, once no more arrive
+    :param arduino: The simulator
+    :param since:   Number of commands evaluated before
+    :param timeout: Seconds to wait at most
+    :return: Commands, e.g. "L30"
+    """
+    deadline = time.monotonic() + timeout
+    count = -1
+    while count != len(arduino.get_commands()) and time.monotonic() < deadline:
+        count = len(arduino.get_commands())
+        time.sleep(0.1)
+
+    return [f"{first_char}{number}" for _, first_char, number in arduino.get_commands()[since:]]
+
+
+# ------------------------------------------------------------
+def wait_for_program(client, timeout: float = 2.0) -> dict:
+    """
+    Wait until the program which is running has ended
+    :param client:  Test client
+    :param timeout: Seconds to wait at most
+    :return: Progress of the program
+    """
+    deadline = time.monotonic() + timeout
+    while (program := client.get('/api/program').json['program'])['state'] in ("running", "paused"):
+        assert time.monotonic() < deadline, 'Program still running'
+        time.sleep(0.01)
+    return program
+
+
+def test_finite_loop_without_wait_is_run(web, client):
+    _, arduino = web
+    since = len(arduino.get_commands())
+    program = [{'op': 'preset', 'preset': 'arms_left'},
+               {'op': 'preset', 'preset': 'arms_right'},
+               {'op': 'loop', 'start': 0, 'times': 3}]
+
+    response = client.post('/api/program', json={'program': program})
+
+    assert response.status_code == 200
+    assert wait_for_program(client)['state'] == "finished"
+    assert received(arduino, since) == ["m0", "b0"] * 3
+
+
+def test_forever_loop_without_wait_is_refused(client):
+    program = [{'op': 'servo', 'servo': 'arm_left', 'value': 80}, {'op': 'loop', 'start': 0, 'times': 0}]
+
+    response = client.post('/api/program', json={'program': program})
+
+    assert response.status_code == 400
+    assert 'repeats forever' in response.json['msg']
+
+
+def test_batch_not_acknowledged_runs_no_later_steps(web, client, monkeypatch):
+    app, arduino = web
+    monkeypatch.setitem(app.app.config, 'SERIAL_ACK_TIMEOUT', 0.1)
+    operations = [{'op': 'servo', 'servo': 'arm_left', 'value': 30},
+                  {'op': 'servo', 'servo': 'arm_right', 'value': 40, 'delay': 0.3}]
+    since = len(arduino.get_commands())
+    arduino.stall(0.3)
+
+    response = client.post('/api/batch?ack=1', json={'operations': operations})
+
+    assert response.status_code == 504
+    assert 'batch' not in response.json
+    time.sleep(0.5)     # Past the end of the stall and the time of the second step
+    assert received(arduino, since) == ["L30"]
+    assert app.batch_runner.get_stats()['pending'] == 0
+
+
+def test_batch_on_closed_port_is_not_connected(web, client, monkeypatch):
+    app, arduino = web
+    monkeypatch.setattr(app.arduino, "send_commands", lambda *args, **kwargs: False)
+    operations = [{'op': 'servo', 'servo': 'arm_left', 'value': 30},
+                  {'op': 'servo', 'servo': 'arm_right', 'value': 40, 'delay': 0.1}]
+
+    response = client.post('/api/batch', json={'operations': operations})
+
+    assert response.status_code == 503
+    assert response.json['msg'] == 'Arduino not connected'
+    assert app.batch_runner.get_stats()['pending'] == 0
+
+
+def test_only_character_devices_are_connected(web, tmp_path):
+    app, _ = web
+    device = app.ArduinoDevice(app.port_registry)
+    path = tmp_path / "ttyFake"
+    path.write_text("")
+
+    assert not device.connect(str(path))
+    assert not device.connect(str(tmp_path))
+    assert app.is_serial_device(app.arduino.port_name)
+
+
+def test_batch_refused_when_scheduler_is_full(web, client, monkeypatch):
+    app, arduino = web
+    monkeypatch.setattr(app.batch_runner, "max_batches", 0)
+    operations = [{'op': 'servo', 'servo': 'arm_left', 'value': 35},
+                  {'op': 'servo', 'servo': 'arm_right', 'value': 45, 'delay': 0.1}]
+    since = len(arduino.get_commands())
+
+    response = client.post('/api/batch', json={'operations': operations})
+
+    assert response.status_code == 429
+    time.sleep(0.2)     # Past the time of the second step
+    assert received(arduino, since) == []
+
+
+def test_batch_is_validated_before_anything_runs(web, client):
+    _, arduino = web
+    operations = [{'op': 'servo', 'servo': 'arm_left', 'value': 35},
+                  {'op': 'servo', 'servo': 'arm', 'value': 45, 'delay': 0.1}]
+    since = len(arduino.get_commands())
+
+    response = client.post('/api/batch', json={'operations': operations})
+
+    assert response.status_code == 400
+    assert [result['status'] for result in response.json['results']] == ["OK", "Error"]
+    time.sleep(0.2)
+    assert received(arduino, since) == []
+
+
+def test_batch_runs_delayed_steps(web, client):
+    _, arduino = web
+    operations = [{'op': 'servo', 'servo': 'arm_left', 'value': 35},
+                  {'op': 'servo', 'servo': 'arm_right', 'value': 45, 'delay': 0.2}]
+    since = len(arduino.get_commands())
+
+    response = client.post('/api/batch', json={'operations': operations})
+
+    assert response.status_code == 200
+    assert [result['status'] for result in response.json['results']] == ["OK", "Scheduled"]
+    time.sleep(0.3)
+    assert received(arduino, since) == ["L35", "R45"]
@@ -0,0 +1,80 @@
+"""
+Tests of the non-blocking Arduino facade of the ASGI serving mode
+"""
+
+import asyncio
+import threading
+from itertools import count
+
+from asgi_server import AsyncArduinoDevice
+
+
+# ================================================================
+class Device:
+    """ArduinoDevice whose commands are echoed by a thread after a delay"""
+
+    def __init__(self, delay: float | None):
+        """
+        Constructor
+        :param delay: Seconds until the commands are echoed, None if they never are
+        """
+        self.delay: float | None = delay
+        self.tickets = count(1)
+        self.forgotten: list[int] = []
+
+    # ------------------------------------------------------------
+    def track_commands(self, commands, watch=True, urgent=False, trace=None, notify=None):
+        """
+        Pretend to queue commands, see ArduinoDevice.track_commands()
+        :return: List of (ticket, event) for each command
+        """
+        tracked = [(next(self.tickets), threading.Event() if watch else None) for _ in commands]
+
+        def echo():
+            for _, event in tracked:
+                event.set()
+                notify()
+
+        if watch and self.delay is not None:
+            threading.Timer(self.delay, echo).start()
+        return tracked
+
+    # ------------------------------------------------------------
+    def forget_commands(self, tickets: list[int]):
+        """
+        Release tickets, see ArduinoDevice.forget_commands()
+        :param tickets: Tickets of the commands
+        """
+        self.forgotten += tickets
+
+
+def test_ack_completes_when_echoed():
+    device = Device(0.05)
+
+    async def send():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        acked = await AsyncArduinoDevice(device).send_commands(["X10", "Y0"], wait_ack=True, timeout=1.0)
+        return acked, loop.time() - start
+
+    acked, elapsed = asyncio.run(send())
+
+    assert acked
+    assert 0.05 <= elapsed < 0.5
+    assert device.forgotten == [1, 2]
+
+
+def test_ack_times_out():
+    device = Device(None)
+
+    acked = asyncio.run(AsyncArduinoDevice(device).send_commands(["X10"], wait_ack=True, timeout=0.05))
+
+    assert not acked
+    assert device.forgotten == [1]
+
+
+def test_no_wait_without_ack():
+    device = Device(None)
+
+    assert asyncio.run(AsyncArduinoDevice(device).send_commands(["X10"]))
+    assert asyncio.run(AsyncArduinoDevice(device).send_commands([], wait_ack=True))
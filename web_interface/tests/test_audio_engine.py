@@ -0,0 +1,185 @@
+"""
+Tests of the loading, mixing and voice handling of the audio engine
+
+The ALSA device is never opened; the engine is marked as running, so
+that play() adds voices without a playback thread.
+"""
+
+import os
+import wave
+from array import array
+
+import pytest
+
+from audio_engine import AudioEngine, Voice
+
+
+# ------------------------------------------------------------
+def write_wav(path, frames: list, channels: int = 1, rate: int = 44100, width: int = 2) -> str:
+    """
+    Write a WAV file
+    :param path:     Path of the file
+    :param frames:   List of frames, each a tuple with one sample per channel
+    :param channels: Number of channels
+    :param rate:     Sample rate
+    :param width:    Bytes per sample
+    :return: Path of the file
+    """
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(channels)
+        f.setsampwidth(width)
+        f.setframerate(rate)
+        if width == 2:
+            f.writeframes(array('h', [sample for frame in frames for sample in frame]).tobytes())
+        else:
+            f.writeframes(bytes(sample & 0xFF for frame in frames for sample in frame))
+    return str(path)
+
+
+def load(engine: AudioEngine, path: str) -> list | None:
+    """
+    Load a file through the clip cache of the engine
+    :param engine: The engine
+    :param path:   Path of the file
+    :return: The samples as a list, or None if the engine cannot play the file
+    """
+    samples = engine._AudioEngine__get_clip(path)
+    return None if samples is None else samples.tolist()
+
+
+def engine_voice(samples: list) -> Voice:
+    """
+    Voice which starts at the beginning of the given samples
+    :param samples: Samples of the clip
+    :return: The voice
+    """
+    return Voice(array('h', samples), 0.0)
+
+
+def test_mono_is_repeated_on_both_channels(tmp_path):
+    path = write_wav(tmp_path / "mono.wav", [(1,), (-2,), (3,)])
+
+    assert load(AudioEngine(), path) == [1, 1, -2, -2, 3, 3]
+
+
+def test_extra_channels_are_dropped(tmp_path):
+    path = write_wav(tmp_path / "quad.wav", [(1, 2, 3, 4), (5, 6, 7, 8)], channels=4)
+
+    assert load(AudioEngine(), path) == [1, 2, 5, 6]
+    assert load(AudioEngine(channels=1), path) == [1, 5]
+
+
+def test_stereo_is_kept(tmp_path):
+    path = write_wav(tmp_path / "stereo.wav", [(1, -1), (32767, -32768)], channels=2)
+
+    assert load(AudioEngine(), path) == [1, -1, 32767, -32768]
+
+
+def test_lower_rate_repeats_frames(tmp_path):
+    path = write_wav(tmp_path / "low.wav", [(1, 10), (2, 20), (3, 30)], channels=2, rate=22050)
+
+    assert load(AudioEngine(), path) == [1, 10, 1, 10, 2, 20, 2, 20, 3, 30, 3, 30]
+
+
+def test_higher_rate_skips_frames(tmp_path):
+    path = write_wav(tmp_path / "high.wav", [(n,) for n in range(8)], rate=88200)
+
+    assert load(AudioEngine(channels=1), path) == [0, 2, 4, 6]
+
+
+def test_channels_and_rate_are_converted_together(tmp_path):
+    path = write_wav(tmp_path / "mono_low.wav", [(7,), (8,)], rate=22050)
+
+    assert load(AudioEngine(), path) == [7, 7, 7, 7, 8, 8, 8, 8]
+
+
+def test_unsupported_files_are_left_to_the_player(tmp_path):
+    engine = AudioEngine()
+    eight_bit = write_wav(tmp_path / "8bit.wav", [(1,), (2,)], width=1)
+    (tmp_path / "clip.mp3").write_bytes(b"ID3 not a wav file")
+
+    assert load(engine, eight_bit) is None
+    assert load(engine, str(tmp_path / "clip.mp3")) is None
+    assert load(engine, str(tmp_path / "missing.wav")) is None
+    assert engine.preload([eight_bit, str(tmp_path / "clip.mp3")]) == 0
+    assert engine.get_status()['clips_loaded'] == 0
+
+
+def test_clips_are_reloaded_when_the_file_changes(tmp_path):
+    engine = AudioEngine(channels=1)
+    path = write_wav(tmp_path / "clip.wav", [(1,)])
+
+    assert engine.preload([path]) == 1
+    first = engine._AudioEngine__get_clip(path)
+    assert engine._AudioEngine__get_clip(path) is first
+
+    write_wav(path, [(2,)])
+    mtime = os.path.getmtime(path) + 1
+    os.utime(path, (mtime, mtime))
+    assert load(engine, path) == [2]
+
+
+def test_invalid_policy_is_rejected():
+    with pytest.raises(ValueError):
+        AudioEngine(policy="queue")
+
+
+def test_software_volume_is_squared():
+    engine = AudioEngine()
+
+    engine.set_volume(50)
+    assert (engine.volume, engine.gain) == (50, 0.25)
+
+    engine.set_volume(150)
+    assert (engine.volume, engine.gain) == (100, 1.0)
+
+
+def test_mix_adds_voices_and_clips():
+    engine = AudioEngine(channels=1)
+    voices = [engine_voice([30000, 100, 5]), engine_voice([30000, -200])]
+
+    data = engine._AudioEngine__mix(voices, 4)
+    assert array('h', data).tolist() == [32767, -100, 5, 0]
+    assert [voice.position for voice in voices] == [4, 4]
+
+
+def test_mix_applies_software_volume():
+    engine = AudioEngine(channels=1)
+    engine.set_volume(50)
+
+    data = engine._AudioEngine__mix([engine_voice([400, -400, 3])], 3)
+    assert array('h', data).tolist() == [100, -100, 0]
+
+
+def test_single_voice_is_padded_with_silence():
+    engine = AudioEngine(channels=1)
+    voice = engine_voice([1, 2, 3])
+
+    assert array('h', engine._AudioEngine__mix([voice], 2)).tolist() == [1, 2]
+    assert array('h', engine._AudioEngine__mix([voice], 2)).tolist() == [3, 0]
+
+
+def test_mix_policy_drops_the_oldest_voice(tmp_path):
+    engine = AudioEngine(channels=1, max_voices=2)
+    engine.running = True
+    paths = [write_wav(tmp_path / f"{n}.wav", [(n,)]) for n in range(3)]
+
+    assert not AudioEngine().play(paths[0])
+    assert all(engine.play(path) for path in paths)
+    assert [voice.samples.tolist() for voice in engine.voices] == [[1], [2]]
+    assert (engine.played, engine.dropped) == (3, 1)
+
+    assert engine.silence() == 2
+    assert engine.get_status()['playing'] == 0
+
+
+def test_preempt_policy_stops_the_playing_voice(tmp_path):
+    engine = AudioEngine(channels=1, policy="preempt")
+    engine.running = True
+    paths = [write_wav(tmp_path / f"{n}.wav", [(n,)]) for n in range(3)]
+
+    for path in paths:
+        assert engine.play(path)
+    assert [voice.samples.tolist() for voice in engine.voices] == [[2]]
+    assert (engine.played, engine.dropped) == (3, 2)
+
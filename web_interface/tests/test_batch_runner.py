@@ -0,0 +1,158 @@
+"""
+Tests of the scheduler for the delayed steps of batches
+"""
+
+import time
+
+from batch_runner import BatchRunner
+from control_lease import ControlLease
+
+
+# ================================================================
+class Steps:
+    """Records when the steps of batches were run"""
+
+    def __init__(self):
+        """Constructor"""
+        self.start: float = time.monotonic()
+        self.run: list[tuple[str, float]] = []
+
+    # ------------------------------------------------------------
+    def step(self, name: str):
+        """
+        Get a step which records that it was run
+        :param name: Name of the step
+        :return: Function run by the scheduler
+        """
+        return lambda: self.run.append((name, time.monotonic() - self.start))
+
+    # ------------------------------------------------------------
+    def names(self) -> list[str]:
+        """
+        Get the steps which were run
+        :return: Names of the steps, in the order they were run
+        """
+        return [name for name, _ in self.run]
+
+
+# ------------------------------------------------------------
+def wait_until_done(runner: BatchRunner, timeout: float = 2.0):
+    """
+    Wait until no batch is waiting any more
+    :param runner:  The scheduler
+    :param timeout: Seconds to wait at most
+    """
+    deadline = time.monotonic() + timeout
+    while runner.get_stats()['pending']:
+        assert time.monotonic() < deadline, 'Batches still pending'
+        time.sleep(0.005)
+
+
+def test_steps_run_at_their_offsets():
+    runner = BatchRunner()
+    steps = Steps()
+
+    assert runner.schedule([(0.05, steps.step("a")), (0.1, steps.step("b")), (0.1, steps.step("c"))]) == 1
+    assert runner.get_stats()['pending'] == 1
+    wait_until_done(runner)
+
+    assert steps.names() == ["a", "b", "c"]
+    assert 0.05 <= steps.run[0][1] < 0.1
+    assert steps.run[1][1] >= 0.1
+
+
+def test_failing_step_ends_only_its_batch():
+    runner = BatchRunner()
+    steps = Steps()
+
+    runner.schedule([(0.01, lambda: 1 / 0), (0.02, steps.step("never"))])
+    runner.schedule([(0.02, steps.step("other"))])
+    wait_until_done(runner)
+
+    assert steps.names() == ["other"]
+
+
+def test_full_scheduler_refuses_batches():
+    runner = BatchRunner(max_batches=2)
+    steps = Steps()
+
+    assert runner.schedule([(0.05, steps.step("a"))]) is not None
+    assert runner.schedule([(0.05, steps.step("b"))]) is not None
+    assert runner.schedule([(0.05, steps.step("c"))]) is None
+    wait_until_done(runner)
+
+    assert sorted(steps.names()) == ["a", "b"]
+    assert runner.schedule([(0.0, steps.step("d"))]) is not None
+
+
+def test_cancel():
+    runner = BatchRunner()
+    steps = Steps()
+
+    batch = runner.schedule([(0.05, steps.step("a"))])
+    runner.schedule([(0.05, steps.step("b"))])
+
+    assert runner.cancel(batch)
+    assert not runner.cancel(batch)
+    wait_until_done(runner)
+    assert steps.names() == ["b"]
+    assert runner.get_stats()['cancelled'] == 1
+
+
+def test_cancel_all():
+    runner = BatchRunner()
+    steps = Steps()
+
+    runner.schedule([(0.0, steps.step("a")), (0.05, steps.step("b"))])
+    runner.schedule([(0.05, steps.step("c"))])
+    time.sleep(0.02)
+
+    assert runner.cancel_all() == 2
+    time.sleep(0.06)
+    assert steps.names() == ["a"]
+
+
+def test_cancel_others_keeps_batches_of_client():
+    lease = ControlLease(2.0, lambda event, data: None)
+    runner = BatchRunner(lease=lease)
+    steps = Steps()
+    lease.admit("a", "A")
+
+    runner.schedule([(0.05, steps.step("a"))], ("a", "A"))
+    runner.schedule([(0.05, steps.step("servo"))])
+    lease.acquire("b", "B", force=True)
+    runner.schedule([(0.05, steps.step("b"))], ("b", "B"))
+
+    assert runner.cancel_others("b") == 1
+    wait_until_done(runner)
+    assert sorted(steps.names()) == ["b", "servo"]
+
+
+def test_batch_holds_lease_until_last_step():
+    lease = ControlLease(0.05, lambda event, data: None)
+    runner = BatchRunner(lease=lease)
+    steps = Steps()
+    lease.admit("a", "A")
+
+    runner.schedule([(0.1, steps.step("a")), (0.2, steps.step("b"))], ("a", "A"))
+    time.sleep(0.15)
+
+    assert lease.admit("b", "B") > 0
+    assert not lease.release("a")
+    wait_until_done(runner)
+    assert steps.names() == ["a", "b"]
+    assert lease.admit("b", "B") == 0
+
+
+def test_batch_stops_when_lease_is_lost():
+    lease = ControlLease(1.0, lambda event, data: None)
+    runner = BatchRunner(lease=lease)
+    steps = Steps()
+    lease.admit("a", "A")
+
+    runner.schedule([(0.05, steps.step("a"))], ("a", "A"))
+    lease.acquire("b", "B", force=True)
+    wait_until_done(runner)
+
+    assert steps.names() == []
+    assert lease.holds("b")
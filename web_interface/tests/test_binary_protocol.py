@@ -0,0 +1,102 @@
+"""
+Tests of the binary pose frames of the serial link
+"""
+
+import pytest
+
+from binary_protocol import (FRAME_START, MOTOR_UNCHANGED, OP_POSE, POSE_CHANNELS, POSE_FRAME_SIZE,
+                             SERVO_UNCHANGED, encode_batch, encode_pose, pose_value)
+
+
+# ------------------------------------------------------------
+@pytest.mark.parametrize("command, value", [
+    ("G55", 55),
+    ("X-20", -20),
+    ("Y100", 100),
+    ("G-1", None),          # Servos only take 0 to 100
+    ("X101", None),
+    ("X-101", None),
+    ("w", None),            # Not a pose channel
+    ("Gabc", None),
+    ("", None),
+])
+def test_pose_value(command, value):
+    assert pose_value(command) == value
+
+
+def test_encode_pose():
+    frame, checksum = encode_pose({'G': 55, 'X': -20})
+
+    assert len(frame) == POSE_FRAME_SIZE
+    assert frame[0] == FRAME_START
+    assert frame[1] == OP_POSE
+    assert frame[2 + POSE_CHANNELS.index('G')] == 55
+    assert frame[2 + POSE_CHANNELS.index('X')] == -20 & 0xFF
+    assert frame[2 + POSE_CHANNELS.index('T')] == SERVO_UNCHANGED & 0xFF
+    assert frame[2 + POSE_CHANNELS.index('Y')] == MOTOR_UNCHANGED & 0xFF
+    assert frame[-1] == checksum
+
+    expected = 0
+    for byte in frame[1:-1]:
+        expected ^= byte
+    assert checksum == expected
+
+
+def test_text_mode_sends_lines():
+    batch = [("G55", 1), ("T30", 2), ("X-20", 3)]
+    data, frames = encode_batch(batch, binary=False)
+
+    assert data == b"G55\nT30\nX-20\n"
+    assert frames == [("G55", [("G55", 1)]), ("T30", [("T30", 2)]), ("X-20", [("X-20", 3)])]
+
+
+def test_run_of_values_is_packed():
+    batch = [("G55", 1), ("T30", 2), ("X-20", 3)]
+    data, frames = encode_batch(batch, binary=True)
+
+    frame, checksum = encode_pose({'G': 55, 'T': 30, 'X': -20})
+    assert data == frame
+    assert frames == [(f"Q{checksum}", batch)]
+
+
+def test_single_value_stays_text():
+    data, frames = encode_batch([("G55", 1)], binary=True)
+
+    assert data == b"G55\n"
+    assert frames == [("G55", [("G55", 1)])]
+
+
+def test_short_run_stays_text():
+    data, frames = encode_batch([("G55", 1), ("T30", 2)], binary=True)
+
+    assert data == b"G55\nT30\n"
+    assert [echo for echo, _ in frames] == ["G55", "T30"]
+
+
+def test_run_ends_at_other_command_and_repeated_channel():
+    batch = [("G55", 1), ("T30", 2), ("B40", 3), ("X-20", 4), ("w", 5),
+             ("G10", 6), ("L20", 7), ("R30", 8), ("Y5", 9), ("G20", 10), ("L30", 11), ("R40", 12), ("X1", 13)]
+    data, frames = encode_batch(batch, binary=True)
+
+    first, first_checksum = encode_pose({'G': 55, 'T': 30, 'B': 40, 'X': -20})
+    second, second_checksum = encode_pose({'G': 10, 'L': 20, 'R': 30, 'Y': 5})
+    third, third_checksum = encode_pose({'G': 20, 'L': 30, 'R': 40, 'X': 1})
+    assert data == first + b"w\n" + second + third
+    assert frames == [(f"Q{first_checksum}", batch[:4]), ("w0", [("w", 5)]),
+                      (f"Q{second_checksum}", batch[5:9]), (f"Q{third_checksum}", batch[9:])]
+
+
+def test_simulator_echoes_frames(simulator):
+    arduino, port = simulator
+    port.write(b"P1\n")
+    assert [port.read_line(), port.read_line()] == ["P1", "Protocol_1"]
+
+    batch = [("G55", 1), ("T30", 2), ("B0", 3), ("X-20", 4), ("w", 5), ("L0", 6), ("R100", 7), ("Y-100", 8)]
+    data, frames = encode_batch(batch, binary=True)
+    assert data[0] == FRAME_START
+
+    port.write(data)
+    echoes = [port.read_line() for _ in frames]
+
+    assert echoes == [echo for echo, _ in frames]
+    assert [first_char for _, first_char, _ in arduino.get_commands()] == ["P", "Q", "w", "Q"]
@@ -0,0 +1,118 @@
+"""
+Tests of the serial send buffer
+"""
+
+import threading
+
+from command_buffer import CommandBuffer
+
+
+# ------------------------------------------------------------
+def drain(buffer: CommandBuffer) -> list[tuple[str, int | None]]:
+    """
+    Take every pending command from a buffer
+    :param buffer: The buffer
+    :return: List of (command, ticket) in send order
+    """
+    return buffer.get_batch(1 << 16, timeout=0)
+
+
+# ------------------------------------------------------------
+def test_newer_value_replaces_pending_value():
+    buffer = CommandBuffer()
+    buffer.put("X10", 1)
+    buffer.put("Y20", 2)
+    buffer.put("X30", 3)
+
+    assert len(buffer) == 2
+    assert drain(buffer) == [("X30", 3), ("Y20", 2)]
+
+
+def test_one_shot_commands_keep_their_order():
+    buffer = CommandBuffer()
+    for command in ("w", "w", "A1"):
+        buffer.put(command)
+
+    assert [command for command, _ in drain(buffer)] == ["w", "w", "A1"]
+
+
+def test_one_shot_command_is_a_barrier_for_coalescing():
+    buffer = CommandBuffer()
+    buffer.put("X10")
+    buffer.put("A1")
+    buffer.put("X20")
+
+    assert [command for command, _ in drain(buffer)] == ["X10", "A1", "X20"]
+
+
+def test_value_sent_is_not_replaced():
+    buffer = CommandBuffer()
+    buffer.put("G10")
+    assert buffer.get(timeout=0) == "G10"
+
+    buffer.put("G20")
+    assert buffer.get(timeout=0) == "G20"
+
+
+def test_urgent_command_goes_first_and_purges_drive_commands():
+    buffer = CommandBuffer()
+    buffer.put("X50")
+    buffer.put("w")
+    buffer.put("G40")
+    buffer.put_urgent("X0")
+
+    assert [command for command, _ in drain(buffer)] == ["X0", "G40"]
+
+
+def test_superseded_commands_are_reported():
+    superseded = []
+    buffer = CommandBuffer(lambda ticket, replacement: superseded.append((ticket, replacement)))
+    buffer.put_many([("X10", 1), ("w", 2), ("G20", 3), ("X30", 4), ("G40", 5)])
+    buffer.put_urgent("X0", 6)
+
+    assert superseded == [(3, 5), (1, 6), (2, 6), (4, 6)]
+    assert drain(buffer) == [("X0", 6), ("G40", 5)]
+
+
+def test_batch_respects_byte_limit_but_returns_one_command():
+    buffer = CommandBuffer()
+    for command in ("G10", "T20", "B30"):
+        buffer.put(command)
+
+    assert [command for command, _ in buffer.get_batch(8, timeout=0)] == ["G10", "T20"]
+    assert [command for command, _ in buffer.get_batch(1, timeout=0)] == ["B30"]
+
+
+def test_put_many_keeps_group_together():
+    buffer = CommandBuffer()
+    buffer.put_many([("X10", 1), ("Y10", 2)])
+
+    assert drain(buffer) == [("X10", 1), ("Y10", 2)]
+
+
+def test_get_times_out_when_empty():
+    assert CommandBuffer().get(timeout=0.01) is None
+
+
+def test_wake_releases_waiting_reader():
+    buffer = CommandBuffer()
+    result = []
+    reader = threading.Thread(target=lambda: result.append(buffer.get(timeout=5)))
+    reader.start()
+
+    buffer.wake()
+    reader.join(timeout=1)
+
+    assert not reader.is_alive()
+    assert result == [None]
+
+
+def test_clear_removes_everything():
+    buffer = CommandBuffer()
+    buffer.put("X10")
+    buffer.put_urgent("Y0")
+    buffer.clear()
+
+    assert len(buffer) == 0
+    buffer.put("X20")
+    assert drain(buffer) == [("X20", None)]
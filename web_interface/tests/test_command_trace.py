@@ -0,0 +1,126 @@
+"""
+Tests of the tracing of serial commands from request to echo
+"""
+
+import types
+
+import pytest
+
+import command_trace
+from command_buffer import CommandBuffer
+from command_trace import CommandTracer, TraceContext
+
+
+# ------------------------------------------------------------
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Clock of the tracer, which only advances when told to
+    :return: Namespace whose 'now' is returned by time.monotonic()
+    """
+    clock = types.SimpleNamespace(now=100.0)
+    monkeypatch.setattr(command_trace, "time", types.SimpleNamespace(monotonic=lambda: clock.now,
+                                                                     time=lambda: 1.7e9 + clock.now))
+    return clock
+
+
+# ------------------------------------------------------------
+@pytest.fixture
+def tracer(clock):
+    """
+    Tracer which traces every request
+    :return: The tracer
+    """
+    return CommandTracer(sample_rate=1.0)
+
+
+def test_stages_of_a_trace(tracer, clock):
+    context = TraceContext("/api/move", received=99.99, server_delay=0.005)
+    trace_id = tracer.begin([1, 2], ["X10", "Y20"], context)
+
+    assert context.trace_id == trace_id
+    clock.now += 0.02
+    tracer.written([1, 2])
+    clock.now += 0.03
+    tracer.echoed([1])
+    assert tracer.get_traces() == []
+
+    clock.now += 0.01
+    tracer.echoed([2])
+    trace, = tracer.get_traces()
+    assert trace['source'] == "/api/move"
+    assert trace['complete'] and not trace['coalesced']
+    assert trace['stages_ms'] == {'server': 5.0, 'handling': 10.0, 'queued': 20.0, 'link': 40.0, 'total': 70.0}
+
+
+def test_sampling(clock):
+    tracer = CommandTracer(sample_rate=0.0)
+
+    assert tracer.begin([1], ["X10"], TraceContext("/api/move")) is None
+    assert tracer.begin([2], ["X10"], TraceContext("/api/move", force=True)) is not None
+
+
+def test_superseded_command_completes_with_its_replacement(tracer, clock):
+    tracer.begin([1], ["X10"], TraceContext("/motor"))
+    clock.now += 0.01
+    tracer.begin([2], ["X20"], TraceContext("/motor"))
+
+    tracer.superseded(1, 2)
+    clock.now += 0.01
+    tracer.written([2])
+    clock.now += 0.02
+    tracer.echoed([2])
+
+    first, second = sorted(tracer.get_traces(), key=lambda trace: trace['id'])
+    assert first['complete'] and first['coalesced']
+    assert first['stages_ms']['total'] == 40.0
+    assert second['complete'] and not second['coalesced']
+    assert second['stages_ms']['total'] == 30.0
+    assert tracer.get_summary()['stages']['total']['count'] == 2
+
+
+def test_superseded_twice(tracer, clock):
+    tracer.begin([1], ["X10"], None)
+    tracer.superseded(1, 2)
+    tracer.superseded(2, 3)
+    tracer.echoed([2])
+    assert tracer.get_traces() == []
+
+    tracer.echoed([3])
+    trace, = tracer.get_traces()
+    assert trace['complete'] and trace['coalesced']
+
+
+def test_buffer_reports_superseded_commands(tracer, clock):
+    buffer = CommandBuffer(tracer.superseded)
+    tracer.begin([1, 2], ["X10", "G20"], None)
+    buffer.put_many([("X10", 1), ("G20", 2)])
+    tracer.begin([3], ["X30"], None)
+    buffer.put("X30", 3)
+    tracer.begin([4], ["X0"], None)
+    buffer.put_urgent("X0", 4)
+
+    tracer.echoed([ticket for _, ticket in buffer.get_batch(100)])
+
+    assert [trace['complete'] for trace in tracer.get_traces()] == [True, True, True]
+
+
+def test_unechoed_trace_expires(tracer, clock):
+    tracer.begin([1], ["X10"], None)
+    tracer.written([1])
+    clock.now += CommandTracer.MAX_AGE
+
+    trace, = tracer.get_traces()
+    assert not trace['complete']
+    assert trace['stages_ms']['total'] is None
+    assert tracer.tickets == {}
+
+
+def test_active_traces_are_limited(clock):
+    tracer = CommandTracer(sample_rate=1.0, max_active=2)
+    for ticket in range(3):
+        tracer.begin([ticket], ["X10"], None)
+
+    oldest = tracer.get_traces()[0]
+    assert oldest['id'] == 1 and not oldest['complete']
+    assert 0 not in tracer.tickets and 2 in tracer.tickets
@@ -0,0 +1,89 @@
+"""
+Tests of the matching of Arduino echoes to the commands sent
+"""
+
+import pytest
+
+from command_tracker import CommandTracker, expected_echo
+
+
+# ------------------------------------------------------------
+@pytest.mark.parametrize("command, echo", [
+    ("X10", "X10"),
+    ("Y-100", "Y-100"),
+    ("G007", "G7"),
+    ("w", "w0"),
+    ("G123456", "G1234"),     # Cut off at MAX_SERIAL_LENGTH like the firmware
+    ("Aabc", "A0"),
+])
+def test_expected_echo(command, echo):
+    assert expected_echo(command) == echo
+
+
+def test_echo_acknowledges_commands_and_releases_waiter():
+    tracker = CommandTracker()
+    event = tracker.watch(1, "X10")
+    tracker.sent("X10", [("X10", 1)])
+
+    assert tracker.received("X10") == [("X10", 1)]
+    assert event.is_set()
+    assert tracker.get_stats()['acked'] == 1
+    assert tracker.get_stats()['in_flight'] == 0
+
+
+def test_other_messages_are_not_echoes():
+    tracker = CommandTracker()
+    tracker.sent("X10", [("X10", 1)])
+
+    assert tracker.received("Battery_80") is None
+    assert tracker.received("Y10") is None
+    assert tracker.get_stats()['in_flight'] == 1
+
+
+def test_skipped_commands_count_as_lost():
+    tracker = CommandTracker()
+    tracker.sent("X10", [("X10", 1)])
+    tracker.sent("Y10", [("Y10", 2)])
+
+    assert tracker.received("Y10") == [("Y10", 2)]
+    assert tracker.get_stats()['lost'] == 1
+
+
+def test_newer_value_acknowledges_coalesced_waiters():
+    tracker = CommandTracker()
+    older = tracker.watch(1, "X10")
+    other_channel = tracker.watch(2, "Y10")
+    tracker.sent("X30", [("X30", 3)])
+
+    tracker.received("X30")
+
+    assert older.is_set()
+    assert not other_channel.is_set()
+
+
+def test_forgotten_waiter_is_not_released():
+    tracker = CommandTracker()
+    event = tracker.watch(1, "w")
+    tracker.forget(1)
+    tracker.sent("w0", [("w", 1)])
+    tracker.received("w0")
+
+    assert not event.is_set()
+
+
+def test_echoes_of_simulator_match(simulator):
+    _, port = simulator
+    tracker = CommandTracker()
+    commands = [("X10", 1), ("Y-20", 2), ("G123456", 3)]
+
+    for command, ticket in commands:
+        tracker.sent(expected_echo(command), [(command, ticket)])
+        port.write(f"{command}\n".encode())
+
+    acknowledged = []
+    while len(acknowledged) < len(commands) and (line := port.read_line()) is not None:
+        acknowledged += tracker.received(line) or []
+
+    assert acknowledged == commands
+    assert tracker.get_stats()['lost'] == 0
+    assert 'rtt_ms' in tracker.get_stats()
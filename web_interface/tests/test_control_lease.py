@@ -0,0 +1,152 @@
+"""
+Tests of the motion lease
+"""
+
+import types
+
+import pytest
+
+import control_lease
+from control_lease import ControlLease
+
+
+# ------------------------------------------------------------
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Clock of the lease, which only advances when told to
+    :return: Namespace whose 'now' is returned by time.monotonic()
+    """
+    clock = types.SimpleNamespace(now=100.0)
+    monkeypatch.setattr(control_lease, "time", types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+# ------------------------------------------------------------
+@pytest.fixture
+def events():
+    """
+    Events published by the lease
+    :return: List of (event type, data)
+    """
+    return []
+
+
+# ------------------------------------------------------------
+@pytest.fixture
+def lease(clock, events):
+    """
+    Lease held for 2 seconds after the last drive command
+    :return: The lease
+    """
+    return ControlLease(2.0, lambda event, data: events.append((event, data)))
+
+
+def test_first_client_takes_lease(lease, events):
+    assert lease.admit("a", "A") == 0
+    assert lease.holds("a")
+    assert not lease.holds("b")
+    assert lease.get_status()['holder'] == "A"
+    assert events[-1][0] == "lease"
+    assert events[-1][1]['state'] == "granted"
+
+
+def test_other_client_refused_until_expiry(lease, clock):
+    lease.admit("a", "A")
+    clock.now += 0.5
+
+    assert lease.admit("b", "B") == pytest.approx(1.5)
+    assert lease.get_status()['rejected'] == 1
+
+    clock.now += 1.5
+    assert lease.admit("b", "B") == 0
+    assert lease.holds("b")
+
+
+def test_drive_commands_renew_lease(lease, clock):
+    lease.admit("a", "A")
+    clock.now += 1.5
+    lease.admit("a", "A")
+    clock.now += 1.5
+
+    assert lease.holds("a")
+    assert lease.admit("b", "B") == pytest.approx(0.5)
+    assert lease.get_status()['granted'] == 1
+
+
+def test_acquire(lease):
+    lease.admit("a", "A")
+
+    assert lease.acquire("b", "B") > 0
+    assert lease.acquire("b", "B", force=True) == 0
+    assert lease.holds("b")
+    assert lease.admit("a", "A") == pytest.approx(2.0)
+
+
+def test_release(lease, events):
+    assert not lease.release("a")
+    lease.admit("a", "A")
+
+    assert not lease.release("b")
+    assert lease.release("a")
+    assert lease.get_status()['holder'] is None
+    assert events[-1][1]['state'] == "released"
+    assert lease.admit("b", "B") == 0
+
+
+def test_renew_keeps_lease_past_next_step(lease, clock):
+    lease.admit("a", "A")
+
+    assert lease.renew("a", 10)
+    clock.now += 11.9
+    assert lease.holds("a")
+    clock.now += 0.1
+    assert not lease.renew("a", 10)
+
+
+def test_renew_fails_for_other_client(lease):
+    lease.admit("a", "A")
+
+    assert not lease.renew("b", 1)
+    assert lease.holds("a")
+    assert not lease.holds("b")
+
+
+def test_runs_keep_lease_until_last_one_ends(lease):
+    lease.admit("a", "A")
+    lease.begin_run("a")
+    lease.begin_run("a")
+
+    assert not lease.release("a")
+    assert lease.get_status()['runs'] == 2
+
+    lease.end_run("a")
+    assert lease.holds("a")
+
+    lease.end_run("a")
+    assert not lease.holds("a")
+    assert lease.get_status()['runs'] == 0
+
+
+def test_runs_counted_per_client(lease):
+    lease.admit("a", "A")
+    lease.begin_run("a")
+    lease.acquire("b", "B", force=True)
+    lease.begin_run("b")
+
+    lease.end_run("a")
+    assert lease.holds("b")
+
+    lease.end_run("b")
+    assert not lease.holds("b")
+
+
+def test_no_arbitration_when_disabled(clock, events):
+    lease = ControlLease(0, lambda event, data: events.append((event, data)))
+
+    assert lease.admit("a", "A") == 0
+    assert lease.admit("b", "B") == 0
+    assert lease.holds("a") and lease.holds("b")
+    assert lease.renew("a", 1)
+    assert not lease.get_status()['enabled']
+    assert events == []
@@ -0,0 +1,127 @@
+"""
+Tests of the keyframe animations
+"""
+
+import json
+import os
+import time
+
+import pytest
+
+from keyframes import UNCHANGED, AnimationEngine, KeyframeAnimation
+
+
+SERVOS: dict = {'head_rotation': 'G', 'arm_left': 'L', 'arm_right': 'R'}
+ANIMATION_FOLDER: str = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "animations")
+
+
+# ------------------------------------------------------------
+def curve(animation: KeyframeAnimation, channel: str) -> list[int]:
+    """
+    Get the sampled values of one channel
+    :param animation: The animation
+    :param channel:   Command letter of the servo
+    :return: Value at each tick
+    """
+    index = animation.channels.index(channel)
+    return [animation.frame(tick)[index] for tick in range(animation.ticks)]
+
+
+def test_linear_sampling():
+    animation = KeyframeAnimation("test", {'tracks': {'arm_left': [[0, 0], [1, 100]]}}, SERVOS, 10)
+
+    assert animation.duration == 1
+    assert animation.ticks == 11
+    assert curve(animation, 'L') == list(range(0, 101, 10))
+
+
+def test_values_held_before_first_and_after_last_keyframe():
+    animation = KeyframeAnimation("test", {'tracks': {
+        'arm_left': [[0.5, 20], [1, 70]],
+        'arm_right': [[0, 40], [0.2, 60]],
+    }}, SERVOS, 10)
+
+    assert curve(animation, 'L')[:6] == [20] * 6
+    assert curve(animation, 'R')[2:] == [60] * 9
+
+
+@pytest.mark.parametrize("easing, values", [
+    ("in", [0, 1, 6, 22, 51, 100]),
+    ("out", [0, 49, 78, 94, 99, 100]),
+    ("in_out", [0, 3, 26, 74, 97, 100]),
+    ("step", [0, 0, 0, 0, 0, 100]),
+])
+def test_easing(easing, values):
+    animation = KeyframeAnimation("test", {'tracks': {'arm_left': [[0, 0], [1, 100, easing]]}}, SERVOS, 5)
+
+    assert curve(animation, 'L') == values
+
+
+def test_servos_without_track_are_unchanged():
+    animation = KeyframeAnimation("test", {'loop': True, 'tracks': {'arm_right': [[0, 30]]}}, SERVOS, 25)
+
+    assert animation.channels == "GLR"
+    assert list(animation.frame(0)) == [UNCHANGED, UNCHANGED, 30]
+    assert animation.get_info() == {'name': "test", 'duration': 0.0, 'loop': True, 'servos': ['arm_right']}
+
+
+@pytest.mark.parametrize("tracks, message", [
+    ({}, "tracks must be a non-empty object"),
+    ({'arm': [[0, 10]]}, 'Invalid servo "arm"'),
+    ({'arm_left': []}, "keyframes must be a non-empty list"),
+    ({'arm_left': [[0]]}, "keyframes must be [seconds, value]"),
+    ({'arm_left': [[1, 10], [0.5, 20]]}, "keyframe times must be non-negative and in order"),
+    ({'arm_left': [[-1, 10]]}, "keyframe times must be non-negative and in order"),
+    ({'arm_left': [[0, 101]]}, "values must be between 0 and 100"),
+    ({'arm_left': [[0, 10, "bounce"]]}, 'invalid easing "bounce"'),
+])
+def test_invalid_keyframes(tracks, message):
+    with pytest.raises(ValueError, match=message.replace("[", r"\[").replace("(", r"\(")):
+        KeyframeAnimation("test", {'tracks': tracks}, SERVOS, 25)
+
+
+def test_shipped_animations_are_valid():
+    servos = dict(SERVOS, neck_top='T', neck_bottom='B', eye_left='E', eye_right='U')
+    engine = AnimationEngine(ANIMATION_FOLDER, servos, lambda commands: True, lambda event, data: None)
+
+    names = [info['name'] for info in engine.get_animations()]
+    assert names == sorted(file[:-5] for file in os.listdir(ANIMATION_FOLDER) if file.endswith(".json"))
+
+
+def test_engine_reloads_changed_file(tmp_path):
+    engine = AnimationEngine(str(tmp_path), SERVOS, lambda commands: True, lambda event, data: None)
+    path = tmp_path / "nod.json"
+
+    path.write_text(json.dumps({'tracks': {'head_rotation': [[0, 10], [1, 20]]}}))
+    assert engine.get("nod").duration == 1
+    assert engine.get("nod") is engine.get("nod")
+
+    path.write_text(json.dumps({'tracks': {'head_rotation': [[0, 10], [2, 20]]}}))
+    os.utime(path, (time.time() + 10, time.time() + 10))
+    assert engine.get("nod").duration == 2
+
+    assert engine.get("missing") is None
+    assert engine.get("../nod") is None
+    path.write_text("[]")
+    os.utime(path, (time.time() + 20, time.time() + 20))
+    with pytest.raises(ValueError):
+        engine.get("nod")
+
+
+def test_engine_sends_changed_values_only():
+    sent = []
+    events = []
+    engine = AnimationEngine(ANIMATION_FOLDER, SERVOS, lambda commands: sent.extend(commands) or True,
+                             lambda event, data: events.append(data['state']), tick_rate=100)
+    animation = KeyframeAnimation("test", {'tracks': {
+        'arm_left': [[0, 0], [0.05, 50, "step"]],
+        'arm_right': [[0, 30]],
+    }}, SERVOS, 100)
+
+    engine.play(animation)
+    deadline = time.monotonic() + 2
+    while engine.get_status()['playing'] is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert sent == ["L0", "R30", "L50"]
+    assert events == ["playing", "finished"]
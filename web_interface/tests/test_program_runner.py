@@ -0,0 +1,202 @@
+"""
+Tests of the server-side runner of Codeblock programs
+"""
+
+import math
+import time
+
+import pytest
+
+from control_lease import ControlLease
+from program_runner import ProgramRunner, ProgramStep, program_duration
+
+
+# ================================================================
+class Robot:
+    """Records what a program sends to the robot"""
+
+    def __init__(self):
+        """Constructor"""
+        self.sent: list[str] = []
+        self.events: list[dict] = []
+
+    # ------------------------------------------------------------
+    def send(self, commands: list[str]) -> bool:
+        """
+        Record serial commands
+        :param commands: The commands
+        :return: True, they are always queued
+        """
+        self.sent.extend(commands)
+        return True
+
+    # ------------------------------------------------------------
+    def stop(self):
+        """Record stopping the motors"""
+        self.sent.append("stop")
+
+    # ------------------------------------------------------------
+    def publish(self, event: str, data: dict):
+        """
+        Record a progress event
+        :param event: Event type
+        :param data:  Progress of the program
+        """
+        self.events.append(data)
+
+
+# ------------------------------------------------------------
+def step(command: str = "", wait: float = 0.0, jump: tuple[int, int] | None = None, action=None) -> ProgramStep:
+    """
+    Build a program step
+    :param command: Serial command of the step, "" for none
+    :param wait:    Seconds until the next step
+    :param jump:    (first step, times) if the step ends a loop
+    :param action:  Function run at the start of the step
+    :return: The step
+    """
+    return ProgramStep("test", None, [command] if command else [], action, wait, jump)
+
+
+# ------------------------------------------------------------
+def wait_for(runner: ProgramRunner, states: tuple = ("finished", "aborted", "failed"), timeout: float = 2.0) -> dict:
+    """
+    Wait until a program has reached a state
+    :param runner:  The runner
+    :param states:  States to wait for
+    :param timeout: Seconds to wait at most
+    :return: Status of the program
+    """
+    deadline = time.monotonic() + timeout
+    while (status := runner.get_status())['state'] not in states:
+        assert time.monotonic() < deadline, f'Program still {status["state"]}'
+        time.sleep(0.005)
+    return status
+
+
+def test_program_duration():
+    assert program_duration([step(wait=1), step(wait=0.5)]) == 1.5
+    assert program_duration([step(wait=1), step(wait=0.5), step(jump=(1, 4)), step(wait=2)]) == 5
+    assert program_duration([step(wait=1), step(wait=1), step(jump=(1, 3)), step(jump=(0, 2))]) == 8
+    assert program_duration([step(wait=1), step(jump=(0, 0))]) == math.inf
+    assert program_duration([step(), step(jump=(0, 0))]) == 0
+
+
+def test_steps_run_in_order_at_their_deadlines():
+    robot = Robot()
+    runner = ProgramRunner(robot.send, robot.stop, robot.publish)
+
+    started = time.monotonic()
+    assert runner.start([step("X10", 0.05), step("X0", 0.05), step("G20")]) == 1
+    status = wait_for(runner)
+
+    assert time.monotonic() - started >= 0.1
+    assert robot.sent == ["X10", "X0", "G20"]
+    assert status['state'] == "finished"
+    assert status['step'] == 2
+    assert robot.events[-1]['state'] == "finished"
+
+
+def test_only_one_program_at_a_time():
+    robot = Robot()
+    runner = ProgramRunner(robot.send, robot.stop, robot.publish)
+
+    assert runner.start([step(wait=0.1)]) == 1
+    assert runner.start([step()]) is None
+    wait_for(runner)
+    assert runner.start([step()]) == 2
+
+
+def test_loops_repeat_their_body():
+    robot = Robot()
+    runner = ProgramRunner(robot.send, robot.stop, robot.publish)
+    program = [step("G1"), step("T1"), step("L1"), step(jump=(1, 3)), step("B1", jump=(0, 2)), step("R1")]
+
+    runner.start(program)
+    wait_for(runner)
+
+    body = ["G1"] + ["T1", "L1"] * 3 + ["B1"]
+    assert robot.sent == body * 2 + ["R1"]
+
+
+def test_loop_without_wait_runs_given_times():
+    robot = Robot()
+    runner = ProgramRunner(robot.send, robot.stop, robot.publish)
+
+    runner.start([step("m"), step("b"), step(jump=(0, 3))])
+
+    assert wait_for(runner)['state'] == "finished"
+    assert robot.sent == ["m", "b"] * 3
+
+
+def test_failing_action_does_not_stop_the_program():
+    robot = Robot()
+    runner = ProgramRunner(robot.send, robot.stop, robot.publish)
+
+    runner.start([step(action=lambda: 1 / 0), step("G1")])
+
+    assert wait_for(runner)['state'] == "finished"
+    assert robot.sent == ["G1"]
+
+
+def test_pause_stops_motors_and_resume_drives_on():
+    robot = Robot()
+    runner = ProgramRunner(robot.send, robot.stop, robot.publish)
+
+    runner.start([step("X50", 0.1), step("X0")])
+    wait_for(runner, ("running",))
+    time.sleep(0.02)
+    assert runner.pause()
+    assert not runner.pause()
+    time.sleep(0.15)
+
+    assert wait_for(runner, ("paused",))['step'] == 0
+    assert robot.sent == ["X50", "stop"]
+
+    assert runner.resume()
+    assert wait_for(runner)['state'] == "finished"
+    assert robot.sent == ["X50", "stop", "X50", "X0"]
+
+
+def test_abort_forever_loop():
+    robot = Robot()
+    runner = ProgramRunner(robot.send, robot.stop, robot.publish)
+
+    runner.start([step("X50", 0.01), step(jump=(0, 0))])
+    assert runner.get_status()['duration'] is None
+    time.sleep(0.05)
+    assert runner.abort()
+
+    assert wait_for(runner)['state'] == "aborted"
+    assert robot.sent.count("X50") > 1
+    assert robot.sent[-1] == "stop"
+    assert not runner.abort()
+
+
+def test_program_holds_motion_lease():
+    robot = Robot()
+    lease = ControlLease(0.05, lambda event, data: None)
+    runner = ProgramRunner(robot.send, robot.stop, robot.publish, lease)
+
+    assert lease.admit("a", "A") == 0
+    runner.start([step("X50", 0.1), step("X0")], ("a", "A"))
+    time.sleep(0.07)
+
+    assert lease.admit("b", "B") > 0
+    assert not lease.release("a")
+    assert wait_for(runner)['state'] == "finished"
+    assert lease.admit("b", "B") == 0
+
+
+def test_program_aborted_when_lease_is_taken_over():
+    robot = Robot()
+    lease = ControlLease(1.0, lambda event, data: None)
+    runner = ProgramRunner(robot.send, robot.stop, robot.publish, lease)
+
+    lease.admit("a", "A")
+    runner.start([step("X50", 0.05), step("X0")], ("a", "A"))
+    lease.acquire("b", "B", force=True)
+
+    assert wait_for(runner)['state'] == "aborted"
+    assert robot.sent == ["X50", "stop"]
+    assert lease.holds("b")
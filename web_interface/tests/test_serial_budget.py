@@ -0,0 +1,60 @@
+"""
+Tests of the token bucket limiting the serial traffic
+"""
+
+import types
+
+import pytest
+
+import serial_budget
+from serial_budget import TokenBucket
+
+
+# ------------------------------------------------------------
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Clock of the token bucket, which only advances when told to
+    :return: Namespace whose 'now' is returned by time.monotonic()
+    """
+    clock = types.SimpleNamespace(now=100.0)
+    monkeypatch.setattr(serial_budget, "time", types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_burst_up_to_capacity(clock):
+    bucket = TokenBucket(rate=100, capacity=50)
+
+    assert bucket.consume(30) == 0
+    assert bucket.consume(20) == 0
+    assert bucket.consume(10) == pytest.approx(0.1)
+    assert bucket.get_stats()['throttled'] == 1
+
+
+def test_refills_at_rate(clock):
+    bucket = TokenBucket(rate=100, capacity=50)
+    bucket.consume(50)
+
+    clock.now += 0.2
+    assert bucket.consume(20) == 0
+    assert bucket.consume(5) == pytest.approx(0.05)
+
+    clock.now += 10
+    assert bucket.get_stats()['available'] == 50
+
+
+def test_large_request_passes_when_full(clock):
+    bucket = TokenBucket(rate=100, capacity=50)
+
+    assert bucket.consume(80) == 0
+    assert bucket.consume(80) == pytest.approx(0.5)
+
+
+def test_stats(clock):
+    bucket = TokenBucket(rate=100, capacity=50)
+    bucket.consume(10)
+
+    stats = bucket.get_stats()
+    assert stats['consumed'] == 10
+    assert stats['available'] == 40
+    assert stats['usage'] == pytest.approx(0.2)
@@ -0,0 +1,153 @@
+"""
+Tests of the recording and replay of control sessions
+"""
+
+import os
+import time
+
+import pytest
+
+from session_log import (AUDIO, COMMANDS, EXTENSION, HEADER, SPEECH, URGENT_COMMANDS, LogEntry,
+                         SessionPlayer, SessionRecorder, read_log)
+
+
+# ------------------------------------------------------------
+def record(recorder: SessionRecorder, name: str) -> str:
+    """
+    Record a short session
+    :param recorder: The recorder
+    :param name:     Name of the recording
+    :return: Path of the recording
+    """
+    assert recorder.start(name)
+    recorder.record_commands(["X10", "Y20"])
+    time.sleep(0.05)
+    recorder.record(AUDIO, "/sounds/beep.wav")
+    recorder.record(SPEECH, "Wall-é")
+    recorder.record_commands(["X0", "Y0"], urgent=True)
+    assert recorder.stop()['entries'] == 4
+    return recorder.get_path(name)
+
+
+# ------------------------------------------------------------
+def wait_until_done(player: SessionPlayer, timeout: float = 2.0):
+    """
+    Wait until a replay has ended
+    :param player:  The player
+    :param timeout: Seconds to wait at most
+    """
+    deadline = time.monotonic() + timeout
+    while player.get_status()['replaying'] is not None:
+        assert time.monotonic() < deadline, 'Replay still running'
+        time.sleep(0.005)
+
+
+def test_recording_round_trip(tmp_path):
+    recorder = SessionRecorder(str(tmp_path))
+    before = time.time()
+
+    started, entries = read_log(record(recorder, "show"))
+
+    assert before - 1 <= started <= time.time()
+    assert [(entry.type, entry.payload) for entry in entries] == [
+        (COMMANDS, "X10\nY20"), (AUDIO, "/sounds/beep.wav"), (SPEECH, "Wall-é"), (URGENT_COMMANDS, "X0\nY0")]
+    assert entries[0].time < 0.05 <= entries[1].time < 1
+    assert [recording['name'] for recording in recorder.get_recordings()] == ["show"]
+
+
+def test_nothing_recorded_while_stopped(tmp_path):
+    recorder = SessionRecorder(str(tmp_path))
+    recorder.record_commands(["X10"])
+
+    assert recorder.stop() is None
+    assert recorder.get_status() == {'recording': None}
+    assert recorder.get_recordings() == []
+
+
+def test_recording_names(tmp_path):
+    recorder = SessionRecorder(str(tmp_path))
+    record(recorder, "show")
+
+    with pytest.raises(ValueError, match="already exists"):
+        recorder.start("show")
+    with pytest.raises(ValueError):
+        recorder.start("../show")
+    assert recorder.get_path("../show") is None
+    assert recorder.get_path("missing") is None
+
+
+def test_only_one_recording_at_a_time(tmp_path):
+    recorder = SessionRecorder(str(tmp_path))
+
+    assert recorder.start("first")
+    assert not recorder.start("second")
+    recorder.stop()
+
+
+def test_truncated_log_is_read_up_to_last_entry(tmp_path):
+    path = record(SessionRecorder(str(tmp_path)), "show")
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    for cut in (len(data) - 1, len(data) - 9):
+        with open(path, 'wb') as f:
+            f.write(data[:cut])
+        assert [entry.type for entry in read_log(path)[1]] == [COMMANDS, AUDIO, SPEECH]
+
+    with open(path, 'wb') as f:
+        f.write(data[:HEADER.size])
+    assert read_log(path)[1] == []
+
+
+def test_other_files_are_not_recordings(tmp_path):
+    path = tmp_path / ("other" + EXTENSION)
+
+    path.write_bytes(b"WLO")
+    with pytest.raises(ValueError):
+        read_log(str(path))
+
+    path.write_bytes(b"RIFF" + bytes(20))
+    with pytest.raises(ValueError):
+        read_log(str(path))
+
+
+def test_replay_with_original_timing():
+    replayed = []
+    events = []
+    player = SessionPlayer({COMMANDS: lambda payload: replayed.append((payload, time.monotonic()))},
+                           lambda event, data: events.append(data['state']))
+    entries = [LogEntry(0.0, COMMANDS, "X10"), LogEntry(0.1, AUDIO, "beep.wav"), LogEntry(0.2, COMMANDS, "X0")]
+
+    start = time.monotonic()
+    assert player.play("show", entries, speed=2.0)
+    assert not player.play("show", entries)
+    wait_until_done(player)
+
+    assert [payload for payload, _ in replayed] == ["X10", "X0"]
+    assert 0.1 <= replayed[1][1] - start < 0.2
+    assert events == ["playing", "finished"]
+    assert player.get_status()['entry'] == 3
+
+
+def test_stop_replay():
+    replayed = []
+    player = SessionPlayer({COMMANDS: replayed.append}, lambda event, data: None)
+
+    player.play("show", [LogEntry(0.0, COMMANDS, "X10"), LogEntry(0.2, COMMANDS, "X0")])
+    time.sleep(0.05)
+
+    assert player.stop()
+    assert not player.stop()
+    time.sleep(0.2)
+    assert replayed == ["X10"]
+
+
+def test_queued_entries_are_written_in_order(tmp_path):
+    recorder = SessionRecorder(str(tmp_path))
+    recorder.start("burst")
+    for value in range(500):
+        recorder.record_commands([f"X{value}"])
+    recorder.stop()
+
+    entries = read_log(os.path.join(tmp_path, "burst" + EXTENSION))[1]
+    assert [entry.payload for entry in entries] == [f"X{value}" for value in range(500)]
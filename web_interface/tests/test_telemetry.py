@@ -0,0 +1,74 @@
+"""
+Tests of the parser of the messages printed by the Arduino
+"""
+
+from telemetry import TelemetryParser
+
+
+# ------------------------------------------------------------
+def battery_parser(history: int = 50) -> TelemetryParser:
+    """
+    Parser of the battery level and errors, as registered by ArduinoDevice
+    :param history: Number of events of each type which are kept
+    :return: The parser
+    """
+    parser = TelemetryParser(history)
+    parser.register("Battery_", "battery", lambda message: int(message.split("_")[1]))
+    parser.register("Error", "error")
+    return parser
+
+
+def test_messages_are_dispatched_by_prefix():
+    parser = battery_parser()
+
+    event = parser.parse("Battery_80")
+    assert (event.type, event.message, event.value) == ("battery", "Battery_80", 80)
+    assert parser.parse("Error: Binary frame checksum").type == "error"
+    assert parser.get_stats() == {'counts': {'battery': 1, 'error': 1}, 'unknown': 0, 'parse_errors': 0}
+
+
+def test_unknown_and_invalid_messages_are_counted():
+    parser = battery_parser()
+
+    assert parser.parse("Hello") is None
+    assert parser.parse("Battery_full") is None
+
+    stats = parser.get_stats()
+    assert (stats['unknown'], stats['parse_errors']) == (1, 1)
+    assert [event.message for event in parser.get_events("unknown")] == ["Hello"]
+    assert [event.message for event in parser.get_events("parse_error")] == ["Battery_full"]
+
+
+def test_history_is_limited_per_type():
+    parser = battery_parser(history=3)
+    for level in range(10):
+        parser.parse(f"Battery_{level}")
+    parser.parse("Error")
+
+    assert [event.value for event in parser.get_events("battery")] == [7, 8, 9]
+    assert [event.value for event in parser.get_events("battery", limit=2)] == [8, 9]
+    assert [event.type for event in parser.get_events()][-1] == "error"
+    assert parser.get_stats()['counts']['battery'] == 10
+
+
+def test_listeners_receive_events():
+    parser = battery_parser()
+    received = []
+    parser.add_listener(received.append)
+
+    parser.parse("Battery_55")
+    parser.remove_listener(received.append)
+    parser.parse("Battery_56")
+
+    assert [event.value for event in received] == [55]
+
+
+def test_simulator_battery_messages(simulator):
+    arduino, port = simulator
+    parser = battery_parser()
+    arduino.battery_interval = 0.05
+
+    while not parser.get_events("battery") and (line := port.read_line()) is not None:
+        parser.parse(line)
+
+    assert parser.get_events("battery")[0].value == arduino.battery_level